@@ -1,7 +1,19 @@
+import os
 from fastapi import Request
-from core.db import get_conn
+from core.db import get_conn, after_commit
+from core.db_async import get_aconn
+from core.audit_writer import writer
 from typing import Optional
 
+# 1 = audit() encola y el hilo de core.audit_writer inserta por lotes (COPY)
+AUDIT_BUFFERED = os.getenv("AUDIT_BUFFERED", "1") == "1"
+
+_AUDIT_SQL = """
+    INSERT INTO cat_facturas.auditoria 
+    (correo, descripcion, accion, log_accion, seccion, id_sec)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
 def build_log(request: Request, extra: str = "") -> str:
     ip = request.headers.get("x-forwarded-for") or (request.client.host if request.client else "unknown")
     ua = request.headers.get("user-agent", "unknown")
@@ -10,6 +22,16 @@ def build_log(request: Request, extra: str = "") -> str:
         base = f"{base} {extra}"
     return base[:255]
 
+def _audit_params(correo, accion, descripcion, log_accion, seccion, id_sec) -> tuple:
+    return (
+        (correo or "ANONIMO")[:100],
+        (descripcion or "")[:200],
+        (accion or "")[:20],
+        (log_accion or "")[:255],
+        (seccion[:50] if seccion else None),
+        (str(id_sec)[:200] if id_sec else None),
+    )
+
 def audit(
     correo: str,
     accion: str,
@@ -18,29 +40,43 @@ def audit(
     seccion: Optional[str] = None,
     id_sec: Optional[str] = None
 ) -> None:
+    row = _audit_params(correo, accion, descripcion, log_accion, seccion, id_sec)
 
-    sql = """
-        INSERT INTO cat_facturas.auditoria 
-        (correo, descripcion, accion, log_accion, seccion, id_sec)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """
+    if AUDIT_BUFFERED:
+        # dentro de unit_of_work() sólo se encola si la transacción hace commit
+        after_commit(lambda: writer.submit(row))
+        return
 
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute(
-                    sql,
-                    (
-                        (correo or "ANONIMO")[:100],
-                        (descripcion or "")[:200],
-                        (accion or "")[:20],
-                        (log_accion or "")[:255],
-                        (seccion[:50] if seccion else None),
-                        (id_sec[:200] if id_sec else None),
-                    ),
-                )
+                cur.execute(_AUDIT_SQL, row)
             conn.commit()
 
     except Exception as e:
         print("Error en audit():", str(e))
         raise
+
+async def audit_async(
+    correo: str,
+    accion: str,
+    descripcion: str,
+    log_accion: str,
+    seccion: Optional[str] = None,
+    id_sec: Optional[str] = None
+) -> None:
+    """Igual que audit() pero sin bloquear el event loop (cola o pool async)."""
+    row = _audit_params(correo, accion, descripcion, log_accion, seccion, id_sec)
+
+    if AUDIT_BUFFERED and writer.submit_nowait(row):
+        return
+
+    try:
+        async with get_aconn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(_AUDIT_SQL, row)
+            await conn.commit()
+
+    except Exception as e:
+        print("Error en audit_async():", str(e))
+        raise
@@ -0,0 +1,182 @@
+# core/audit_writer.py
+"""
+Escritor de auditoría en segundo plano: audit() sólo encola la fila y un hilo la
+inserta por lotes con COPY en cat_facturas.auditoria.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from core.db import get_conn
+
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))  # segundos
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_PUT_TIMEOUT = float(os.getenv("AUDIT_PUT_TIMEOUT", "0.5"))       # espera si la cola está llena
+AUDIT_MAX_RETRIES = 3
+
+_COPY_SQL = """
+    COPY cat_facturas.auditoria (correo, descripcion, accion, log_accion, seccion, id_sec)
+    FROM STDIN
+"""
+
+
+def copy_rows(rows: List[tuple]) -> None:
+    """Inserta filas de auditoría en una sola transacción con COPY."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            with cur.copy(_COPY_SQL) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        conn.commit()
+
+
+class AuditWriter:
+    """
+    Cola acotada + hilo de vaciado.
+    - flush por tamaño (AUDIT_BATCH_SIZE) o por tiempo (AUDIT_FLUSH_INTERVAL)
+    - si la cola está llena, submit() espera AUDIT_PUT_TIMEOUT y luego escribe directo (no se pierden filas)
+    - stop() vacía todo lo pendiente antes de regresar; después las filas se escriben directo
+      (un hilo nuevo sería daemon y perdería lo encolado al salir del intérprete)
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=AUDIT_QUEUE_MAX)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False  # stop() ya corrió: no se vuelve a arrancar solo
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "flushes": 0,
+            "direct_writes": 0,
+            "failed_batches": 0,
+            "dropped": 0,
+            "last_flush_ms": 0.0,
+            "last_batch": 0,
+        }
+
+    # -----------------------------
+    # API
+    # -----------------------------
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._closed = True
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout)
+        # lo que haya quedado (p. ej. encolado durante el apagado)
+        self._drain_all()
+
+    def submit(self, row: tuple) -> None:
+        if self._closed:
+            # apagado: escribe directo en el hilo del request
+            copy_rows([row])
+            self._stats["direct_writes"] += 1
+            return
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put(row, timeout=AUDIT_PUT_TIMEOUT)
+            self._stats["enqueued"] += 1
+        except queue.Full:
+            # backpressure: escribe directo en el hilo del request
+            copy_rows([row])
+            self._stats["direct_writes"] += 1
+
+    def submit_nowait(self, row: tuple) -> bool:
+        """Para el event loop: no bloquea; regresa False si la cola está llena o ya se apagó."""
+        if self._closed:
+            return False
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(row)
+            self._stats["enqueued"] += 1
+            return True
+        except queue.Full:
+            return False
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "queued": self._queue.qsize(),
+            "queue_max": AUDIT_QUEUE_MAX,
+            "running": self._thread is not None and self._thread.is_alive(),
+        }
+
+    # -----------------------------
+    # Hilo de vaciado
+    # -----------------------------
+    def _take_batch(self, first_timeout: float) -> List[tuple]:
+        batch: List[tuple] = []
+        try:
+            batch.append(self._queue.get(timeout=first_timeout))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while len(batch) < AUDIT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[tuple]) -> None:
+        for attempt in range(1, AUDIT_MAX_RETRIES + 1):
+            t0 = time.perf_counter()
+            try:
+                copy_rows(batch)
+                self._stats["written"] += len(batch)
+                self._stats["flushes"] += 1
+                self._stats["last_batch"] = len(batch)
+                self._stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                return
+            except Exception as e:
+                self._stats["failed_batches"] += 1
+                print(f"Error en audit writer (intento {attempt}/{AUDIT_MAX_RETRIES}):", str(e))
+                time.sleep(min(0.5 * attempt, 2.0))
+        self._stats["dropped"] += len(batch)
+        print(f"Audit writer: se descartan {len(batch)} filas tras {AUDIT_MAX_RETRIES} intentos:", batch)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take_batch(first_timeout=AUDIT_FLUSH_INTERVAL)
+            if batch:
+                self._flush(batch)
+        self._drain_all()
+
+    def _drain_all(self) -> None:
+        while True:
+            batch: List[tuple] = []
+            while len(batch) < AUDIT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+
+writer = AuditWriter()
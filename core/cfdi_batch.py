@@ -0,0 +1,95 @@
+# core/cfdi_batch.py
+"""
+Validación de CFDI por lote.
+- expand_uploads: separa los XML de los archivos subidos (XML sueltos o ZIP)
+- validate_many: reparte XML/XSD/timbre al pool de procesos (core.executors.run_cpu)
+Las búsquedas en BD (RFC/UUID) se hacen en services.cfdi_service.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import zipfile
+from typing import Any, Dict, Iterable, List, Tuple
+
+from core import executors
+from core.cfdi_core import build_validation_checklist
+
+CFDI_LOTE_MAX_FILES = int(os.getenv("CFDI_LOTE_MAX_FILES", "1000"))
+CFDI_LOTE_MAX_FILE_BYTES = int(os.getenv("CFDI_LOTE_MAX_FILE_BYTES", str(5 * 1024 * 1024)))  # 5 MB por XML
+CFDI_LOTE_STREAM_MIN = int(os.getenv("CFDI_LOTE_STREAM_MIN", "50"))  # a partir de aquí responde NDJSON
+CFDI_LOTE_CHUNK = int(os.getenv("CFDI_LOTE_CHUNK", "100"))           # archivos por bloque en NDJSON
+
+
+class LoteError(ValueError):
+    """Lote rechazado completo (p. ej. demasiados archivos)."""
+
+
+def check_xml(name: str, xml_bytes: bytes) -> Dict[str, Any]:
+    """Corre en el worker: checklist XML/XSD/timbre de un archivo."""
+    try:
+        res = build_validation_checklist(xml_bytes)
+    except Exception as e:
+        res = {"xml_ok": False, "xsd_ok": False, "timbre_ok": False, "messages": [f"Error al validar: {e}"]}
+    res["file"] = name
+    return res
+
+
+async def validate_many(items: List[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+    """Valida en paralelo (pool de procesos); conserva el orden de items."""
+    if not items:
+        return []
+    return list(await asyncio.gather(*(executors.run_cpu(check_xml, name, data) for name, data in items)))
+
+
+# -----------------------------
+# Archivos del lote
+# -----------------------------
+def _rejected(name: str, msg: str) -> Dict[str, Any]:
+    return {
+        "file": name, "ok": False,
+        "xml_ok": False, "xsd_ok": False, "timbre_ok": False, "rfc_ok": False, "uuid_ok": False,
+        "messages": [msg],
+    }
+
+
+def expand_uploads(uploads: Iterable[Tuple[str, bytes]]) -> Tuple[List[Tuple[str, bytes]], List[Dict[str, Any]]]:
+    """
+    Regresa (items, rechazados):
+    - items: [(nombre, xml_bytes)] a validar; los ZIP se expanden a sus .xml ("lote.zip/a.xml")
+    - rechazados: reporte directo de lo que no se valida (ZIP dañado, archivo muy grande, no XML)
+    """
+    items: List[Tuple[str, bytes]] = []
+    rejected: List[Dict[str, Any]] = []
+
+    def _add(name: str, data: bytes) -> None:
+        if len(items) >= CFDI_LOTE_MAX_FILES:
+            raise LoteError(f"El lote excede el máximo de {CFDI_LOTE_MAX_FILES} archivos.")
+        items.append((name, data))
+
+    for name, data in uploads:
+        if name.lower().endswith(".zip") or zipfile.is_zipfile(io.BytesIO(data)):
+            try:
+                zf = zipfile.ZipFile(io.BytesIO(data))
+            except zipfile.BadZipFile:
+                rejected.append(_rejected(name, "ZIP inválido o dañado."))
+                continue
+            with zf:
+                for info in zf.infolist():
+                    inner = info.filename
+                    if info.is_dir() or inner.startswith("__MACOSX/"):
+                        continue
+                    label = f"{name}/{inner}"
+                    if not inner.lower().endswith(".xml"):
+                        rejected.append(_rejected(label, "No es un archivo XML."))
+                    elif info.file_size > CFDI_LOTE_MAX_FILE_BYTES:
+                        rejected.append(_rejected(label, "El XML excede el tamaño máximo permitido."))
+                    else:
+                        _add(label, zf.read(info))
+        elif len(data) > CFDI_LOTE_MAX_FILE_BYTES:
+            rejected.append(_rejected(name, "El XML excede el tamaño máximo permitido."))
+        else:
+            _add(name, data)
+
+    return items, rejected
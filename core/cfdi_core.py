@@ -2,11 +2,15 @@
 from __future__ import annotations
 
 import os
+import time
+from contextlib import contextmanager
 from datetime import datetime, date
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from lxml import etree
 
+from core import xsd_cache
+
 CFDI_NS = "http://www.sat.gob.mx/cfd/4"
 TFD_NS = "http://www.sat.gob.mx/TimbreFiscalDigital"
 
@@ -20,9 +24,27 @@ def _project_root() -> str:
     return os.getcwd()
 
 def _xsd_base_path() -> str:
-    # XSD/CFD/4 en raíz del proyecto
+    # CFDI_XSD_PATH (app.yaml) o XSD/CFD/4 en raíz del proyecto
+    env_path = os.getenv("CFDI_XSD_PATH")
+    if env_path and os.path.isdir(env_path):
+        return env_path
+    for parts in (("XSD", "CFD", "4"), ("xsd", "cfd", "4")):
+        cand = os.path.join(_project_root(), *parts)
+        if os.path.isdir(cand):
+            return cand
     return os.path.join(_project_root(), "XSD", "CFD", "4")
 
+def _main_xsd_name(base: str) -> str:
+    # wrapper con timbre si existe (recomendado); si no, cfdv40.xsd
+    if os.path.exists(os.path.join(base, "schema_cfdi40_con_timbre.xsd")):
+        return "schema_cfdi40_con_timbre.xsd"
+    return "cfdv40.xsd"
+
+def preload_xsd_cfdi40() -> None:
+    """Compila el esquema CFDI 4.0 por adelantado (arranque de la app)."""
+    base = _xsd_base_path()
+    xsd_cache.get_schema(base, _main_xsd_name(base))
+
 def _guess_main_xsd() -> str:
     """
     Intento robusto:
@@ -41,6 +63,37 @@ def _guess_main_xsd() -> str:
 
     raise FileNotFoundError(f"No se encontró XSD principal en: {base}")
 
+def parse_cfdi(xml_bytes: bytes) -> etree._Element:
+    """Parse único del CFDI; el árbol se reutiliza en todas las etapas de validación."""
+    parser = etree.XMLParser(recover=False, remove_blank_text=True, huge_tree=True)
+    return etree.fromstring(xml_bytes, parser=parser)
+
+@contextmanager
+def detached_for_xsd(doc: etree._Element) -> Iterator[Dict[str, bool]]:
+    """
+    Desprende TimbreFiscalDigital y Addenda del árbol (sin copiarlo ni reparsear)
+    mientras dura el bloque y los vuelve a colocar en su posición al salir.
+    """
+    detached: List[Tuple[etree._Element, etree._Element, int]] = []
+    info = {"timbre_removed": False, "addenda_removed": False}
+    targets = [
+        ("timbre_removed", doc.xpath("//cfdi:Complemento//tfd:TimbreFiscalDigital", namespaces=NS)),
+        ("addenda_removed", doc.findall(".//cfdi:Addenda", namespaces=NS)),
+    ]
+    try:
+        for flag, elems in targets:
+            for el in elems:
+                parent = el.getparent()
+                if parent is None:
+                    continue
+                detached.append((parent, el, parent.index(el)))
+                parent.remove(el)
+                info[flag] = True
+        yield info
+    finally:
+        for parent, el, idx in reversed(detached):
+            parent.insert(idx, el)
+
 def strip_for_xsd_validation(xml_bytes: bytes) -> bytes:
     """
     Emula cfdi.py:
@@ -78,74 +131,41 @@ def validate_xml_well_formed(xml_bytes: bytes) -> Tuple[bool, str]:
     except Exception as e:
         return False, f"XML inválido: {e}"
 
+def validate_xsd_cfdi40_doc(doc: etree._Element) -> Tuple[bool, str, List[str]]:
+    """validate_xsd_cfdi40 sobre un árbol ya parseado (sin timbre/addenda)."""
+    base = _xsd_base_path()
+    xsd_main = _main_xsd_name(base)
+    try:
+        ok, errors = xsd_cache.validate(base, xsd_main, doc)
+        if ok:
+            return True, f"XSD OK usando {xsd_main}", errors
+        return False, "XSD inválido (estructura CFDI no cumple).", errors
+    except Exception as e:
+        return False, f"No fue posible validar XSD: {e}", [str(e)]
+
 def validate_xsd_cfdi40(xml_bytes_no_addenda: bytes):
     """
     Retorna SIEMPRE: (ok: bool, msg: str, errors: list[str])
     Emula validación estable con imports locales (SAT URLs -> archivos).
+    El esquema compilado se reutiliza entre llamadas (core.xsd_cache).
     """
-    base = _xsd_base_path()
-    xsd_main = os.path.join(base, "schema_cfdi40_con_timbre.xsd")
-    if not os.path.exists(xsd_main):
-        # fallback (pero recomendado crear el wrapper)
-        xsd_main = os.path.join(base, "cfdv40.xsd")
-
-    errors = []
-
-    class LocalResolver(etree.Resolver):
-        def resolve(self, url, pubid, context):
-            # 1) si viene URL SAT, tomar basename
-            fname = os.path.basename(url)
-
-            # 2) intenta base/fname
-            cand = os.path.join(base, fname)
-            if os.path.exists(cand):
-                return self.resolve_filename(cand, context)
-
-            # 3) intenta base/url (por si es relativa)
-            cand2 = os.path.join(base, url)
-            if os.path.exists(cand2):
-                return self.resolve_filename(cand2, context)
-
-            # 4) búsqueda recursiva por si están en subcarpetas
-            for root, _, files in os.walk(base):
-                if fname in files:
-                    return self.resolve_filename(os.path.join(root, fname), context)
-
-            return None
-
     try:
-        # Parser XSD con resolver
-        xsd_parser = etree.XMLParser(load_dtd=False, no_network=True)
-        xsd_parser.resolvers.add(LocalResolver())
-
-        schema_doc = etree.parse(xsd_main, parser=xsd_parser)
-        schema = etree.XMLSchema(schema_doc)
-
         # Parse XML (sin addenda) y validar
         xml_parser = etree.XMLParser(recover=False, huge_tree=True)
         doc = etree.fromstring(xml_bytes_no_addenda, parser=xml_parser)
-
-        schema.assertValid(doc)
-        return True, f"XSD OK usando {os.path.basename(xsd_main)}", errors
-
-    except etree.DocumentInvalid as e:
-        # errores detallados del schema
-        try:
-            for err in e.error_log:
-                errors.append(f"[{err.line}:{err.column}] {err.message}")
-        except Exception:
-            errors.append(str(e))
-        return False, "XSD inválido (estructura CFDI no cumple).", errors
-
     except Exception as e:
         return False, f"No fue posible validar XSD: {e}", [str(e)]
+    return validate_xsd_cfdi40_doc(doc)
 
 def extract_cfdi_fields(xml_bytes: bytes) -> Dict[str, Any]:
     """
     Extrae uuid, rfc_emisor, fecha_emision (cfdi:Comprobante@Fecha),
     fecha_timbrado (TimbreFiscalDigital@FechaTimbrado).
     """
-    doc = etree.fromstring(xml_bytes)
+    return extract_cfdi_fields_doc(etree.fromstring(xml_bytes))
+
+def extract_cfdi_fields_doc(doc: etree._Element) -> Dict[str, Any]:
+    """extract_cfdi_fields sobre un árbol ya parseado (con timbre)."""
 
     ##Campos solicitados
     emisor = doc.find(".//cfdi:Emisor", namespaces=NS)
@@ -212,26 +232,39 @@ def build_validation_checklist(xml_bytes: bytes) -> Dict[str, Any]:
     - xml_ok (bien formado)
     - xsd_ok (CFDI 4.0, sin Addenda)
     - timbre_ok (UUID presente)
+    El XML se parsea UNA vez; todas las etapas trabajan sobre el mismo árbol.
+    timings_ms reporta el tiempo por etapa.
     """
-    xml_ok, xml_msg = validate_xml_well_formed(xml_bytes)
-    data = {"xml_ok": xml_ok, "xsd_ok": False, "timbre_ok": False, "messages": []}
-    data["messages"].append(xml_msg)
+    timings: Dict[str, float] = {}
+    data = {"xml_ok": False, "xsd_ok": False, "timbre_ok": False, "messages": [], "timings_ms": timings}
+
+    def _lap(stage: str, t0: float) -> float:
+        t1 = time.perf_counter()
+        timings[stage] = round((t1 - t0) * 1000, 3)
+        return t1
 
-    if not xml_ok:
+    t = time.perf_counter()
+    try:
+        doc = parse_cfdi(xml_bytes)
+        data["xml_ok"] = True
+        data["messages"].append("XML bien formado.")
+    except Exception as e:
+        data["messages"].append(f"XML inválido: {e}")
+        _lap("parse", t)
         return data
+    t = _lap("parse", t)
 
     # extrae campos del original (con timbre)
-    fields = extract_cfdi_fields(xml_bytes)
+    fields = extract_cfdi_fields_doc(doc)
     data["timbre_ok"] = bool(fields.get("uuid"))
     data["messages"].append("Timbre OK." if data["timbre_ok"] else "Timbre NO encontrado (UUID faltante).")
+    t = _lap("extract", t)
 
-    # valida XSD con XML sin addenda
+    # valida XSD sin timbre/addenda (se desprenden y se reinsertan)
     try:
-        xml_wo = strip_for_xsd_validation(xml_bytes)
-        res = validate_xsd_cfdi40(xml_wo)
-        ok = res[0]
-        msg = res[1] if len(res) > 1 else ""
-        errors = res[2] if len(res) > 2 else []
+        with detached_for_xsd(doc):
+            t = _lap("detach", t)
+            ok, msg, errors = validate_xsd_cfdi40_doc(doc)
         data["xsd_ok"] = ok
         data["messages"].append(msg)
         if errors:
@@ -239,6 +272,7 @@ def build_validation_checklist(xml_bytes: bytes) -> Dict[str, Any]:
     except Exception as e:
         data["xsd_ok"] = False
         data["messages"].append(f"No fue posible validar XSD: {e}")
+    _lap("xsd", t)
 
     data["extracted"] = {
         "uuid": fields.get("uuid"),
@@ -252,5 +286,5 @@ def build_validation_checklist(xml_bytes: bytes) -> Dict[str, Any]:
         "isr":fields.get("isr"),
         "importe_pago":fields.get("importe_pago"),
     }
-    #print(data["extracted"])
+    timings["total"] = round(sum(timings.values()), 3)
     return data
@@ -3,11 +3,13 @@ from __future__ import annotations
 
 from typing import Any, Dict, Optional, Tuple
 from lxml import etree
-from urllib.parse import urlparse
 import base64
 import os
 import re
 
+from core import xsd_cache
+from core.cfdi_core import detached_for_xsd
+
 # -----------------------------
 # Timbre validators (TimbreFiscalDigital 1.1)
 # -----------------------------
@@ -41,23 +43,6 @@ def validar_timbre(timbre_elem: etree._Element) -> Dict[str, str]:
     return res
 
 
-# -----------------------------
-# XSD local resolver
-# -----------------------------
-class LocalResolver(etree.Resolver):
-    """Resuelve imports/includes de XSD usando archivos locales."""
-    def __init__(self, xsd_path: str):
-        super().__init__()
-        self.xsd_path = xsd_path
-
-    def resolve(self, system_url, public_id, context):
-        filename = os.path.basename(urlparse(system_url).path)
-        full_path = os.path.join(self.xsd_path, filename)
-        if os.path.exists(full_path):
-            return self.resolve_filename(full_path, context)
-        return None
-
-
 def _parse_xml(xml_bytes: bytes) -> Tuple[bool, Optional[etree._Element], str]:
     try:
         doc = etree.fromstring(xml_bytes)
@@ -66,51 +51,15 @@ def _parse_xml(xml_bytes: bytes) -> Tuple[bool, Optional[etree._Element], str]:
         return False, None, f"XML inválido: {str(e)}"
 
 
-def _strip_for_xsd(doc: etree._Element) -> Tuple[etree._Element, Dict[str, bool]]:
-    """Copia profunda y remueve timbre/addenda SOLO para validar XSD."""
-    info = {"addenda_removed": False, "timbre_removed": False}
-    xsd_doc = etree.fromstring(etree.tostring(doc))  # deep copy
-
-    ns = {
-        "cfdi": "http://www.sat.gob.mx/cfd/4",
-        "tfd": "http://www.sat.gob.mx/TimbreFiscalDigital",
-    }
-
-    # remover timbre antes de validar XSD CFDI
-    for tfd in xsd_doc.xpath("//cfdi:Complemento//tfd:TimbreFiscalDigital", namespaces=ns):
-        parent = tfd.getparent()
-        if parent is not None:
-            parent.remove(tfd)
-            info["timbre_removed"] = True
-
-    # remover addenda antes de validar XSD CFDI
-    for addenda in xsd_doc.xpath("//cfdi:Addenda", namespaces={"cfdi": ns["cfdi"]}):
-        parent = addenda.getparent()
-        if parent is not None:
-            parent.remove(addenda)
-            info["addenda_removed"] = True
-
-    return xsd_doc, info
-
-
 def _validate_xsd_cfdi(xsd_doc: etree._Element, xsd_base_path: str) -> Tuple[bool, str]:
-    """Valida contra cfdv40.xsd usando resolver local."""
+    """Valida contra cfdv40.xsd (esquema compilado y cacheado en core.xsd_cache)."""
     try:
-        parser = etree.XMLParser(no_network=True)
-        parser.resolvers.add(LocalResolver(xsd_base_path))
-
         xsd_file = os.path.join(xsd_base_path, "cfdv40.xsd")
         if not os.path.exists(xsd_file):
             return False, f"No se encontró cfdv40.xsd en: {xsd_base_path}"
 
-        with open(xsd_file, "rb") as f:
-            schema_root = etree.XML(f.read(), parser)
-
-        schema = etree.XMLSchema(schema_root)
-        schema.assertValid(xsd_doc)
-        return True, ""
-    except etree.DocumentInvalid as e:
-        return False, str(e)
+        ok, errors = xsd_cache.validate(xsd_base_path, "cfdv40.xsd", xsd_doc)
+        return ok, "; ".join(errors)
     except Exception as e:
         return False, str(e)
 
@@ -156,9 +105,9 @@ def validate_cfdi_40(xml_bytes: bytes, xsd_base_path: str) -> Dict[str, Any]:
     if report["addenda_present"]:
         report["messages"].append("ℹ️ Addenda detectada: se excluye de la validación XSD pero se guarda completa")
 
-    # XSD CFDI 4.0 (sin timbre y sin addenda)
-    xsd_doc, _info = _strip_for_xsd(doc)
-    ok_xsd, xsd_err = _validate_xsd_cfdi(xsd_doc, xsd_base_path)
+    # XSD CFDI 4.0 (sin timbre y sin addenda; se desprenden del mismo árbol y se reinsertan)
+    with detached_for_xsd(doc):
+        ok_xsd, xsd_err = _validate_xsd_cfdi(doc, xsd_base_path)
     if not ok_xsd:
         report["errors"].append(xsd_err)
         report["messages"].append("❌ XSD CFDI 4.0 inválido")
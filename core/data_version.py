@@ -0,0 +1,32 @@
+# core/data_version.py
+"""
+Versión de datos (por proceso) de las tablas del listado de facturas.
+Las escrituras llaman touch() y los cachés que dependen de esos datos
+(conteos del listado, exportaciones) incluyen version() en su llave.
+Otras instancias no se enteran: por eso esos cachés también tienen TTL.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Dict
+
+from core.db import after_commit
+
+FACTURAS = "facturas"  # cfdi, orden_suministro y catálogos que se unen en el listado
+
+_versions: Dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def _bump(name: str) -> None:
+    with _lock:
+        _versions[name] = _versions.get(name, 0) + 1
+
+
+def touch(name: str = FACTURAS) -> None:
+    """Marca datos modificados; dentro de unit_of_work se aplica al hacer commit."""
+    after_commit(lambda: _bump(name))
+
+
+def version(name: str = FACTURAS) -> int:
+    return _versions.get(name, 0)
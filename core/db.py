@@ -1,11 +1,223 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Optional
+
 import psycopg
+from psycopg.pq import TransactionStatus
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 
 DB_DSN = os.getenv("DB_DSN", "")
 
-def get_conn() -> psycopg.Connection:
-    if not DB_DSN:
-        raise RuntimeError("DB_DSN no está configurado. Define la variable de entorno DB_DSN.")
-    return psycopg.connect(DB_DSN, row_factory=dict_row)
+# Pool por proceso. Con max_instances=10 en app.yaml, el máximo de conexiones
+# hacia Postgres es DB_POOL_MAX * instancias (default 10 * 10 = 100).
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))      # segundos
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))         # espera máx. por conexión
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+# Métricas propias de adquisición (el pool sólo reporta acumulados)
+_acq_lock = threading.Lock()
+_acq = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "in_use": 0}
+
+
+def get_pool() -> ConnectionPool:
+    """Regresa el pool del proceso; lo crea y abre la primera vez."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            if not DB_DSN:
+                raise RuntimeError("DB_DSN no está configurado. Define la variable de entorno DB_DSN.")
+            _pool = ConnectionPool(
+                DB_DSN,
+                min_size=DB_POOL_MIN,
+                max_size=max(DB_POOL_MIN, DB_POOL_MAX),
+                max_idle=DB_POOL_MAX_IDLE,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                timeout=DB_POOL_TIMEOUT,
+                kwargs={"row_factory": dict_row},
+                check=ConnectionPool.check_connection,  # health check al entregar conexión
+                name="facturas",
+                open=True,
+            )
+    return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def _track_acquire(t0: float) -> None:
+    wait_ms = (time.perf_counter() - t0) * 1000
+    with _acq_lock:
+        _acq["count"] += 1
+        _acq["total_ms"] += wait_ms
+        _acq["max_ms"] = max(_acq["max_ms"], wait_ms)
+        _acq["in_use"] += 1
+
+
+def _track_release() -> None:
+    with _acq_lock:
+        _acq["in_use"] -= 1
+
+
+# -----------------------------
+# Unit of work por request
+# -----------------------------
+class _UnitOfWork:
+    __slots__ = ("conn", "on_commit", "failed")
+
+    def __init__(self) -> None:
+        self.conn: Optional[psycopg.Connection] = None
+        self.on_commit: List[Callable[[], None]] = []
+        self.failed = False  # hubo rollback explícito: ya no se confirma nada
+
+
+class _UowConn:
+    """Conexión compartida del unit of work: commit/close los decide unit_of_work()."""
+
+    def __init__(self, conn: psycopg.Connection, uow: _UnitOfWork):
+        self._conn = conn
+        self._uow = uow
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        # deshace todo el unit of work (no sólo lo de este service): al salir no se
+        # confirma nada ni corren los callbacks de after_commit
+        self._uow.failed = True
+        self._conn.rollback()
+
+    def close(self) -> None:
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+_current_uow: ContextVar[Optional[_UnitOfWork]] = ContextVar("db_unit_of_work", default=None)
+
+
+def _finish_uow(uow: _UnitOfWork) -> bool:
+    """Commit si la transacción sigue sana; regresa si hubo commit (o no hubo conexión)."""
+    conn = uow.conn
+    if conn is None:
+        return not uow.failed
+    if conn.broken or conn.closed:
+        return False
+    # INERROR: alguien atrapó un error de BD; el "commit" sería un rollback del servidor
+    if uow.failed or conn.info.transaction_status == TransactionStatus.INERROR:
+        conn.rollback()
+        return False
+    conn.commit()
+    return True
+
+
+@contextmanager
+def unit_of_work() -> Iterator[None]:
+    """
+    Agrupa todo lo que se haga con get_conn() (services + audit) en UNA conexión y
+    UNA transacción. La conexión se pide al pool hasta el primer get_conn().
+    Commit al salir sin error, rollback si hubo excepción. Anidado = se une al externo.
+    Los callbacks de after_commit sólo corren si el commit ocurrió de verdad (no con la
+    conexión rota, la transacción en error o tras un conn.rollback()).
+    """
+    if _current_uow.get() is not None:
+        yield
+        return
+
+    uow = _UnitOfWork()
+    token = _current_uow.set(uow)
+    try:
+        yield
+        committed = _finish_uow(uow)
+    except BaseException:
+        if uow.conn is not None and not uow.conn.closed:
+            uow.conn.rollback()
+        raise
+    finally:
+        _current_uow.reset(token)
+        if uow.conn is not None:
+            get_pool().putconn(uow.conn)
+            _track_release()
+
+    if committed:
+        for fn in uow.on_commit:
+            fn()
+
+
+def after_commit(fn: Callable[[], None]) -> None:
+    """Ejecuta fn al hacer commit el unit of work activo (se descarta si hay rollback); sin unit of work, de inmediato."""
+    uow = _current_uow.get()
+    if uow is None:
+        fn()
+    else:
+        uow.on_commit.append(fn)
+
+
+@contextmanager
+def get_conn() -> Iterator[psycopg.Connection]:
+    """
+    Conexión prestada del pool. Uso igual que antes:
+        with get_conn() as conn: ...
+    Al salir del bloque hace commit (o rollback si hubo excepción) y la devuelve al pool.
+    Dentro de unit_of_work() regresa la conexión del request y conn.commit() se difiere.
+    """
+    uow = _current_uow.get()
+    if uow is not None:
+        if uow.conn is None:
+            t0 = time.perf_counter()
+            uow.conn = get_pool().getconn()
+            _track_acquire(t0)
+        yield _UowConn(uow.conn, uow)
+        return
+
+    pool = get_pool()
+    t0 = time.perf_counter()
+    with pool.connection() as conn:
+        _track_acquire(t0)
+        try:
+            yield conn
+        finally:
+            _track_release()
+
+
+def pool_stats() -> dict:
+    """Estadísticas del pool para dimensionarlo (espera, en uso, latencia de adquisición)."""
+    if _pool is None:
+        return {"open": False, "min_size": DB_POOL_MIN, "max_size": DB_POOL_MAX}
+
+    stats = _pool.get_stats()
+    with _acq_lock:
+        acq = dict(_acq)
+    return {
+        "open": True,
+        "min_size": _pool.min_size,
+        "max_size": _pool.max_size,
+        "pool_size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "in_use": acq["in_use"],
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": stats.get("requests_num", 0),
+        "requests_queued": stats.get("requests_queued", 0),
+        "requests_timeouts": stats.get("requests_errors", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+        "acquire_count": acq["count"],
+        "acquire_avg_ms": round(acq["total_ms"] / acq["count"], 3) if acq["count"] else 0.0,
+        "acquire_max_ms": round(acq["max_ms"], 3),
+    }
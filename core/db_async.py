@@ -0,0 +1,103 @@
+# core/db_async.py
+"""
+Ruta async hacia Postgres (psycopg AsyncConnection + AsyncConnectionPool) para los
+endpoints de lectura más usados, sin ocupar hilos del threadpool de Starlette.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from core.db import DB_DSN, DB_POOL_MAX_IDLE, DB_POOL_MAX_LIFETIME, DB_POOL_TIMEOUT
+
+# Pool independiente del síncrono: sumar ambos al dimensionar max_connections
+DB_APOOL_MIN = int(os.getenv("DB_APOOL_MIN", "1"))
+DB_APOOL_MAX = int(os.getenv("DB_APOOL_MAX", "10"))
+
+_apool: Optional[AsyncConnectionPool] = None
+_apool_lock: Optional[asyncio.Lock] = None
+
+_acq = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "in_use": 0}
+
+
+async def get_apool() -> AsyncConnectionPool:
+    """Regresa el pool async del proceso; lo crea y abre la primera vez (dentro del event loop)."""
+    global _apool, _apool_lock
+    if _apool is not None:
+        return _apool
+    if _apool_lock is None:
+        _apool_lock = asyncio.Lock()
+    async with _apool_lock:
+        if _apool is None:
+            if not DB_DSN:
+                raise RuntimeError("DB_DSN no está configurado. Define la variable de entorno DB_DSN.")
+            pool = AsyncConnectionPool(
+                DB_DSN,
+                min_size=DB_APOOL_MIN,
+                max_size=max(DB_APOOL_MIN, DB_APOOL_MAX),
+                max_idle=DB_POOL_MAX_IDLE,
+                max_lifetime=DB_POOL_MAX_LIFETIME,
+                timeout=DB_POOL_TIMEOUT,
+                kwargs={"row_factory": dict_row},
+                check=AsyncConnectionPool.check_connection,
+                name="facturas-async",
+                open=False,
+            )
+            await pool.open()
+            _apool = pool
+    return _apool
+
+
+async def close_apool() -> None:
+    global _apool
+    if _apool is not None:
+        await _apool.close()
+        _apool = None
+
+
+@asynccontextmanager
+async def get_aconn() -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    Equivalente async de core.db.get_conn():
+        async with get_aconn() as conn: ...
+    """
+    pool = await get_apool()
+    t0 = time.perf_counter()
+    async with pool.connection() as conn:
+        wait_ms = (time.perf_counter() - t0) * 1000
+        _acq["count"] += 1
+        _acq["total_ms"] += wait_ms
+        _acq["max_ms"] = max(_acq["max_ms"], wait_ms)
+        _acq["in_use"] += 1
+        try:
+            yield conn
+        finally:
+            _acq["in_use"] -= 1
+
+
+def apool_stats() -> dict:
+    if _apool is None:
+        return {"open": False, "min_size": DB_APOOL_MIN, "max_size": DB_APOOL_MAX}
+
+    stats = _apool.get_stats()
+    return {
+        "open": True,
+        "min_size": _apool.min_size,
+        "max_size": _apool.max_size,
+        "pool_size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "in_use": _acq["in_use"],
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": stats.get("requests_num", 0),
+        "requests_queued": stats.get("requests_queued", 0),
+        "requests_timeouts": stats.get("requests_errors", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+        "acquire_count": _acq["count"],
+        "acquire_avg_ms": round(_acq["total_ms"] / _acq["count"], 3) if _acq["count"] else 0.0,
+        "acquire_max_ms": round(_acq["max_ms"], 3),
+    }
@@ -1,13 +1,25 @@
 # core/excel_export.py
 from __future__ import annotations
 
-from datetime import datetime, date
-from io import BytesIO
-from typing import Iterable, Sequence
+import os
+import re
+import tempfile
+from datetime import datetime
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator, Optional, Sequence
 
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
 
+from core.xlsx_stream import WIDTH_SAMPLE_ROWS, column_widths
+
+XLSX_SPOOL_BYTES = int(os.getenv("XLSX_SPOOL_BYTES", str(8 * 1024 * 1024)))  # en memoria; arriba de esto, a disco
+_CHUNK_BYTES = 64 * 1024
+_ILLEGAL_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_BOLD = Font(bold=True)
+
 
 def _safe_str(v):
     # Evita fórmulas en Excel (CSV/Excel injection): si empieza con =, +, -, @ => prefix '
@@ -16,66 +28,62 @@ def _safe_str(v):
     return v
 
 
-def export_xlsx(
-    rows: Sequence[dict],
+def _xlsx_value(v: Any) -> Any:
+    # openpyxl rechaza caracteres de control y fechas con zona; NaN/inf no existen en Excel
+    if isinstance(v, str):
+        return _ILLEGAL_XML.sub("", _safe_str(v))
+    if isinstance(v, datetime) and v.tzinfo is not None:
+        return v.replace(tzinfo=None)
+    if isinstance(v, float) and (v != v or v in (float("inf"), float("-inf"))):
+        return None
+    return v
+
+
+def stream_export_xlsx(
+    rows: Iterable[Sequence[Any]],
     *,
+    headers: Sequence[str],
     sheet_name: str = "Reporte",
-    title: str | None = None,
-    columns: list[tuple[str, str]] | None = None,
-) -> bytes:
+    title: Optional[str] = None,
+    sample_rows: int = WIDTH_SAMPLE_ROWS,
+) -> Iterator[bytes]:
     """
-    rows: lista de dicts.
-    columns: opcional -> lista de (key, header). Si no se manda, usa llaves del primer row.
-    Regresa bytes XLSX listo para enviar como respuesta.
+    XLSX con una hoja write-only de openpyxl (Workbook(write_only=True)): las filas no se
+    retienen, openpyxl las serializa a un temporal y el libro se guarda en un
+    SpooledTemporaryFile (XLSX_SPOOL_BYTES en memoria, el resto en disco).
+    rows: iterable de secuencias en el orden de headers (puede ser un generador, p. ej. un cursor del servidor).
+    Textos con _safe_str; anchos de columna con las primeras sample_rows filas.
+    Es el escritor XLSX de core.stream_export.stream_rows (todas las exportaciones .xlsx).
+    Regresa un generador de chunks del XLSX (para StreamingResponse); el primer chunk
+    sale cuando el libro está completo.
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = sheet_name[:31]  # Excel limita a 31 chars
+    rows = iter(rows)
+    sample = [tuple(_xlsx_value(v) for v in values) for values in islice(rows, sample_rows)]
 
-    r = 1
-    if title:
-        ws.cell(row=r, column=1, value=title)
-        ws.merge_cells(start_row=r, start_column=1, end_row=r, end_column=max(1, (len(columns) if columns else 1)))
-        r += 2
-
-    if not rows:
-        ws.cell(row=r, column=1, value="Sin datos")
-        bio = BytesIO()
-        wb.save(bio)
-        return bio.getvalue()
-
-    # Determina columnas
-    if columns is None:
-        keys = list(rows[0].keys())
-        columns = [(k, k) for k in keys]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(re.sub(r"[\[\]:*?/\\]", " ", sheet_name)[:31] or "Reporte")
+    for i, w in enumerate(column_widths(headers, sample), start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
 
-    # Header
-    for c, (_, header) in enumerate(columns, start=1):
-        ws.cell(row=r, column=c, value=header)
-    r += 1
+    def bold(v: Any) -> WriteOnlyCell:
+        cell = WriteOnlyCell(ws, value=_xlsx_value(v))
+        cell.font = _BOLD
+        return cell
 
-    # Data
-    for row in rows:
-        for c, (key, _) in enumerate(columns, start=1):
-            v = row.get(key)
-            # normaliza fechas
-            if isinstance(v, (datetime, date)):
-                ws.cell(row=r, column=c, value=v)
-            else:
-                ws.cell(row=r, column=c, value=_safe_str(v))
-        r += 1
-
-    # Auto width (simple)
-    for c in range(1, len(columns) + 1):
-        col_letter = get_column_letter(c)
-        max_len = 10
-        for cell in ws[col_letter]:
-            if cell.value is None:
-                continue
-            s = str(cell.value)
-            max_len = max(max_len, len(s[:200]))
-        ws.column_dimensions[col_letter].width = min(max_len + 2, 60)
+    if title:
+        ws.append([bold(title)])
+        ws.append([])
+        if len(headers) > 1:
+            ws.merged_cells.add(f"A1:{get_column_letter(len(headers))}1")
+    ws.append([bold(h) for h in headers])
+    for values in chain(sample, (tuple(_xlsx_value(v) for v in values) for values in rows)):
+        ws.append(values)
 
-    bio = BytesIO()
-    wb.save(bio)
-    return bio.getvalue()
+    with tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_BYTES) as spool:
+        wb.save(spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
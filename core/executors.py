@@ -0,0 +1,206 @@
+# core/executors.py
+"""
+Ejecutores para sacar trabajo bloqueante del event loop en los endpoints async:
+- run_db:  hilos para llamadas síncronas a BD (psycopg, unit_of_work, audit)
+- run_cpu: procesos para XML/XSD (lxml); cada proceso precompila el XSD CFDI 4.0
+- map_cpu: procesos (uno por núcleo) para trabajo por lotes desde hilos de trabajo,
+  p. ej. hashes argon2 de la carga de catálogos; síncrono, fuera del event loop
+Cada uno limita el trabajo pendiente y mide tiempo en cola y de ejecución.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from core.cfdi_core import preload_xsd_cfdi40
+from core.db import DB_POOL_MAX
+
+# hilos de BD: no más que conexiones del pool síncrono (más hilos sólo esperarían conexión)
+EXEC_DB_WORKERS = int(os.getenv("EXEC_DB_WORKERS", str(DB_POOL_MAX)))
+EXEC_DB_MAX_PENDING = int(os.getenv("EXEC_DB_MAX_PENDING", "100"))
+EXEC_CPU_WORKERS = int(os.getenv("EXEC_CPU_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) - 1)))))
+EXEC_CPU_MAX_PENDING = int(os.getenv("EXEC_CPU_MAX_PENDING", "200"))
+EXEC_BATCH_WORKERS = int(os.getenv("EXEC_BATCH_WORKERS", str(os.cpu_count() or 2)))
+
+
+def _init_cpu_worker() -> None:
+    try:
+        preload_xsd_cfdi40()
+    except Exception as e:
+        # se reintenta en la primera validación del proceso
+        print("No fue posible precargar XSD CFDI 4.0 en worker:", str(e))
+
+
+def _timed(fn: Callable, submitted_at: float, args: tuple, kwargs: dict):
+    """Corre en el worker: regresa (resultado, segundos en cola, segundos de ejecución)."""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return result, started - submitted_at, time.time() - started
+
+
+class _Lane:
+    """Un executor + límite de pendientes (semáforo) + métricas."""
+
+    def __init__(self, name: str, factory: Callable[[], Executor], max_pending: int) -> None:
+        self.name = name
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._max_pending = max_pending
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "in_flight": 0, "waiting": 0,
+            "queue_ms_total": 0.0, "queue_ms_max": 0.0, "run_ms_total": 0.0, "run_ms_max": 0.0,
+        }
+
+    def executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._factory()
+        return self._executor
+
+    def shutdown(self) -> None:
+        with self._lock:
+            ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, call: Callable, *args, **kwargs) -> Any:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self._max_pending)
+        st = self._stats
+        st["waiting"] += 1
+        async with self._sem:
+            st["waiting"] -= 1
+            st["submitted"] += 1
+            st["in_flight"] += 1
+            loop = asyncio.get_running_loop()
+            try:
+                result, queued, ran = await loop.run_in_executor(
+                    self.executor(), functools.partial(_timed, call, time.time(), args, kwargs)
+                )
+            except Exception:
+                st["failed"] += 1
+                raise
+            finally:
+                st["in_flight"] -= 1
+        st["completed"] += 1
+        st["queue_ms_total"] += queued * 1000
+        st["queue_ms_max"] = max(st["queue_ms_max"], queued * 1000)
+        st["run_ms_total"] += ran * 1000
+        st["run_ms_max"] = max(st["run_ms_max"], ran * 1000)
+        return result
+
+    def map(self, fn: Callable, *iterables, chunksize: int = 1) -> list:
+        """Versión síncrona (hilos de trabajo): fn sobre iterables, en orden; una llamada = un envío."""
+        st = self._stats
+        with self._lock:
+            st["submitted"] += 1
+            st["in_flight"] += 1
+        started = time.time()
+        try:
+            result = list(self.executor().map(fn, *iterables, chunksize=max(1, chunksize)))
+        except Exception:
+            with self._lock:
+                st["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                st["in_flight"] -= 1
+        ran = (time.time() - started) * 1000
+        with self._lock:
+            st["completed"] += 1
+            st["run_ms_total"] += ran
+            st["run_ms_max"] = max(st["run_ms_max"], ran)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        st = self._stats
+        done = st["completed"]
+        return {
+            "started": self._executor is not None,
+            "max_pending": self._max_pending,
+            "submitted": st["submitted"],
+            "completed": done,
+            "failed": st["failed"],
+            "in_flight": st["in_flight"],
+            "waiting": st["waiting"],
+            "queue_ms_avg": round(st["queue_ms_total"] / done, 3) if done else 0.0,
+            "queue_ms_max": round(st["queue_ms_max"], 3),
+            "run_ms_avg": round(st["run_ms_total"] / done, 3) if done else 0.0,
+            "run_ms_max": round(st["run_ms_max"], 3),
+        }
+
+
+_db = _Lane(
+    "db",
+    lambda: ThreadPoolExecutor(max_workers=EXEC_DB_WORKERS, thread_name_prefix="db-exec"),
+    EXEC_DB_MAX_PENDING,
+)
+# spawn: el proceso padre tiene hilos (pools de BD, audit writer) que no deben heredarse por fork
+_cpu = _Lane(
+    "cpu",
+    lambda: ProcessPoolExecutor(
+        max_workers=EXEC_CPU_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_cpu_worker,
+    ),
+    EXEC_CPU_MAX_PENDING,
+)
+# sin initializer: no necesita el XSD; se crea en el primer uso
+_batch = _Lane(
+    "batch",
+    lambda: ProcessPoolExecutor(
+        max_workers=EXEC_BATCH_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    ),
+    0,
+)
+
+
+async def run_db(fn: Callable, *args, **kwargs) -> Any:
+    """Ejecuta fn en el pool de hilos de BD (con el contexto del request, p. ej. unit_of_work)."""
+    ctx = contextvars.copy_context()
+    return await _db.run(ctx.run, fn, *args, **kwargs)
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    """Ejecuta fn (función de módulo, argumentos serializables) en el pool de procesos."""
+    return await _cpu.run(fn, *args, **kwargs)
+
+
+def map_cpu(fn: Callable, *iterables, chunksize: int = 1) -> list:
+    """Síncrono: reparte fn (función de módulo, argumentos serializables) en el pool por lotes."""
+    return _batch.map(fn, *iterables, chunksize=chunksize)
+
+
+def _noop() -> None:
+    return None
+
+
+def start() -> None:
+    """Arranca los pools por adelantado (el de procesos compila el XSD en cada worker)."""
+    _db.executor()
+    # ProcessPoolExecutor crea sus procesos bajo demanda: una tarea vacía por worker los
+    # levanta ya (spawn + _init_cpu_worker) en vez de en las primeras validaciones
+    cpu = _cpu.executor()
+    for f in [cpu.submit(_noop) for _ in range(EXEC_CPU_WORKERS)]:
+        f.result()
+
+
+def shutdown() -> None:
+    _batch.shutdown()
+    _cpu.shutdown()
+    _db.shutdown()
+
+
+def stats() -> Dict[str, Any]:
+    return {"db": _db.stats(), "cpu": _cpu.stats(), "batch": _batch.stats()}
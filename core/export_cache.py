@@ -0,0 +1,173 @@
+# core/export_cache.py
+"""
+Caché en disco (por instancia) de archivos exportados.
+La llave es un hash de lo que determina el contenido (reporte, formato, filtros
+normalizados, columnas y versión de datos); el archivo se guarda mientras se
+transmite por primera vez y las siguientes peticiones lo leen del disco.
+Acotado por bytes totales (LRU) y TTL.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, Tuple
+
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "facturas_export_cache"))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+EXPORT_CACHE_TTL = float(os.getenv("EXPORT_CACHE_TTL", "3600"))  # segundos
+_READ_CHUNK = 64 * 1024
+
+
+def fingerprint(**parts: Any) -> str:
+    """Hash estable de las partes (se serializan con llaves ordenadas)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ExportCache:
+    def __init__(self, directory: str, max_bytes: int, ttl: float) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()  # key -> (bytes, creado)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "aborted": 0}
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """Archivo abierto de la llave (vigente), o None. Abierto antes de soltar el lock: sobrevive a un evict."""
+        with self._lock:
+            self._load()
+            entry = self._items.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            try:
+                f = open(self._path(key), "rb")
+            except OSError:
+                self._drop(key)
+                self._stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats["hits"] += 1
+            return f
+
+    def read(self, f: BinaryIO) -> Iterator[bytes]:
+        """Chunks de un archivo regresado por open()."""
+        with f:
+            while True:
+                chunk = f.read(_READ_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+
+    def store(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pasa los chunks tal cual y a la vez los escribe al caché; la entrada se registra
+        sólo si el generador se consume completo (si el cliente corta, se descarta).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._load()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        size = 0
+        done = False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            done = True
+        finally:
+            if not done or size > self.max_bytes:
+                if not done:
+                    with self._lock:
+                        self._stats["aborted"] += 1
+                _unlink(tmp)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            os.replace(tmp, self._path(key))
+            self._items[key] = (size, time.time())
+            self._bytes += size
+            self._stats["stored"] += 1
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                old = next(iter(self._items))
+                self._drop(old)
+                self._stats["evicted"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._load()
+            for key in list(self._items):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "dir": self.directory,
+            }
+
+    # -----------------------------
+    # Internos (con _lock tomado)
+    # -----------------------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _drop(self, key: str) -> None:
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[0]
+            _unlink(self._path(key))
+
+    def _load(self) -> None:
+        """Al primer uso retoma los archivos que ya estaban en el directorio (más viejos primero)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        found = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith(".part"):
+                # restos de escrituras interrumpidas (las recientes pueden ser de otro proceso)
+                if time.time() - st.st_mtime > self.ttl:
+                    _unlink(path)
+                continue
+            found.append((st.st_mtime, name, st.st_size))
+        for mtime, name, size in sorted(found):
+            self._items[name] = (size, mtime)
+            self._bytes += size
+
+
+def _unlink(path: str) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_TTL)
@@ -10,6 +10,22 @@ def hash_password(plain: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+def is_password_hash(value: str) -> bool:
+    return bool(value) and pwd_context.identify(value, required=False) is not None
+
+def resolve_password_hash(value: str, current: str | None, rehash: bool = True) -> str:
+    # Hash a guardar: el valor si ya es hash; el actual si la contraseña no cambió;
+    # si no, un hash nuevo (rehash=False regresa el valor tal cual, p. ej. vista previa)
+    if is_password_hash(value):
+        return value
+    if current and is_password_hash(current):
+        try:
+            if verify_password(value, current):
+                return current
+        except ValueError:
+            pass  # hash guardado ilegible: se reemplaza
+    return hash_password(value) if rehash else value
+
 def generate_temp_password(length: int = 12) -> str:
     # Evita caracteres que rompen URLs/regex y confunden
     alphabet = string.ascii_letters + string.digits + "!@#$%&*_-"
@@ -0,0 +1,190 @@
+# core/stream_export.py
+"""
+Exportación tabular en streaming: xlsx | csv | ndjson | parquet.
+Todos reciben filas como secuencias en el orden de headers (p. ej. un generador
+que lee de un cursor del servidor) y regresan un generador de bytes:
+
+    StreamingResponse(stream_rows("csv", rows, headers=cols), media_type=FORMATS["csv"].media_type)
+
+- xlsx: core.excel_export.stream_export_xlsx, textos con _safe_str (Excel injection)
+- csv: UTF-8 con BOM (Excel lo abre con acentos), textos con _safe_str (CSV injection)
+- ndjson: un objeto JSON por fila; fechas ISO, Decimal como número
+- parquet: grupos de filas de PARQUET_ROW_GROUP vía pyarrow; esquema con el primer grupo
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+from core.excel_export import _safe_str, stream_export_xlsx
+from core.xlsx_stream import XLSX_MEDIA_TYPE, StreamSink
+
+PARQUET_ROW_GROUP = int(os.getenv("PARQUET_ROW_GROUP", "20000"))
+_FLUSH_BYTES = 64 * 1024
+
+
+class ExportFormat(NamedTuple):
+    media_type: str
+    extension: str
+
+
+FORMATS: Dict[str, ExportFormat] = {
+    "xlsx": ExportFormat(XLSX_MEDIA_TYPE, "xlsx"),
+    "csv": ExportFormat("text/csv; charset=utf-8", "csv"),
+    "ndjson": ExportFormat("application/x-ndjson", "ndjson"),
+    "parquet": ExportFormat("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def check_format(formato: str) -> str:
+    formato = (formato or "").strip().lower()
+    if formato not in FORMATS:
+        raise ValueError(f"format debe ser uno de: {', '.join(FORMATS)}.")
+    return formato
+
+
+# -----------------------------
+# CSV / NDJSON
+# -----------------------------
+def _csv_value(v: Any) -> Any:
+    if v is None:
+        return ""
+    if isinstance(v, (datetime, date, time)):
+        return v.isoformat()
+    return _safe_str(v)
+
+
+def stream_csv(rows: Iterable[Sequence[Any]], *, headers: Sequence[str]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n")
+    buf.write("\ufeff")
+    writer.writerow(headers)
+    for values in rows:
+        writer.writerow([_csv_value(v) for v in values])
+        if buf.tell() >= _FLUSH_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def _json_default(v: Any) -> Any:
+    if isinstance(v, (datetime, date, time)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return str(v)
+
+
+def stream_ndjson(rows: Iterable[Sequence[Any]], *, headers: Sequence[str]) -> Iterator[bytes]:
+    parts: List[str] = []
+    size = 0
+    for values in rows:
+        line = json.dumps(dict(zip(headers, values)), ensure_ascii=False, default=_json_default) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= _FLUSH_BYTES:
+            yield "".join(parts).encode("utf-8")
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts).encode("utf-8")
+
+
+# -----------------------------
+# Parquet
+# -----------------------------
+_DECIMAL_SCALE = 6
+
+
+def _arrow_type(values: Iterable[Any]):
+    import pyarrow as pa
+
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return pa.bool_()
+        if isinstance(v, int):
+            return pa.int64()
+        if isinstance(v, float):
+            return pa.float64()
+        if isinstance(v, Decimal):
+            return pa.decimal128(38, _DECIMAL_SCALE)
+        if isinstance(v, datetime):
+            return pa.timestamp("us")
+        if isinstance(v, date):
+            return pa.date32()
+        if isinstance(v, time):
+            return pa.time64("us")
+        return pa.string()
+    return pa.string()
+
+
+def _arrow_column(values: List[Any], typ) -> List[Any]:
+    import pyarrow as pa
+
+    if typ == pa.string():
+        return [None if v is None else str(v) for v in values]
+    if pa.types.is_decimal(typ):
+        q = Decimal(1).scaleb(-_DECIMAL_SCALE)
+        return [None if v is None else Decimal(v).quantize(q) for v in values]
+    return values
+
+
+def stream_parquet(
+    rows: Iterable[Sequence[Any]],
+    *,
+    headers: Sequence[str],
+    row_group: int = PARQUET_ROW_GROUP,
+) -> Iterator[bytes]:
+    """Un grupo de filas por bloque de row_group filas; sólo ese bloque vive en memoria."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = iter(rows)
+    sink = StreamSink()
+    schema = None
+    writer: Optional[pq.ParquetWriter] = None
+    try:
+        while True:
+            block = list(islice(rows, row_group))
+            if not block and writer is not None:
+                break
+            columns = list(zip(*block)) if block else [() for _ in headers]
+            if schema is None:
+                schema = pa.schema([(h, _arrow_type(col)) for h, col in zip(headers, columns)])
+                writer = pq.ParquetWriter(sink, schema, compression="snappy")
+            arrays = [pa.array(_arrow_column(list(col), f.type), type=f.type) for col, f in zip(columns, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+            if len(block) < row_group:
+                break
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def stream_rows(
+    formato: str,
+    rows: Iterable[Sequence[Any]],
+    *,
+    headers: Sequence[str],
+    sheet_name: str = "Reporte",
+    title: Optional[str] = None,
+) -> Iterator[bytes]:
+    """Generador de bytes del formato pedido (ver FORMATS); title sólo aplica a xlsx."""
+    formato = check_format(formato)
+    if formato == "xlsx":
+        return stream_export_xlsx(rows, headers=headers, sheet_name=sheet_name, title=title)
+    if formato == "csv":
+        return stream_csv(rows, headers=headers)
+    if formato == "ndjson":
+        return stream_ndjson(rows, headers=headers)
+    return stream_parquet(rows, headers=headers)
@@ -0,0 +1,105 @@
+# core/upload_tickets.py
+"""
+Almacén en memoria (por proceso) de XML ya validados.
+/api/cfdi/validar guarda los bytes + resultado de validación y regresa un ticket
+(SHA-256 del contenido); /api/cfdi/alta lo usa en lugar de volver a subir el archivo.
+Acotado por TTL, número de entradas y bytes totales (LRU).
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+CFDI_TICKET_TTL = float(os.getenv("CFDI_TICKET_TTL", "900"))                         # segundos
+CFDI_TICKET_MAX = int(os.getenv("CFDI_TICKET_MAX", "200"))                           # entradas
+CFDI_TICKET_MAX_BYTES = int(os.getenv("CFDI_TICKET_MAX_BYTES", str(64 * 1024 * 1024)))  # 64 MB
+
+
+class Ticket:
+    __slots__ = ("key", "owner", "data", "result", "expires_at")
+
+    def __init__(self, key: str, owner: str, data: bytes, result: Dict[str, Any], expires_at: float):
+        self.key = key
+        self.owner = owner
+        self.data = data
+        self.result = result
+        self.expires_at = expires_at
+
+
+class TicketStore:
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, Ticket]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"issued": 0, "hits": 0, "misses": 0, "evicted": 0, "expired": 0}
+
+    def put(self, data: bytes, result: Dict[str, Any], owner: str) -> Optional[str]:
+        """Guarda el XML y su validación; regresa el ticket (None si no cabe)."""
+        if len(data) > self.max_bytes:
+            return None
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._pop(key)
+            self._purge_expired()
+            while self._items and (len(self._items) >= self.max_entries or self._bytes + len(data) > self.max_bytes):
+                _, old = self._items.popitem(last=False)
+                self._bytes -= len(old.data)
+                self._stats["evicted"] += 1
+            self._items[key] = Ticket(key, owner, data, result, time.monotonic() + self.ttl)
+            self._bytes += len(data)
+            self._stats["issued"] += 1
+        return key
+
+    def get(self, key: str, owner: str) -> Optional[Ticket]:
+        """Ticket vigente del mismo usuario que lo generó, o None."""
+        with self._lock:
+            t = self._items.get(key or "")
+            if t is not None and t.expires_at <= time.monotonic():
+                self._pop(key)
+                self._stats["expired"] += 1
+                t = None
+            if t is None or t.owner != owner:
+                self._stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats["hits"] += 1
+            return t
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+            }
+
+    # -----------------------------
+    # Internos (con _lock tomado)
+    # -----------------------------
+    def _pop(self, key: str) -> None:
+        t = self._items.pop(key, None)
+        if t is not None:
+            self._bytes -= len(t.data)
+
+    def _purge_expired(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, t in self._items.items() if t.expires_at <= now]:
+            self._pop(key)
+            self._stats["expired"] += 1
+
+
+tickets = TicketStore(CFDI_TICKET_TTL, CFDI_TICKET_MAX, CFDI_TICKET_MAX_BYTES)
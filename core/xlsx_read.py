@@ -0,0 +1,120 @@
+# core/xlsx_read.py
+"""
+Lectura de .xlsx en streaming con openpyxl (read_only): una sola pasada por hoja.
+
+    wb = open_workbook(data)
+    headers, batches = read_sheet(wb["Hoja"])     # encabezados = primera fila
+    for rownos, rows in Prefetch(batches):        # lotes leídos por adelantado en otro hilo
+        ...
+
+Las celdas llegan con tipos de Python (str/int/float/datetime/None); no se arma
+un DataFrame de la hoja completa. Las filas totalmente vacías se omiten.
+"""
+from __future__ import annotations
+
+import os
+import queue
+import threading
+from io import BytesIO
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+XLSX_READ_BATCH = int(os.getenv("XLSX_READ_BATCH", "5000"))     # filas por lote
+XLSX_READ_AHEAD = int(os.getenv("XLSX_READ_AHEAD", "8"))        # lotes en cola por hoja
+
+Batch = Tuple[List[int], List[tuple]]  # (números de fila en Excel, filas)
+
+
+def open_workbook(data: bytes):
+    """Workbook en modo read_only/data_only; cerrar con wb.close() al terminar."""
+    from openpyxl import load_workbook
+
+    return load_workbook(BytesIO(data), read_only=True, data_only=True)
+
+
+def _header_names(first: Optional[Sequence[Any]]) -> List[str]:
+    names = ["" if v is None else str(v) for v in (first or ())]
+    while names and names[-1] == "":
+        names.pop()
+    # duplicados como pandas: X, X.1, X.2
+    seen: dict = {}
+    out = []
+    for n in names:
+        k = seen.get(n, 0)
+        seen[n] = k + 1
+        out.append(n if k == 0 else f"{n}.{k}")
+    return out
+
+
+def _batches(rows: Iterator[tuple], width: int, batch_size: int) -> Iterator[Batch]:
+    rownos: List[int] = []
+    block: List[tuple] = []
+    for rowno, values in enumerate(rows, start=2):
+        if len(values) != width:
+            values = tuple(values[:width]) + (None,) * (width - len(values))
+        if all(v is None for v in values):
+            continue
+        rownos.append(rowno)
+        block.append(values)
+        if len(block) >= batch_size:
+            yield rownos, block
+            rownos, block = [], []
+    if block:
+        yield rownos, block
+
+
+def read_sheet(ws, *, batch_size: int = XLSX_READ_BATCH) -> Tuple[List[str], Iterator[Batch]]:
+    """
+    Encabezados (primera fila) + generador de lotes del resto de la hoja, sobre el mismo
+    recorrido: validar encabezados no obliga a releer la hoja.
+    """
+    rows = ws.iter_rows(values_only=True)
+    headers = _header_names(next(rows, None))
+    return headers, _batches(rows, len(headers), batch_size)
+
+
+class Prefetch:
+    """
+    Consume un iterador en un hilo propio y entrega sus elementos en orden por una cola
+    acotada (maxsize): varias hojas se parsean a la vez mientras se procesa la actual.
+    Las excepciones del hilo se relanzan al consumir. close() detiene el hilo.
+    """
+
+    _END = object()
+
+    def __init__(self, items: Iterable[Any], maxsize: int = XLSX_READ_AHEAD, name: str = "xlsx-read") -> None:
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(items,), name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, items: Iterable[Any]) -> None:
+        try:
+            for item in items:
+                if not self._put((None, item)):
+                    return
+        except BaseException as e:
+            self._put((e, None))
+            return
+        self._put((None, self._END))
+
+    def __iter__(self) -> Iterator[Any]:
+        while True:
+            err, item = self._q.get()
+            if err is not None:
+                raise err
+            if item is self._END:
+                return
+            yield item
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
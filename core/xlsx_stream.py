@@ -0,0 +1,80 @@
+# core/xlsx_stream.py
+"""
+Piezas compartidas de las exportaciones en streaming: media type XLSX, anchos de
+columna con una muestra acotada de filas (core.excel_export), el destino StreamSink
+para escritores que sólo escriben hacia adelante (parquet) y rows_from_dicts.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+WIDTH_SAMPLE_ROWS = 200      # filas usadas para calcular anchos
+
+
+class StreamSink:
+    """Destino no 'seekable' (parquet): acumula bytes hasta que el generador los entrega."""
+
+    def __init__(self) -> None:
+        self._parts: List[bytes] = []
+        self.size = 0
+        self._pos = 0
+        self.closed = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        self.size += len(b)
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        self.size = 0
+        return out
+
+
+def _display_len(v: Any) -> int:
+    if v is None:
+        return 0
+    if isinstance(v, datetime):
+        return 19
+    if isinstance(v, date):
+        return 10
+    return len(str(v)[:200])
+
+
+def column_widths(
+    headers: Sequence[str],
+    sample: Iterable[Sequence[Any]],
+    *,
+    min_width: int = 10,
+    max_width: int = 50,
+) -> List[float]:
+    """Ancho por columna: máximo entre encabezado y la muestra (+2), acotado a [min_width, max_width]."""
+    lens = [len(str(h)) for h in headers]
+    for values in sample:
+        for i, v in enumerate(values):
+            if i < len(lens):
+                lens[i] = max(lens[i], _display_len(v))
+    return [min(max(n + 2, min_width), max_width) for n in lens]
+
+
+def rows_from_dicts(rows: Iterable[dict], keys: Sequence[str]) -> Iterator[Tuple[Any, ...]]:
+    """Adapta un iterable de dicts a tuplas en el orden de keys."""
+    for row in rows:
+        yield tuple(row.get(k) for k in keys)
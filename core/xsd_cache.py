@@ -0,0 +1,119 @@
+# core/xsd_cache.py
+"""
+Cache de esquemas XSD compilados (etree.XMLSchema) por proceso.
+Se compila una vez por (carpeta, xsd principal) y se recompila sólo si cambian
+los archivos .xsd de la carpeta.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+from lxml import etree
+
+# cada cuántos segundos se revisa si cambiaron los .xsd (0 = en cada uso)
+XSD_RELOAD_CHECK = float(os.getenv("XSD_RELOAD_CHECK", "30"))
+
+
+class _IndexResolver(etree.Resolver):
+    """Resuelve imports/includes (URLs SAT o rutas relativas) contra un índice local nombre->ruta."""
+
+    def __init__(self, base: str, index: Dict[str, str]):
+        super().__init__()
+        self.base = base
+        self.index = index
+
+    def resolve(self, url, pubid, context):
+        fname = os.path.basename(urlparse(url).path)
+        path = self.index.get(fname)
+        if path:
+            return self.resolve_filename(path, context)
+
+        cand = os.path.join(self.base, url)
+        if os.path.exists(cand):
+            return self.resolve_filename(cand, context)
+        return None
+
+
+def _scan(base: str) -> Tuple[Dict[str, str], Tuple]:
+    """Índice de .xsd bajo base y huella (ruta, mtime, tamaño) para detectar cambios."""
+    index: Dict[str, str] = {}
+    finger = []
+    for root, _, files in os.walk(base):
+        for fn in sorted(files):
+            if not fn.lower().endswith(".xsd"):
+                continue
+            path = os.path.join(root, fn)
+            index.setdefault(fn, path)
+            st = os.stat(path)
+            finger.append((path, st.st_mtime_ns, st.st_size))
+    return index, tuple(sorted(finger))
+
+
+class _Entry:
+    __slots__ = ("schema", "fingerprint", "checked_at", "lock")
+
+    def __init__(self, schema: etree.XMLSchema, fingerprint: Tuple):
+        self.schema = schema
+        self.fingerprint = fingerprint
+        self.checked_at = time.monotonic()
+        # XMLSchema comparte error_log entre llamadas: una validación a la vez por esquema
+        self.lock = threading.Lock()
+
+
+_cache: Dict[Tuple[str, str], _Entry] = {}
+_cache_lock = threading.Lock()
+
+
+def _compile(base: str, main: str, index: Dict[str, str]) -> etree.XMLSchema:
+    parser = etree.XMLParser(load_dtd=False, no_network=True)
+    parser.resolvers.add(_IndexResolver(base, index))
+    schema_doc = etree.parse(os.path.join(base, main), parser=parser)
+    return etree.XMLSchema(schema_doc)
+
+
+def _get_entry(base: str, main: str) -> _Entry:
+    key = (os.path.abspath(base), main)
+    entry = _cache.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry.checked_at < XSD_RELOAD_CHECK:
+        return entry
+
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and time.monotonic() - entry.checked_at < XSD_RELOAD_CHECK:
+            return entry
+        index, fingerprint = _scan(key[0])
+        if entry is not None and entry.fingerprint == fingerprint:
+            entry.checked_at = time.monotonic()
+            return entry
+        entry = _Entry(_compile(key[0], main, index), fingerprint)
+        _cache[key] = entry
+        return entry
+
+
+def get_schema(base: str, main: str) -> etree.XMLSchema:
+    """Esquema compilado (lo compila la primera vez o si cambiaron los archivos)."""
+    return _get_entry(base, main).schema
+
+
+def validate(base: str, main: str, doc) -> Tuple[bool, List[str]]:
+    """
+    Valida doc (elemento o árbol) contra el esquema cacheado.
+    Regresa (ok, errores "[línea:col] mensaje").
+    """
+    entry = _get_entry(base, main)
+    with entry.lock:
+        ok = entry.schema.validate(doc)
+        if ok:
+            return True, []
+        return False, [f"[{err.line}:{err.column}] {err.message}" for err in entry.schema.error_log]
+
+
+def clear() -> None:
+    with _cache_lock:
+        _cache.clear()
+
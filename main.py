@@ -2,6 +2,13 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 
+from core.db import DB_DSN, get_pool, close_pool
+from core.db_async import get_apool, close_apool
+from core.audit_writer import writer as audit_writer
+from core.cfdi_core import preload_xsd_cfdi40
+from core import executors
+from services import catalogos_jobs_service, export_jobs_service
+
 from routers.auth_router import router as auth_router
 from routers.user_router import router as users_router
 from routers.pages_router import router as pages_router
@@ -33,9 +40,37 @@ from routers.cfdi_api_router import router as cfdi_api_router
 from routers.facturas_listado_api_router import router as facturas_listado_api_router
 from routers.facturas_listado_router  import router as facturas_listado_router
 
+from routers.sistema_api_router import router as sistema_api_router
+
 app = FastAPI(title="Sistema de Facturas - IMSS Bienestar")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.on_event("startup")
+async def _startup():
+    # abre los pools de conexiones al arrancar; sin DB_DSN se difiere al primer uso
+    if DB_DSN:
+        get_pool()
+        await get_apool()
+    audit_writer.start()
+    executors.start()
+    export_jobs_service.start()
+    catalogos_jobs_service.start()
+    try:
+        # compila el XSD CFDI 4.0 una sola vez; si falla se reintenta en la primera validación
+        preload_xsd_cfdi40()
+    except Exception as e:
+        print("No fue posible precargar XSD CFDI 4.0:", str(e))
+
+@app.on_event("shutdown")
+async def _shutdown():
+    # vacía la auditoría pendiente antes de cerrar el pool
+    export_jobs_service.shutdown()
+    catalogos_jobs_service.shutdown()
+    audit_writer.stop()
+    executors.shutdown()
+    close_pool()
+    await close_apool()
+
 ##routers
 app.include_router(auth_router)
 app.include_router(users_router)
@@ -69,4 +104,6 @@ app.include_router(cfdi_router)
 app.include_router(cfdi_api_router)
 
 app.include_router(facturas_listado_api_router)
-app.include_router(facturas_listado_router)
\ No newline at end of file
+app.include_router(facturas_listado_router)
+
+app.include_router(sistema_api_router)
@@ -3,13 +3,13 @@ from fastapi import APIRouter, Request, Query
 from fastapi.responses import JSONResponse
 
 from core.auth import require_admin
-from core.audit import audit, build_log
-from services.auditoria_service import search_auditoria
+from core.audit import audit_async, build_log
+from services.auditoria_service import search_auditoria_async
 
 router = APIRouter(prefix="/api")
 
 @router.get("/auditoria")
-def api_auditoria(
+async def api_auditoria(
     request: Request,
     correo: str | None = Query(default=None),
     accion: str | None = Query(default=None),
@@ -23,7 +23,7 @@ def api_auditoria(
     if not admin:
         return JSONResponse({"detail": "Unauthorized"}, status_code=401)
 
-    result = search_auditoria(
+    result = await search_auditoria_async(
         correo=correo,
         accion=accion,
         q=q,
@@ -33,7 +33,7 @@ def api_auditoria(
         offset=offset,
     )
 
-    audit(
+    await audit_async(
         correo=admin.correo,
         accion="API_AUDIT",
         descripcion="Consulta auditoría (API)",
@@ -6,7 +6,7 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
-from core.db import get_conn
+from core.db import get_conn, unit_of_work
 from core.security import verify_password
 from core.audit import audit, build_log
 from core.auth import serializer, SESSION_COOKIE, get_current_user, require_login
@@ -78,97 +78,99 @@ def do_login(
     correo: str = Form(...),
     password: str = Form(...),
 ):
-    correo = (correo or "").strip().lower()
-    #print(f"[DEBUG] Inicio login - correo recibido: {correo}")
+    # lectura de usuario + auditoría con una sola conexión/transacción
+    with unit_of_work():
+        correo = (correo or "").strip().lower()
+        #print(f"[DEBUG] Inicio login - correo recibido: {correo}")
+
+        # 1) Dominio permitido
+        if not is_allowed_email(correo):
+            #print("[DEBUG] Paso 1: correo no permitido")
+            audit(
+                correo="ANONIMO",
+                accion="LOGIN_FAIL",
+                descripcion="Intento login con correo no permitido",
+                log_accion=build_log(request, extra=f"correo={correo}"),
+            )
+            return templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": "Solo se permite acceso con correo @imssbienestar.gob.mx"},
+                status_code=400,
+            )
+        #print("[DEBUG] Paso 1: dominio permitido OK")
+
+        # 2) Buscar usuario
+        try:
+            row = fetch_user_auth_by_email(correo)
+            #print(f"[DEBUG] Paso 2: usuario encontrado: {row}")
+        except Exception as e:
+            print(f"[DEBUG] Paso 2: ERROR conexión a BD: {e}")
+            return templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": "Error de conexión a la base de datos."},
+                status_code=500,
+            )
+
+        if not row:
+            #print("[DEBUG] Paso 2: usuario no existe")
+            audit(
+                correo=correo,
+                accion="LOGIN_FAIL",
+                descripcion="Intento login: usuario no existe",
+                log_accion=build_log(request),
+            )
+            return templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": "Usuario o contraseña incorrectos."},
+                status_code=401,
+            )
+
+        # 3) Estatus ACTIVO
+        estatus = (row.get("estatus") or "").upper()
+        if estatus != "ACTIVO":
+            #print(f"[DEBUG] Paso 3: usuario INACTIVO - estatus={estatus}")
+            audit(
+                correo=correo,
+                accion="LOGIN_FAIL",
+                descripcion="Intento login: usuario INACTIVO",
+                log_accion=build_log(request),
+            )
+            return templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": "Tu usuario está INACTIVO. Contacta al administrador."},
+                status_code=403,
+            )
+        #print("[DEBUG] Paso 3: estatus ACTIVO OK")
+
+        # 4) Verificar password
+        stored_hash = row.get("pwd") or ""
+        if not stored_hash or not verify_password(password, stored_hash):
+            #print("[DEBUG] Paso 4: contraseña incorrecta")
+            audit(
+                correo=correo,
+                accion="LOGIN_FAIL",
+                descripcion="Intento login: contraseña incorrecta",
+                log_accion=build_log(request),
+            )
+            return templates.TemplateResponse(
+                "login.html",
+                {"request": request, "error": "Usuario o contraseña incorrectos."},
+                status_code=401,
+            )
+       # print("[DEBUG] Paso 4: contraseña OK")
+
+        # 5) Login OK: crear sesión
+        resp = RedirectResponse(url="/home", status_code=302)
+        set_session_cookie(resp, row)
+        #print("[DEBUG] Paso 5: sesión creada, login OK")
 
-    # 1) Dominio permitido
-    if not is_allowed_email(correo):
-        #print("[DEBUG] Paso 1: correo no permitido")
-        audit(
-            correo="ANONIMO",
-            accion="LOGIN_FAIL",
-            descripcion="Intento login con correo no permitido",
-            log_accion=build_log(request, extra=f"correo={correo}"),
-        )
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Solo se permite acceso con correo @imssbienestar.gob.mx"},
-            status_code=400,
-        )
-    #print("[DEBUG] Paso 1: dominio permitido OK")
-
-    # 2) Buscar usuario
-    try:
-        row = fetch_user_auth_by_email(correo)
-        #print(f"[DEBUG] Paso 2: usuario encontrado: {row}")
-    except Exception as e:
-        print(f"[DEBUG] Paso 2: ERROR conexión a BD: {e}")
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Error de conexión a la base de datos."},
-            status_code=500,
-        )
-
-    if not row:
-        #print("[DEBUG] Paso 2: usuario no existe")
         audit(
             correo=correo,
-            accion="LOGIN_FAIL",
-            descripcion="Intento login: usuario no existe",
-            log_accion=build_log(request),
-        )
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Usuario o contraseña incorrectos."},
-            status_code=401,
+            accion="LOGIN",
+            descripcion="Inicio de sesión exitoso",
+            log_accion=build_log(request, extra=f"rol={row.get('rol')}"),
         )
-
-    # 3) Estatus ACTIVO
-    estatus = (row.get("estatus") or "").upper()
-    if estatus != "ACTIVO":
-        #print(f"[DEBUG] Paso 3: usuario INACTIVO - estatus={estatus}")
-        audit(
-            correo=correo,
-            accion="LOGIN_FAIL",
-            descripcion="Intento login: usuario INACTIVO",
-            log_accion=build_log(request),
-        )
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Tu usuario está INACTIVO. Contacta al administrador."},
-            status_code=403,
-        )
-    #print("[DEBUG] Paso 3: estatus ACTIVO OK")
-
-    # 4) Verificar password
-    stored_hash = row.get("pwd") or ""
-    if not stored_hash or not verify_password(password, stored_hash):
-        #print("[DEBUG] Paso 4: contraseña incorrecta")
-        audit(
-            correo=correo,
-            accion="LOGIN_FAIL",
-            descripcion="Intento login: contraseña incorrecta",
-            log_accion=build_log(request),
-        )
-        return templates.TemplateResponse(
-            "login.html",
-            {"request": request, "error": "Usuario o contraseña incorrectos."},
-            status_code=401,
-        )
-   # print("[DEBUG] Paso 4: contraseña OK")
-
-    # 5) Login OK: crear sesión
-    resp = RedirectResponse(url="/home", status_code=302)
-    set_session_cookie(resp, row)
-    #print("[DEBUG] Paso 5: sesión creada, login OK")
-
-    audit(
-        correo=correo,
-        accion="LOGIN",
-        descripcion="Inicio de sesión exitoso",
-        log_accion=build_log(request, extra=f"rol={row.get('rol')}"),
-    )
-    return resp
+        return resp
 
 
 
@@ -178,22 +180,23 @@ def home(request: Request):
     if not user:
         return RedirectResponse(url="/", status_code=302)
 
-    # Solo CAPTURISTA y ADMIN
-    if user.rol == "ADMIN":
-        data = reportes_admin()
-        audit(user.correo, "VIEW", "Home Admin (reportes)", build_log(request))
-        return templates.TemplateResponse(
-            "facturas_listado.html",
-            {"request": request, "user_role": user.rol, "user_name": user.nombre, "user_email": user.correo, **data},
-        )
+    with unit_of_work():
+        # Solo CAPTURISTA y ADMIN
+        if user.rol == "ADMIN":
+            data = reportes_admin()
+            audit(user.correo, "VIEW", "Home Admin (reportes)", build_log(request))
+            return templates.TemplateResponse(
+                "facturas_listado.html",
+                {"request": request, "user_role": user.rol, "user_name": user.nombre, "user_email": user.correo, **data},
+            )
     
-    if user.rol == "CAPTURISTA":
-        reportes = reportes_capturista()
-        audit(user.correo, "VIEW", "Home Capturista (reportes)", build_log(request))
-        return templates.TemplateResponse(
-            "facturas_listado.html",
-            {"request": request, "user_role": user.rol, "user_name": user.nombre, "user_email": user.correo, "reportes": reportes},
-        )
+        if user.rol == "CAPTURISTA":
+            reportes = reportes_capturista()
+            audit(user.correo, "VIEW", "Home Capturista (reportes)", build_log(request))
+            return templates.TemplateResponse(
+                "facturas_listado.html",
+                {"request": request, "user_role": user.rol, "user_name": user.nombre, "user_email": user.correo, "reportes": reportes},
+            )
     
     return RedirectResponse(url="/logout", status_code=302)
 
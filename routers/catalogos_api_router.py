@@ -6,7 +6,9 @@ from fastapi.responses import JSONResponse
 
 from core.auth import require_login
 from core.audit import audit, build_log
-from services.catalogos_service import process_catalogos_excel
+from core.executors import run_db
+from services import catalogos_jobs_service
+from services.catalogos_service import CatalogoImportEnCurso, process_catalogos_excel
 
 router = APIRouter(prefix="/api/catalogos", tags=["catalogos"])
 
@@ -17,7 +19,9 @@ def require_admin(request: Request):
     return user
 
 @router.post("/upload")
-async def upload_catalogos(request: Request, file: UploadFile = File(...)):
+async def upload_catalogos(
+    request: Request, file: UploadFile = File(...), dry_run: bool = False, background: bool = False
+):
     user = require_admin(request)
     if not user:
         return JSONResponse({"detail": "Unauthorized"}, status_code=401)
@@ -28,14 +32,25 @@ async def upload_catalogos(request: Request, file: UploadFile = File(...)):
 
     content = await file.read()
 
+    # carga real en segundo plano: commits por lotes, avance consultable y reanudable
+    if background and not dry_run:
+        return await run_db(submit_catalogos_job, request, user, file.filename or "catalogos.xlsx", content)
+
     try:
-        result = process_catalogos_excel(
+        # fuera del event loop: lectura, BD y hashes argon2 (Usuario) son bloqueantes
+        result = await run_db(
+            process_catalogos_excel,
             excel_bytes=content,
             filename=file.filename or "catalogos.xlsx",
             actor_email=user.correo,
-            request_log=build_log(request)
+            request_log=build_log(request),
+            dry_run=dry_run,
         )
 
+        # la vista previa no escribe nada: no se audita
+        if dry_run:
+            return JSONResponse(result, status_code=200)
+
         audit(
             user.correo,
             "BULK_UPLOAD_CATALOGOS",
@@ -45,6 +60,8 @@ async def upload_catalogos(request: Request, file: UploadFile = File(...)):
 
         return JSONResponse(result, status_code=200)
 
+    except CatalogoImportEnCurso as e:
+        return JSONResponse({"detail": str(e)}, status_code=409)
     except Exception as e:
         tb = traceback.format_exc()
         debug = os.getenv("DEBUG", "0") == "1"
@@ -58,3 +75,65 @@ async def upload_catalogos(request: Request, file: UploadFile = File(...)):
             payload["traceback"] = tb
 
         return JSONResponse(payload, status_code=500)
+
+
+# -----------------------------
+# Importación en segundo plano
+# -----------------------------
+def submit_catalogos_job(request: Request, user, filename: str, content: bytes):
+    """Encola la importación y responde 202 con el trabajo (id, estatus, avance)."""
+    try:
+        job = catalogos_jobs_service.submit_job(user.correo, filename, content)
+    except CatalogoImportEnCurso as e:
+        return JSONResponse({"detail": str(e)}, status_code=409)
+
+    audit(
+        user.correo,
+        "BULK_UPLOAD_CATALOGOS",
+        f"Carga masiva de catálogos en segundo plano: {filename}",
+        build_log(request, extra=f"job={job['id']}"),
+    )
+    return JSONResponse(job, status_code=202)
+
+
+@router.get("/jobs")
+def api_catalogos_jobs(request: Request, limit: int = 20):
+    user = require_admin(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return {"items": catalogos_jobs_service.list_jobs(limit)}
+
+
+@router.get("/jobs/{job_id}")
+def api_catalogos_job(request: Request, job_id: str):
+    user = require_admin(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    job = catalogos_jobs_service.get_job(job_id)
+    if not job:
+        return JSONResponse({"detail": "No encontrado"}, status_code=404)
+    return job
+
+
+@router.post("/jobs/{job_id}/reanudar")
+def api_catalogos_job_reanudar(request: Request, job_id: str):
+    """Reencola un trabajo en ERROR; continúa desde el último lote confirmado."""
+    user = require_admin(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    try:
+        job = catalogos_jobs_service.reanudar_job(job_id)
+    except CatalogoImportEnCurso as e:
+        return JSONResponse({"detail": str(e)}, status_code=409)
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=410)
+    if not job:
+        return JSONResponse({"detail": "No encontrado o no reanudable"}, status_code=404)
+
+    audit(
+        user.correo,
+        "BULK_UPLOAD_CATALOGOS",
+        f"Reanudación de carga de catálogos: {job['archivo']}",
+        build_log(request, extra=f"job={job['id']}"),
+    )
+    return JSONResponse(job, status_code=202)
@@ -2,28 +2,35 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, Request, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from core.db import get_conn
+from fastapi.responses import JSONResponse, StreamingResponse
+from core.db import get_conn, unit_of_work
+from core.db_async import get_aconn
 
+import json
 from datetime import date
-from typing import Optional
+from typing import List, Optional
 
 from core.auth import require_login
-from core.audit import audit, build_log
+from core.audit import audit, audit_async, build_log
+from core import cfdi_batch
+from core.cfdi_core import build_validation_checklist
+from core.executors import run_cpu, run_db
+from core.upload_tickets import tickets
 
 from services.cfdi_service import (
-    list_facturas,
     get_factura_detalle,
-    list_contratos,
-    list_partidas_by_contrato,
-    validate_cfdi,
+    lookup_cfdi,
+    validate_cfdi_lote_async,
     create_factura_and_os,
     update_factura_and_os,
     #delete_factura,
     set_cfdi_estatus,
-    list_est_siaf,
-    list_fiscalizador,
     get_factura_audit,
+    list_facturas_async,
+    list_contratos_async,
+    list_partidas_by_contrato_async,
+    list_est_siaf_async,
+    list_fiscalizador_async,
 )
 
 router = APIRouter(prefix="/api/cfdi", tags=["cfdi_api"])
@@ -35,9 +42,9 @@ def _require_user(request: Request):
     return user
 
 @router.get("")
-def api_list(request: Request, q: str = ""):
+async def api_list(request: Request, q: str = ""):
     _require_user(request)
-    return {"items": list_facturas(q)}
+    return {"items": await list_facturas_async(q)}
 
 @router.get("/{cfdi_id}/audit")
 def api_audit(request: Request, cfdi_id: str):
@@ -58,34 +65,86 @@ def api_detalle(request: Request, cfdi_id: int):
     return {"item": row}
 
 @router.get("/catalogos/contratos")
-def api_contratos(request: Request):
+async def api_contratos(request: Request):
     _require_user(request)
-    return {"items": list_contratos()}
+    return {"items": await list_contratos_async()}
 
 @router.get("/catalogos/contratos/{contrato_id}/partidas")
-def api_partidas(request: Request, contrato_id: int):
+async def api_partidas(request: Request, contrato_id: int):
     _require_user(request)
-    return {"items": list_partidas_by_contrato(contrato_id)}
+    return {"items": await list_partidas_by_contrato_async(contrato_id)}
 
 @router.get("/catalogos/estado_siaf")
-def api_estado_siaf(request: Request):
+async def api_estado_siaf(request: Request):
     _require_user(request)
-    return {"items": list_est_siaf()}
+    return {"items": await list_est_siaf_async()}
 
 @router.get("/catalogos/fiscalizador")
-def api_fiscalizador(request: Request):
+async def api_fiscalizador(request: Request):
     _require_user(request)
-    return {"items": list_fiscalizador()}
+    return {"items": await list_fiscalizador_async()}
 
 @router.post("/validar")
 async def api_validar(request: Request, file: UploadFile = File(...)):
     user = _require_user(request)
     xml_bytes = await file.read()
-    res = validate_cfdi(xml_bytes)
-
-    audit(user.correo, "VALIDAR_CFDI_XML", "Validación XML CFDI (registro facturas)", build_log(request))
+    log = build_log(request)
+    # XML/XSD en el pool de procesos; búsquedas y auditoría en el pool de hilos de BD
+    checklist = await run_cpu(build_validation_checklist, xml_bytes)
+    # el ticket guarda sólo XML/XSD/timbre: RFC/UUID se vuelven a buscar en /alta
+    xml_checklist = {**checklist, "messages": list(checklist.get("messages") or [])}
+
+    def _validar():
+        with unit_of_work():
+            res = lookup_cfdi(checklist)
+            audit(user.correo, "VALIDAR_CFDI_XML", "Validación XML CFDI (registro facturas)", log)
+        return res
+
+    res = await run_db(_validar)
+    # ticket para /alta: evita volver a subir y validar el mismo XML
+    if res.get("xml_ok"):
+        res["ticket"] = tickets.put(xml_bytes, xml_checklist, user.correo)
     return res
 
+@router.post("/validar-lote")
+async def api_validar_lote(request: Request, files: List[UploadFile] = File(...), stream: bool = False):
+    """
+    Valida varios XML (sueltos o en ZIP). Reporte por archivo; con stream=1 o lotes
+    grandes (>= CFDI_LOTE_STREAM_MIN) responde NDJSON: una línea por archivo y al final {"summary": ...}.
+    """
+    user = _require_user(request)
+    uploads = [(f.filename or "archivo.xml", await f.read()) for f in files]
+    try:
+        items, rejected = cfdi_batch.expand_uploads(uploads)
+    except cfdi_batch.LoteError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+    await audit_async(
+        user.correo, "VALIDAR_CFDI_LOTE",
+        f"Validación de lote CFDI ({len(items)} XML, {len(rejected)} rechazados)",
+        build_log(request),
+    )
+
+    summary = {"total": len(items) + len(rejected), "ok": 0, "rechazados": 0}
+
+    def _count(r: dict) -> dict:
+        summary["ok" if r.get("ok") else "rechazados"] += 1
+        return r
+
+    if stream or len(items) >= cfdi_batch.CFDI_LOTE_STREAM_MIN:
+        async def _ndjson():
+            for r in rejected:
+                yield json.dumps(_count(r), ensure_ascii=False, default=str) + "\n"
+            async for r in validate_cfdi_lote_async(items, chunk_size=cfdi_batch.CFDI_LOTE_CHUNK):
+                yield json.dumps(_count(r), ensure_ascii=False, default=str) + "\n"
+            yield json.dumps({"summary": summary}) + "\n"
+
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+    reports = [_count(r) for r in rejected]
+    reports += [_count(r) async for r in validate_cfdi_lote_async(items)]
+    return {"items": reports, "summary": summary}
+
 @router.post("/alta")
 async def api_alta(
     request: Request,
@@ -96,7 +155,8 @@ async def api_alta(
     estatus_os: int = Form(...), #estatus Administrativo
     
     #CFDI
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    ticket: Optional[str] = Form(None), #ticket de /validar (sustituye a file)
     proveedor_id: int = Form(...),
     fecha_recepcion: str = Form(...),#Fecha recepcion CFDI
     monto_partida: float = Form(0),    
@@ -162,90 +222,118 @@ async def api_alta(
 ):    
     
     user = _require_user(request)
-    xml_bytes = await file.read()
+    if not ticket and file is None:
+        return JSONResponse({"ok": False, "message": "Envía el XML (file) o el ticket de /validar."}, status_code=400)
+    staged = tickets.get(ticket, user.correo) if ticket else None
+    if staged is None and file is None:
+        # ticket vencido o generado en otra instancia: el cliente reenvía el XML
+        return JSONResponse(
+            {"ok": False, "ticket_expired": True, "message": "La validación expiró, vuelve a enviar el XML."},
+            status_code=410,
+        )
+
+    if staged is not None:
+        # XML/XSD/timbre ya validados en /validar; RFC/UUID se buscan abajo igual que con archivo
+        xml_bytes = staged.data
+        v = {**staged.result, "messages": list(staged.result.get("messages") or [])}
+    else:
+        xml_bytes = await file.read()
+        # XML/XSD en el pool de procesos; RFC/UUID se buscan abajo, en la misma transacción del alta
+        v = await run_cpu(build_validation_checklist, xml_bytes)
+    extracted = v.get("extracted")
 
-    # Primero valida
-    v = validate_cfdi(xml_bytes)
-    if not v.get("ok"):
-        audit(user.correo, "ALTA_RECHAZADA_CFDI", "Alta CFDI rechazada por validación", build_log(request))
-        return JSONResponse({"ok": False, "message": "CFDI no válido.", "validation": v}, status_code=400)
-    
     # Si no viene fecha_captura desde el frontend, asignar hoy
     if not fecha_captura:
         fecha_captura = date.today().isoformat()
-
-    res = create_factura_and_os(
-        actor_email=user.correo,
-        log=build_log(request),
-        #contrato
-        partida_id=partida_id,
-        mes_servicio=mes_servicio,
-        estatus_os=estatus_os, #estatus Administrativo
-
-        #CFDI
-        xml_bytes=xml_bytes,
-        proveedor_id=proveedor_id,
-        monto_partida=monto_partida,    
-        ieps= ieps,
-        descuento=descuento,
-        otras_contribuciones=otras_contribuciones,
-        retenciones=retenciones,
-        penalizacion=penalizacion,
-        deductiva=deductiva,
-        importe_pago=importe_pago,
-        fecha_recepcion=fecha_recepcion,
-        observaciones_cfdi=observaciones_cfdi,
+    log = build_log(request)
+
+    def _alta():
+        # validación + alta + auditoría: una conexión y una transacción
+        with unit_of_work():
+            # RFC/UUID al momento del alta (el resultado de /validar pudo cambiar)
+            if not lookup_cfdi(v).get("ok"):
+                audit(user.correo, "ALTA_RECHAZADA_CFDI", "Alta CFDI rechazada por validación", log)
+                return None
+
+            return create_factura_and_os(
+                actor_email=user.correo,
+                log=log,
+                #contrato
+                partida_id=partida_id,
+                mes_servicio=mes_servicio,
+                estatus_os=estatus_os, #estatus Administrativo
+
+                #CFDI
+                xml_bytes=xml_bytes,
+                proveedor_id=proveedor_id,
+                monto_partida=monto_partida,    
+                ieps= ieps,
+                descuento=descuento,
+                otras_contribuciones=otras_contribuciones,
+                retenciones=retenciones,
+                penalizacion=penalizacion,
+                deductiva=deductiva,
+                importe_pago=importe_pago,
+                fecha_recepcion=fecha_recepcion,
+                observaciones_cfdi=observaciones_cfdi,
         
-        #os
-        orden_suministro=orden_suministro,
-        fecha_solicitud=fecha_solicitud,
-        folio_oficio=folio_oficio,
-        folio_interno=folio_interno,
-        cuenta_bancaria=cuenta_bancaria,
-        banco=banco,   
-        importe_p_compromiso=importe_p_compromiso,
-        no_compromiso=no_compromiso,
-        fecha_pago=fecha_pago,
-        validacion=validacion,
-        cincomillar=cincomillar,
-        riva=riva,
-        risr=risr,
-        solicitud=solicitud,
-        observaciones_os=observaciones_os,
-        archivo=archivo,
-
-        #facturacion
-        fecha_fiscalizacion=fecha_fiscalizacion,
-        fiscalizador=fiscalizador,
-        responsable_fis=responsable_fis,
-        fecha_carga_sicop=fecha_carga_sicop,
-        responsable_carga_sicop=responsable_carga_sicop,
-        numero_solicitud=numero_solicitud,
-        clc=clc,
-        estatus_siaf=estatus_siaf,
-
-        #devolucion
-        oficio_dev=oficio_dev,
-        fecha_dev=fecha_dev,
-        motivo_dev=motivo_dev,
-
-        #final
-        ret_imp_nom=ret_imp_nom,
-        fecha_pr=fecha_pr,
-        inmueble=inmueble,
-        periodo=periodo,
-        recargos=recargos,
-        corte_presupuesto=corte_presupuesto,
-        fecha_turno=fecha_turno,
-        obs_pr=obs_pr,
-        numero_solicitud25=numero_solicitud25,
-        clc25=clc25,
-        numero_solicitud26=numero_solicitud26,
-        clc26=clc26,
-        numero_solicitud27=numero_solicitud27,
-        clc27=clc27,
-        capturista=capturista,
-    )
+                #os
+                orden_suministro=orden_suministro,
+                fecha_solicitud=fecha_solicitud,
+                folio_oficio=folio_oficio,
+                folio_interno=folio_interno,
+                cuenta_bancaria=cuenta_bancaria,
+                banco=banco,   
+                importe_p_compromiso=importe_p_compromiso,
+                no_compromiso=no_compromiso,
+                fecha_pago=fecha_pago,
+                validacion=validacion,
+                cincomillar=cincomillar,
+                riva=riva,
+                risr=risr,
+                solicitud=solicitud,
+                observaciones_os=observaciones_os,
+                archivo=archivo,
+
+                #facturacion
+                fecha_fiscalizacion=fecha_fiscalizacion,
+                fiscalizador=fiscalizador,
+                responsable_fis=responsable_fis,
+                fecha_carga_sicop=fecha_carga_sicop,
+                responsable_carga_sicop=responsable_carga_sicop,
+                numero_solicitud=numero_solicitud,
+                clc=clc,
+                estatus_siaf=estatus_siaf,
+
+                #devolucion
+                oficio_dev=oficio_dev,
+                fecha_dev=fecha_dev,
+                motivo_dev=motivo_dev,
+
+                #final
+                ret_imp_nom=ret_imp_nom,
+                fecha_pr=fecha_pr,
+                inmueble=inmueble,
+                periodo=periodo,
+                recargos=recargos,
+                corte_presupuesto=corte_presupuesto,
+                fecha_turno=fecha_turno,
+                obs_pr=obs_pr,
+                numero_solicitud25=numero_solicitud25,
+                clc25=clc25,
+                numero_solicitud26=numero_solicitud26,
+                clc26=clc26,
+                numero_solicitud27=numero_solicitud27,
+                clc27=clc27,
+                capturista=capturista,
+                extracted=extracted,
+            )
+
+    res = await run_db(_alta)
+    if res is None:
+        return JSONResponse({"ok": False, "message": "CFDI no válido.", "validation": v}, status_code=400)
+    if staged is not None and res.get("ok"):
+        tickets.discard(staged.key)
     #return JSONResponse({"ok": False, "message": res, "validation": v}, status_code=200)
     
     return res
@@ -315,78 +403,85 @@ async def api_update(
     clc27: Optional[str] = Form(None),
 ):
     user = _require_user(request)
-    res = update_factura_and_os(
-        cfdi_id=cfdi_id,
-        estatus_os=estatus_os, #estatus Administrativo
-        monto_partida=monto_partida,
-        ieps= ieps,
-        descuento=descuento,
-        otras_contribuciones=otras_contribuciones,
-        retenciones=retenciones,
-        penalizacion=penalizacion,
-        deductiva=deductiva,
-        importe_pago=importe_pago,
-        observaciones_cfdi=observaciones_cfdi,
-        #os
-        orden_suministro=orden_suministro,
-        fecha_solicitud=fecha_solicitud,
-        folio_oficio=folio_oficio,
-        folio_interno=folio_interno,
-        cuenta_bancaria=cuenta_bancaria,
-        banco=banco,   
-        importe_p_compromiso=importe_p_compromiso,
-        no_compromiso=no_compromiso,
-        fecha_pago=fecha_pago,
-        validacion=validacion,
-        cincomillar=cincomillar,
-        riva=riva,
-        risr=risr,
-        solicitud=solicitud,
-        observaciones_os=observaciones_os,
-        archivo=archivo,
-
-        #facturacion
-        fecha_fiscalizacion=fecha_fiscalizacion,
-        fiscalizador=fiscalizador,
-        responsable_fis=responsable_fis,
-        fecha_carga_sicop=fecha_carga_sicop,
-        responsable_carga_sicop=responsable_carga_sicop,
-        numero_solicitud=numero_solicitud,
-        clc=clc,
-        estatus_siaf=estatus_siaf,
-
-        #devolucion
-        oficio_dev=oficio_dev,
-        fecha_dev=fecha_dev,
-        motivo_dev=motivo_dev,
-
-        #final
-        ret_imp_nom=ret_imp_nom,
-        fecha_pr=fecha_pr,
-        inmueble=inmueble,
-        periodo=periodo,
-        recargos=recargos,
-        corte_presupuesto=corte_presupuesto,
-        fecha_turno=fecha_turno,
-        obs_pr=obs_pr,
-        numero_solicitud25=numero_solicitud25,
-        clc25=clc25,
-        numero_solicitud26=numero_solicitud26,
-        clc26=clc26,
-        numero_solicitud27=numero_solicitud27,
-        clc27=clc27,
-
-    )
-    audit(user.correo, "EDICION_CFDI", f"Edición de información de CFDI id={cfdi_id}", build_log(request),"cat_facturas.cfdi",str(cfdi_id))
-    return res
+    log = build_log(request)
+
+    def _update():
+        with unit_of_work():
+            res = update_factura_and_os(
+                cfdi_id=cfdi_id,
+                estatus_os=estatus_os, #estatus Administrativo
+                monto_partida=monto_partida,
+                ieps= ieps,
+                descuento=descuento,
+                otras_contribuciones=otras_contribuciones,
+                retenciones=retenciones,
+                penalizacion=penalizacion,
+                deductiva=deductiva,
+                importe_pago=importe_pago,
+                observaciones_cfdi=observaciones_cfdi,
+                #os
+                orden_suministro=orden_suministro,
+                fecha_solicitud=fecha_solicitud,
+                folio_oficio=folio_oficio,
+                folio_interno=folio_interno,
+                cuenta_bancaria=cuenta_bancaria,
+                banco=banco,   
+                importe_p_compromiso=importe_p_compromiso,
+                no_compromiso=no_compromiso,
+                fecha_pago=fecha_pago,
+                validacion=validacion,
+                cincomillar=cincomillar,
+                riva=riva,
+                risr=risr,
+                solicitud=solicitud,
+                observaciones_os=observaciones_os,
+                archivo=archivo,
+
+                #facturacion
+                fecha_fiscalizacion=fecha_fiscalizacion,
+                fiscalizador=fiscalizador,
+                responsable_fis=responsable_fis,
+                fecha_carga_sicop=fecha_carga_sicop,
+                responsable_carga_sicop=responsable_carga_sicop,
+                numero_solicitud=numero_solicitud,
+                clc=clc,
+                estatus_siaf=estatus_siaf,
+
+                #devolucion
+                oficio_dev=oficio_dev,
+                fecha_dev=fecha_dev,
+                motivo_dev=motivo_dev,
+
+                #final
+                ret_imp_nom=ret_imp_nom,
+                fecha_pr=fecha_pr,
+                inmueble=inmueble,
+                periodo=periodo,
+                recargos=recargos,
+                corte_presupuesto=corte_presupuesto,
+                fecha_turno=fecha_turno,
+                obs_pr=obs_pr,
+                numero_solicitud25=numero_solicitud25,
+                clc25=clc25,
+                numero_solicitud26=numero_solicitud26,
+                clc26=clc26,
+                numero_solicitud27=numero_solicitud27,
+                clc27=clc27,
+
+            )
+            audit(user.correo, "EDICION_CFDI", f"Edición de información de CFDI id={cfdi_id}", log,"cat_facturas.cfdi",str(cfdi_id))
+        return res
+
+    return await run_db(_update)
 
 
 
 @router.put("/{cfdi_id}/estatus")
 def api_set_status(request: Request, cfdi_id: int, estatus: str = Form(...)):
     user = _require_user(request)
-    res = set_cfdi_estatus(cfdi_id, estatus)
-    audit(user.correo, "CFDI_ESTATUS", f"Cambio estatus CFDI id={cfdi_id} -> {estatus}", build_log(request),"cat_facturas.cfdi",cfdi_id)
+    with unit_of_work():
+        res = set_cfdi_estatus(cfdi_id, estatus)
+        audit(user.correo, "CFDI_ESTATUS", f"Cambio estatus CFDI id={cfdi_id} -> {estatus}", build_log(request),"cat_facturas.cfdi",cfdi_id)
     return res
 
 @router.get("/catalogos/proveedor-by-rfc")
@@ -409,17 +504,14 @@ def api_proveedor_by_rfc(request: Request, rfc: str):
             return {"item": dict(zip(cols, row))}
 
 @router.get("/catalogos/estado-orden")
-def api_estado_orden(request: Request):
+async def api_estado_orden(request: Request):
     _require_user(request)
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+    async with get_aconn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
                 SELECT id, estatus_general, estatus_reporte
                 FROM cat_facturas.estado_orden
                 ORDER BY id
             """)
-            #print(cur.description)
-            cols = [d[0] for d in cur.description]
-            items = [dict(r) for r in cur.fetchall()]
-            #print(items)
+            items = await cur.fetchall()
             return {"items": items}
@@ -3,85 +3,154 @@ from __future__ import annotations
 
 from datetime import datetime
 from fastapi import APIRouter, Request, Query
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from core.auth import require_login, require_admin
+from core.auth import require_login
 from core.audit import audit, build_log
-from core.excel_export import export_xlsx
 
-# Importa los services de reportes que quieras exportar
-from services.auditoria_service import search_auditoria
+# Reportes exportables: se registran en services/reportes_export.py
+from services import export_jobs_service, reportes_export
+from services.export_jobs_service import ExportJobLimit
 
 router = APIRouter(prefix="/api/export")
 
 
-def _filename(prefix: str) -> str:
+def _filename(prefix: str, extension: str = "xlsx") -> str:
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{prefix}_{ts}.xlsx"
+    return f"{prefix}_{ts}.{extension}"
+
+
+@router.get("/reportes")
+def export_reportes(request: Request):
+    """Reportes exportables para el usuario (nombre, filtros, tope de filas)."""
+    user = require_login(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return {"items": [r for r in reportes_export.catalogo() if r["roles"] is None or user.rol in r["roles"]]}
 
 
 @router.get("/excel")
 def export_excel(
     request: Request,
-    report: str = Query(..., description="Nombre del reporte, ej: auditoria"),
-    # filtros genéricos (algunos aplican, otros no según reporte)
-    correo: str | None = Query(default=None),
-    accion: str | None = Query(default=None),
-    q: str | None = Query(default=None),
-    date_from: str | None = Query(default=None),
-    date_to: str | None = Query(default=None),
+    report: str = Query(..., description="Nombre del reporte, ej: auditoria (ver /api/export/reportes)"),
+    format: str = Query(default="xlsx", description="xlsx | csv | ndjson | parquet"),
+    limit: int | None = Query(default=None, ge=1, description="tope de filas (no rebasa el del reporte)"),
+    background: bool = Query(default=False, description="true => exportación en segundo plano (ver /jobs)"),
 ):
+    """
+    Exporta cualquier reporte registrado en services.reportes_export en streaming.
+    Los filtros van como query params y dependen del reporte (p. ej. auditoria:
+    correo, accion, q, date_from, date_to); los que el reporte no declara se ignoran.
+    """
     user = require_login(request)
     if not user:
         return JSONResponse({"detail": "Unauthorized"}, status_code=401)
 
-    report = report.strip().lower()
+    params = dict(request.query_params)
 
-    # -------- Reporte: auditoria (SOLO ADMIN) --------
-    if report == "auditoria":
-        admin = require_admin(request)
-        if not admin:
+    if background:
+        return submit_export_job(request, user, report, format, params)
+
+    try:
+        rep = reportes_export.get_reporte(report)
+        if not reportes_export.puede_exportar(rep, user.rol):
             return JSONResponse({"detail": "Forbidden"}, status_code=403)
+        filtros = reportes_export.normalizar_filtros(rep, params)
+        content, fmt = reportes_export.exportar_reporte(rep, format, filtros, limit=limit)
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+    audit(
+        correo=user.correo,
+        accion="EXPORT_XLSX" if fmt.extension == "xlsx" else "EXPORT",
+        descripcion=f"Exportación {fmt.extension.upper()} - {rep.titulo or rep.hoja}",
+        log_accion=build_log(request, extra=f"report={rep.nombre} max_rows={limit or rep.max_filas}"),
+    )
+
+    return StreamingResponse(
+        content,
+        media_type=fmt.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{_filename(rep.nombre, fmt.extension)}"'
+        },
+    )
+
+
+# -----------------------------
+# Exportaciones en segundo plano
+# -----------------------------
+def submit_export_job(request: Request, user, reporte: str, formato: str, params: dict):
+    """Encola la exportación y responde 202 con el trabajo (id, estatus, avance)."""
+    try:
+        job = export_jobs_service.submit_job(user.correo, user.rol, reporte, formato, params)
+    except PermissionError as e:
+        return JSONResponse({"detail": str(e)}, status_code=403)
+    except ExportJobLimit as e:
+        return JSONResponse({"detail": str(e)}, status_code=429)
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+    audit(
+        correo=user.correo,
+        accion="EXPORT_JOB",
+        descripcion=f"Exportación en segundo plano - {job['reporte']} ({job['formato']})",
+        log_accion=build_log(request, extra=f"job={job['id']}"),
+    )
+    return JSONResponse(job, status_code=202)
+
+
+@router.post("/jobs")
+async def api_export_job_submit(request: Request):
+    """
+    Body JSON: {"reporte": "facturas" | "auditoria", "formato": "xlsx" | "csv" | "ndjson" | "parquet",
+                "filtros": {...mismos filtros que la exportación directa...}}
+    """
+    user = require_login(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+
+    payload = await request.json()
+    return submit_export_job(
+        request,
+        user,
+        str(payload.get("reporte") or ""),
+        str(payload.get("formato") or "xlsx"),
+        payload.get("filtros") or {},
+    )
+
+
+@router.get("/jobs")
+def api_export_jobs(request: Request, limit: int = Query(default=20, ge=1, le=100)):
+    user = require_login(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return {"items": export_jobs_service.list_jobs(user.correo, limit)}
+
+
+@router.get("/jobs/{job_id}")
+def api_export_job(request: Request, job_id: str):
+    user = require_login(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+
+    job = export_jobs_service.get_job(job_id, user.correo)
+    if not job:
+        return JSONResponse({"detail": "Exportación no encontrada"}, status_code=404)
+    return job
+
+
+@router.get("/jobs/{job_id}/descarga")
+def api_export_job_descarga(request: Request, job_id: str):
+    user = require_login(request)
+    if not user:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+
+    found = export_jobs_service.job_file(job_id, user.correo)
+    if not found:
+        return JSONResponse({"detail": "Archivo no disponible (no terminado o expirado)"}, status_code=404)
 
-        result = search_auditoria(
-            correo=correo,
-            accion=accion,
-            q=q,
-            date_from=date_from,
-            date_to=date_to,
-            limit=500,   # exportamos hasta 500 por default (puedes aumentar)
-            offset=0,
-        )
-        rows = result["rows"]
-
-        xlsx = export_xlsx(
-            rows,
-            sheet_name="Auditoria",
-            title="Reporte de Auditoría",
-            columns=[
-                ("FECHA", "FECHA"),
-                ("ROL", "ROL"),
-                ("RESPONSABLE", "RESPONSABLE"),
-                ("CORREO", "CORREO"),
-                ("accion", "ACCION"),
-                ("DESCRIPCION", "DESCRIPCION"),
-            ],
-        )
-
-        audit(
-            correo=admin.correo,
-            accion="EXPORT_XLSX",
-            descripcion="Exportación Excel - Auditoría",
-            log_accion=build_log(request, extra=f"rows={len(rows)}"),
-        )
-
-        return Response(
-            content=xlsx,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f'attachment; filename="{_filename("auditoria")}"'
-            },
-        )
-
-    # --------- agrega aquí más reportes ---------
-    return JSONResponse({"detail": f"Reporte no soportado: {report}"}, status_code=400)
+    content, filename, media_type, size = found
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    return StreamingResponse(content, media_type=media_type, headers=headers)
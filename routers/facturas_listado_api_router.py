@@ -5,17 +5,20 @@ API Router para listado de facturas con paginación y exportación
 from __future__ import annotations
 
 from fastapi import APIRouter, Request, Query, HTTPException
-from fastapi.responses import FileResponse
-import os
+from fastapi.responses import JSONResponse, StreamingResponse
+from datetime import datetime
 
 from core.auth import require_login
-from core.audit import audit, build_log
+from core.audit import audit, audit_async, build_log
+from core.stream_export import FORMATS
+from core.xlsx_stream import XLSX_MEDIA_TYPE
+from routers.export_router import submit_export_job
 from services.facturas_listado_service import (
-    list_facturas_paginado,
+    list_facturas_paginado_async,
+    exportar_facturas,
     exportar_facturas_excel,
-    get_filtros_opciones,
+    get_filtros_opciones_async,
 )
-from starlette.background import BackgroundTask
 
 router = APIRouter(prefix="/api/facturas-listado", tags=["facturas_listado_api"])
 
@@ -28,8 +31,15 @@ def _require_user(request: Request):
     return user
 
 
+def _filtros_dict(proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin) -> dict:
+    return {
+        "proveedor": proveedor, "uuid": uuid, "area": area, "estatus_os": estatus_os,
+        "fecha_inicio": fecha_inicio, "fecha_fin": fecha_fin,
+    }
+
+
 @router.get("/lista")
-def api_lista_facturas(
+async def api_lista_facturas(
     request: Request,
     page: int = Query(1, ge=1),
     per_page: int = Query(50, ge=1, le=500),
@@ -39,6 +49,9 @@ def api_lista_facturas(
     estatus_os: int = Query(None),
     fecha_inicio: str = Query(None),
     fecha_fin: str = Query(None),
+    after: str = Query(None),
+    count: str = Query("exact"),
+    vista: str = Query("grid"),
 ):
     """
     Endpoint para listar facturas con paginación y filtros.
@@ -52,22 +65,31 @@ def api_lista_facturas(
     - estatus_os: filtro por ID de estado de orden
     - fecha_inicio: filtro fecha >= (formato: YYYY-MM-DD)
     - fecha_fin: filtro fecha <= (formato: YYYY-MM-DD)
+    - after: next_cursor de la página anterior (paginación por cursor; page sólo se informa)
+    - count: exact (default, cacheado) | capped (hasta LISTADO_COUNT_CAP, "10000+") | estimate
+    - vista: columnas a regresar: grid (default, tabla del listado) | detail | export-full | export-fiscal
     """
     user = _require_user(request)
     
-    result = list_facturas_paginado(
-        page=page,
-        per_page=per_page,
-        proveedor=proveedor,
-        uuid=uuid,
-        area=area,
-        estatus_os=estatus_os,
-        fecha_inicio=fecha_inicio,
-        fecha_fin=fecha_fin,
-    )
+    try:
+        result = await list_facturas_paginado_async(
+            page=page,
+            per_page=per_page,
+            proveedor=proveedor,
+            uuid=uuid,
+            area=area,
+            estatus_os=estatus_os,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+            after=after,
+            count_mode=count,
+            vista=vista,
+        )
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
     
     # Auditoría
-    audit(
+    await audit_async(
         user.correo,
         "LISTADO_FACTURAS",
         f"Consulta listado de facturas (página {page})",
@@ -78,13 +100,13 @@ def api_lista_facturas(
 
 
 @router.get("/filtros")
-def api_filtros_opciones(request: Request):
+async def api_filtros_opciones(request: Request):
     """
     Endpoint para obtener las opciones disponibles para filtros.
     Retorna áreas y estados de orden.
     """
     _require_user(request)
-    return get_filtros_opciones()
+    return await get_filtros_opciones_async()
 
 
 @router.get("/exportar-excel")
@@ -96,14 +118,21 @@ def api_exportar_excel(
     estatus_os: int = Query(None),
     fecha_inicio: str = Query(None),
     fecha_fin: str = Query(None),
+    background: bool = Query(False),
 ):
     """
     Endpoint para exportar facturas a Excel.
-    Aplica los mismos filtros que el listado.
+    Aplica los mismos filtros que el listado. El archivo se genera y envía
+    en streaming (cursor del servidor -> xlsx), sin archivo temporal.
+    background=true: se encola (202 + trabajo; avance y descarga en /api/export/jobs).
     """
     user = _require_user(request)
+
+    if background:
+        return submit_export_job(request, user, "facturas", "xlsx", _filtros_dict(
+            proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin))
     
-    filepath = exportar_facturas_excel(
+    content = exportar_facturas_excel(
         proveedor=proveedor,
         uuid=uuid,
         area=area,
@@ -112,7 +141,7 @@ def api_exportar_excel(
         fecha_fin=fecha_fin,
     )
     
-    if not filepath:
+    if content is None:
         raise HTTPException(status_code=404, detail="No hay datos para exportar")
     
     # Auditoría
@@ -124,21 +153,68 @@ def api_exportar_excel(
     )
     
     # Generar nombre del archivo
-    from datetime import datetime
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"facturas_{timestamp}.xlsx"
     
-    def cleanup():
-        """Eliminar archivo temporal después de enviarlo"""
-        try:
-            if os.path.exists(filepath):
-                os.unlink(filepath)
-        except Exception:
-            pass
-    
-    return FileResponse(
-        filepath,
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        filename=filename,
-        background=BackgroundTask(cleanup)
+    return StreamingResponse(
+        content,
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/exportar")
+def api_exportar(
+    request: Request,
+    format: str = Query("xlsx"),
+    proveedor: str = Query(None),
+    uuid: str = Query(None),
+    area: int = Query(None),
+    estatus_os: int = Query(None),
+    fecha_inicio: str = Query(None),
+    fecha_fin: str = Query(None),
+    background: bool = Query(False),
+):
+    """
+    Exporta facturas en streaming con los mismos filtros y columnas que /exportar-excel.
+    - format: xlsx (default) | csv | ndjson | parquet
+    - background: true => se encola (202 + trabajo; avance y descarga en /api/export/jobs)
+    """
+    user = _require_user(request)
+
+    if background:
+        return submit_export_job(request, user, "facturas", format, _filtros_dict(
+            proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin))
+
+    try:
+        content = exportar_facturas(
+            format,
+            proveedor=proveedor,
+            uuid=uuid,
+            area=area,
+            estatus_os=estatus_os,
+            fecha_inicio=fecha_inicio,
+            fecha_fin=fecha_fin,
+        )
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+    if content is None:
+        raise HTTPException(status_code=404, detail="No hay datos para exportar")
+
+    fmt = FORMATS[format.strip().lower()]
+    audit(
+        user.correo,
+        "EXPORTAR_FACTURAS",
+        f"Exportación de facturas ({fmt.extension})",
+        build_log(request)
+    )
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"facturas_{timestamp}.{fmt.extension}"
+
+    return StreamingResponse(
+        content,
+        media_type=fmt.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
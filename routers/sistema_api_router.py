@@ -0,0 +1,72 @@
+# routers/sistema_api_router.py
+from __future__ import annotations
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from core.auth import require_admin
+from core.db import pool_stats
+from core.db_async import apool_stats
+from core.audit_writer import writer as audit_writer
+from core.upload_tickets import tickets as cfdi_tickets
+from core import executors
+from core.export_cache import export_cache
+from services import catalogos_jobs_service, export_jobs_service
+
+router = APIRouter(prefix="/api/sistema", tags=["sistema_api"])
+
+
+@router.get("/db-pool")
+def api_db_pool(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return {"sync": pool_stats(), "async": apool_stats()}
+
+
+@router.get("/audit-writer")
+def api_audit_writer(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return audit_writer.stats()
+
+
+@router.get("/cfdi-tickets")
+def api_cfdi_tickets(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return cfdi_tickets.stats()
+
+
+@router.get("/executors")
+def api_executors(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return executors.stats()
+
+
+@router.get("/export-jobs")
+def api_export_jobs(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return export_jobs_service.stats()
+
+
+@router.get("/catalogos-jobs")
+def api_catalogos_jobs(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return catalogos_jobs_service.stats()
+
+
+@router.get("/export-cache")
+def api_export_cache(request: Request):
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"detail": "Unauthorized"}, status_code=401)
+    return export_cache.stats()
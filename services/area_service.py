@@ -2,6 +2,7 @@
 from __future__ import annotations
 
 from psycopg.rows import dict_row
+from core import data_version
 from core.db import get_conn
 
 
@@ -26,6 +27,7 @@ def insert_area(nombre_area: str, desc_area: str | None) -> int:
             """, (nombre_area, desc_area))
             new_id = cur.fetchone()[0]
         conn.commit()
+    data_version.touch()
     return int(new_id)
 
 
@@ -38,6 +40,7 @@ def update_area(area_id: int, nombre_area: str, desc_area: str | None) -> None:
               WHERE id=%s
             """, (nombre_area, desc_area, area_id))
         conn.commit()
+    data_version.touch()
 
 
 def delete_area(area_id: int) -> None:
@@ -45,6 +48,7 @@ def delete_area(area_id: int) -> None:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM cat_facturas.area WHERE id=%s", (area_id,))
         conn.commit()
+    data_version.touch()
 
 
 def area_name_exists(nombre: str, exclude_id: int | None = None) -> bool:
@@ -1,20 +1,34 @@
 # services/auditoria_service.py
 from __future__ import annotations
+import os
+from typing import Iterator
 from psycopg.rows import dict_row
 from core.db import get_conn
+from core.db_async import get_aconn
 from datetime import datetime, timedelta
+
+EXPORT_AUDITORIA_MAX = int(os.getenv("EXPORT_AUDITORIA_MAX", "100000"))  # filas por exportación
+
+# columnas de la exportación: (llave, encabezado)
+AUDITORIA_COLUMNAS = [
+    ("FECHA", "FECHA"),
+    ("ROL", "ROL"),
+    ("RESPONSABLE", "RESPONSABLE"),
+    ("CORREO", "CORREO"),
+    ("accion", "ACCION"),
+    ("DESCRIPCION", "DESCRIPCION"),
+]
  
-def search_auditoria(
-    correo: str | None = None,
-    accion: str | None = None,
-    q: str | None = None,
-    date_from: str | None = None,   # 'YYYY-MM-DD'
-    date_to: str | None = None,     # 'YYYY-MM-DD'
-    limit: int = 100,
-    offset: int = 0,
-) -> dict:
-    limit = max(1, min(int(limit), 500))
-    offset = max(0, int(offset))
+def _auditoria_query(
+    correo: str | None,
+    accion: str | None,
+    q: str | None,
+    date_from: str | None,
+    date_to: str | None,
+    limit: int,
+    offset: int,
+) -> tuple[str, str, list]:
+    """Arma (sql_count, sql_rows, params) para la búsqueda de auditoría."""
  
     where = []
     params = []
@@ -60,9 +74,22 @@ def search_auditoria(
         ORDER BY 1 desc
         LIMIT {limit} OFFSET {offset};
     """
-    #print(sql_rows)
-    #print(sql_count)
-    #print(params)
+    return sql_count, sql_rows, params
+
+
+def search_auditoria(
+    correo: str | None = None,
+    accion: str | None = None,
+    q: str | None = None,
+    date_from: str | None = None,   # 'YYYY-MM-DD'
+    date_to: str | None = None,     # 'YYYY-MM-DD'
+    limit: int = 100,
+    offset: int = 0,
+) -> dict:
+    limit = max(1, min(int(limit), 500))
+    offset = max(0, int(offset))
+    sql_count, sql_rows, params = _auditoria_query(correo, accion, q, date_from, date_to, limit, offset)
+
     with get_conn() as conn:
         with conn.cursor(row_factory=dict_row) as cur:
             cur.execute(sql_count,params)
@@ -70,4 +97,65 @@ def search_auditoria(
             cur.execute(sql_rows,params)
             rows = cur.fetchall()
  
-    return {"total": total, "rows": rows, "limit": limit, "offset": offset}
\ No newline at end of file
+    return {"total": total, "rows": rows, "limit": limit, "offset": offset}
+
+
+async def search_auditoria_async(
+    correo: str | None = None,
+    accion: str | None = None,
+    q: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    limit: int = 100,
+    offset: int = 0,
+) -> dict:
+    """Versión async de search_auditoria (mismo resultado)."""
+    limit = max(1, min(int(limit), 500))
+    offset = max(0, int(offset))
+    sql_count, sql_rows, params = _auditoria_query(correo, accion, q, date_from, date_to, limit, offset)
+
+    async with get_aconn() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(sql_count, params)
+            total = (await cur.fetchone())["total"]
+            await cur.execute(sql_rows, params)
+            rows = await cur.fetchall()
+
+    return {"total": total, "rows": rows, "limit": limit, "offset": offset}
+
+
+def count_auditoria(
+    correo: str | None = None,
+    accion: str | None = None,
+    q: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+) -> int:
+    sql_count, _, params = _auditoria_query(correo, accion, q, date_from, date_to, 1, 0)
+    with get_conn() as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(sql_count, params)
+            return cur.fetchone()["total"]
+
+
+def iter_auditoria(
+    correo: str | None = None,
+    accion: str | None = None,
+    q: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    limit: int = EXPORT_AUDITORIA_MAX,
+    chunk: int = 2000,
+) -> Iterator[dict]:
+    """Filas de auditoría para exportar (hasta limit), con cursor del servidor por bloques."""
+    limit = max(1, min(int(limit), EXPORT_AUDITORIA_MAX))
+    _, sql_rows, params = _auditoria_query(correo, accion, q, date_from, date_to, limit, 0)
+
+    with get_conn() as conn:
+        with conn.cursor(name="auditoria_export", row_factory=dict_row) as cur:
+            cur.execute(sql_rows.strip().rstrip(";"), params)
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    break
+                yield from rows
@@ -0,0 +1,352 @@
+# services/catalogos_jobs_service.py
+"""
+Importación de catálogos en segundo plano.
+submit_job registra el trabajo en cat_facturas.catalogo_import_job junto con el Excel
+(columna contenido, así cualquier instancia lo reanuda) y lo encola. El worker corre process_catalogos_excel
+con commits cada CATALOGOS_JOB_CHUNK filas; cada commit incluye el punto de control
+(hoja, última fila, summary, errores), así un trabajo en ERROR (falla, reinicio,
+sin avance) se reanuda con reanudar_job desde el último lote confirmado.
+Sólo corre una importación a la vez (advisory lock en process_catalogos_excel).
+"""
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import uuid as uuid_mod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from psycopg.types.json import Jsonb
+
+from core.db import get_conn
+from services.catalogos_service import CatalogoImportEnCurso, Lotes, process_catalogos_excel
+
+CATALOGOS_JOB_CHUNK = int(os.getenv("CATALOGOS_JOB_CHUNK", "5000"))           # filas por commit
+CATALOGOS_JOB_STALE = int(os.getenv("CATALOGOS_JOB_STALE", "900"))            # sin avance => ERROR (reanudable)
+CATALOGOS_JOB_TTL = int(os.getenv("CATALOGOS_JOB_TTL", str(7 * 24 * 3600)))   # segundos que se conserva el Excel
+CATALOGOS_JOB_SWEEP = float(os.getenv("CATALOGOS_JOB_SWEEP", "300"))
+
+_MAX_ROW_ERRORS = 2000
+_INSTANCE = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# -----------------------------
+# SQL
+# -----------------------------
+_COLS = """
+    id, correo, nombre_archivo, estatus, filas, filas_total, punto_control, resultado, error,
+    intentos, fecha_creacion, fecha_inicio, fecha_actualizacion, fecha_fin
+"""
+
+_ACTIVO_SQL = """
+    SELECT id, correo
+    FROM cat_facturas.catalogo_import_job
+    WHERE estatus IN ('PENDIENTE', 'EN_PROCESO')
+      AND fecha_actualizacion > now() - make_interval(secs => %s)
+    LIMIT 1
+"""
+
+_INSERT_SQL = f"""
+    INSERT INTO cat_facturas.catalogo_import_job (id, correo, nombre_archivo, contenido, instancia)
+    VALUES (%s, %s, %s, %s, %s)
+    RETURNING {_COLS}
+"""
+
+_REANUDAR_SQL = f"""
+    UPDATE cat_facturas.catalogo_import_job
+    SET estatus = 'PENDIENTE', error = NULL, fecha_fin = NULL, fecha_actualizacion = now(), instancia = %s
+    WHERE id = %s AND estatus = 'ERROR'
+    RETURNING {_COLS}, contenido IS NOT NULL AS disponible
+"""
+
+_CLAIM_SQL = f"""
+    UPDATE cat_facturas.catalogo_import_job
+    SET estatus = 'EN_PROCESO', intentos = intentos + 1, instancia = %s,
+        fecha_inicio = COALESCE(fecha_inicio, now()), fecha_actualizacion = now()
+    WHERE id = %s AND estatus = 'PENDIENTE'
+    RETURNING {_COLS}
+"""
+
+_PROGRESS_SQL = """
+    UPDATE cat_facturas.catalogo_import_job
+    SET filas = %s, filas_total = %s, punto_control = %s, fecha_actualizacion = now()
+    WHERE id = %s
+"""
+
+_FINISH_SQL = """
+    UPDATE cat_facturas.catalogo_import_job
+    SET estatus = %s, resultado = %s, error = %s, fecha_fin = now(), fecha_actualizacion = now()
+    WHERE id = %s
+"""
+
+_FAIL_SQL = """
+    UPDATE cat_facturas.catalogo_import_job
+    SET estatus = 'ERROR', error = %s, fecha_fin = now(), fecha_actualizacion = now()
+    WHERE id = %s AND estatus IN ('PENDIENTE', 'EN_PROCESO')
+"""
+
+
+def _exec(sql: str, params: Sequence[Any], fetch: bool = False) -> Any:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall() if fetch else cur.rowcount
+
+
+def _check_activo(cur, excepto: Optional[uuid_mod.UUID] = None) -> None:
+    # serializa envíos/reanudaciones para que no se cuelen dos a la vez
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('catalogo_import_job'))")
+    cur.execute(_ACTIVO_SQL, (CATALOGOS_JOB_STALE,))
+    row = cur.fetchone()
+    if row and row["id"] != excepto:
+        raise CatalogoImportEnCurso(
+            f"Hay otra importación de catálogos en curso ({row['correo']}); espera a que termine."
+        )
+
+
+# -----------------------------
+# API
+# -----------------------------
+def submit_job(correo: str, filename: str, content: bytes) -> Dict[str, Any]:
+    """Guarda el Excel y encola la importación. CatalogoImportEnCurso si ya hay una activa."""
+    job_id = uuid_mod.uuid4()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _check_activo(cur)
+            cur.execute(_INSERT_SQL, (job_id, correo, filename, content, _INSTANCE))
+            row = cur.fetchone()
+        conn.commit()
+
+    _pool().submit(_run_job, job_id)
+    _count("submitted", 1)
+    return _job_result(row)
+
+
+def reanudar_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Vuelve a encolar un trabajo en ERROR; continúa desde su último lote confirmado.
+    None si no existe o no está en ERROR; ValueError si su Excel ya no está disponible.
+    """
+    job_uuid = _uuid(job_id)
+    if job_uuid is None:
+        return None
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _check_activo(cur)
+            cur.execute(_REANUDAR_SQL, (_INSTANCE, job_uuid))
+            row = cur.fetchone()
+            if row and not row["disponible"]:
+                conn.rollback()
+                raise ValueError("El archivo de la importación ya no está disponible; vuelve a cargarlo.")
+        conn.commit()
+    if not row:
+        return None
+    _pool().submit(_run_job, job_uuid)
+    _count("resumed", 1)
+    return _job_result(row)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    job_uuid = _uuid(job_id)
+    if job_uuid is None:
+        return None
+    rows = _exec(f"SELECT {_COLS} FROM cat_facturas.catalogo_import_job WHERE id = %s", (job_uuid,), fetch=True)
+    return _job_result(rows[0], detalle=True) if rows else None
+
+
+def list_jobs(limit: int = 20) -> List[Dict[str, Any]]:
+    rows = _exec(
+        f"SELECT {_COLS} FROM cat_facturas.catalogo_import_job ORDER BY fecha_creacion DESC LIMIT %s",
+        (max(1, min(int(limit), 100)),),
+        fetch=True,
+    )
+    return [_job_result(r) for r in rows]
+
+
+def _uuid(job_id: str) -> Optional[uuid_mod.UUID]:
+    try:
+        return uuid_mod.UUID(str(job_id))
+    except ValueError:
+        return None
+
+
+def _job_result(row: dict, detalle: bool = False) -> Dict[str, Any]:
+    total = row["filas_total"]
+    punto = row["punto_control"] or {}
+    if row["estatus"] == "TERMINADO":
+        progreso = 100
+    elif total:
+        progreso = min(99, int(row["filas"] * 100 / total))
+    else:
+        progreso = 0
+    out = {
+        "id": str(row["id"]),
+        "correo": row["correo"],
+        "archivo": row["nombre_archivo"],
+        "estatus": row["estatus"],
+        "filas": row["filas"],
+        "filas_total": total,
+        "progreso": progreso,
+        "hoja": punto.get("hoja"),
+        "fila": punto.get("fila"),
+        "summary": punto.get("summary"),
+        "error": row["error"],
+        "intentos": row["intentos"],
+        "reanudable": row["estatus"] == "ERROR",
+        "fecha_creacion": row["fecha_creacion"].isoformat() if row["fecha_creacion"] else None,
+        "fecha_actualizacion": row["fecha_actualizacion"].isoformat() if row["fecha_actualizacion"] else None,
+        "fecha_fin": row["fecha_fin"].isoformat() if row["fecha_fin"] else None,
+    }
+    if detalle:
+        out["resultado"] = row["resultado"]
+    return out
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+def _run_job(job_id: uuid_mod.UUID) -> None:
+    rows = _exec(_CLAIM_SQL, (_INSTANCE, job_id), fetch=True)
+    if not rows:
+        return
+    _count("running", 1)
+    job = rows[0]
+
+    def guardar(cur, punto: dict) -> None:
+        # misma transacción que el lote: el avance guardado siempre corresponde a lo confirmado
+        punto = {**punto, "row_errors": punto["row_errors"][:_MAX_ROW_ERRORS]}
+        cur.execute(_PROGRESS_SQL, (punto["filas"], punto["filas_total"], Jsonb(punto), job_id))
+
+    try:
+        rows = _exec("SELECT contenido FROM cat_facturas.catalogo_import_job WHERE id = %s", (job_id,), fetch=True)
+        if not rows or rows[0]["contenido"] is None:
+            raise RuntimeError("El archivo de la importación ya no está disponible; vuelve a cargarlo.")
+        result = process_catalogos_excel(
+            excel_bytes=bytes(rows[0]["contenido"]),
+            filename=job["nombre_archivo"],
+            actor_email=job["correo"],
+            request_log=f"job={job_id}",
+            lotes=Lotes(CATALOGOS_JOB_CHUNK, guardar, reanudar=job["punto_control"]),
+        )
+        if result.get("ok"):
+            _exec(_FINISH_SQL, ("TERMINADO", Jsonb(result), None, job_id))
+            _count("completed", 1)
+        else:
+            # estructura inválida: no hay nada que reanudar
+            _exec(_FINISH_SQL, ("ERROR", Jsonb(result), result.get("message"), job_id))
+            _count("failed", 1)
+    except Exception as e:
+        _count("failed", 1)
+        print(f"Importación de catálogos {job_id} falló:", str(e))
+        _exec(_FAIL_SQL, (str(e)[:500], job_id))
+    finally:
+        _count("running", -1)
+
+
+# -----------------------------
+# Limpieza
+# -----------------------------
+def sweep() -> Dict[str, int]:
+    """
+    Pasa a ERROR (reanudable) los trabajos sin avance y borra los Excel vencidos.
+    Los PENDIENTE de esta instancia esperan en el pool local (sin latido propio): se
+    refrescan aquí para que no se den por abandonados mientras esperan worker.
+    """
+    _exec(
+        """
+        UPDATE cat_facturas.catalogo_import_job
+        SET fecha_actualizacion = now()
+        WHERE instancia = %s AND estatus = 'PENDIENTE'
+        """,
+        (_INSTANCE,),
+    )
+    stale = _exec(
+        """
+        UPDATE cat_facturas.catalogo_import_job
+        SET estatus = 'ERROR', error = 'Importación interrumpida (sin avance); se puede reanudar.', fecha_fin = now()
+        WHERE estatus IN ('PENDIENTE', 'EN_PROCESO')
+          AND fecha_actualizacion < now() - make_interval(secs => %s)
+        """,
+        (CATALOGOS_JOB_STALE,),
+    )
+    removed = _exec(
+        """
+        UPDATE cat_facturas.catalogo_import_job
+        SET contenido = NULL
+        WHERE estatus IN ('TERMINADO', 'ERROR') AND contenido IS NOT NULL
+          AND fecha_actualizacion < now() - make_interval(secs => %s)
+        """,
+        (CATALOGOS_JOB_TTL,),
+    )
+    return {"stale": stale, "files_removed": removed}
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stats = {"submitted": 0, "resumed": 0, "running": 0, "completed": 0, "failed": 0}
+_stop = threading.Event()
+_sweeper: Optional[threading.Thread] = None
+
+
+def _pool() -> ThreadPoolExecutor:
+    # un worker: las importaciones son excluyentes (advisory lock)
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalogos-job")
+    return _executor
+
+
+def _count(key: str, n: int) -> None:
+    with _executor_lock:
+        _stats[key] += n
+
+
+def _sweep_loop() -> None:
+    while not _stop.wait(CATALOGOS_JOB_SWEEP):
+        try:
+            sweep()
+        except Exception as e:
+            print("Limpieza de importaciones de catálogos falló:", str(e))
+
+
+def start() -> None:
+    global _sweeper
+    _stop.clear()
+    if _sweeper is None or not _sweeper.is_alive():
+        _sweeper = threading.Thread(target=_sweep_loop, name="catalogos-job-sweeper", daemon=True)
+        _sweeper.start()
+
+
+def shutdown() -> None:
+    """Detiene la limpieza y el pool; lo que quedó pendiente en esta instancia pasa a ERROR (reanudable)."""
+    global _executor
+    _stop.set()
+    with _executor_lock:
+        ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=False, cancel_futures=True)
+        try:
+            _exec(
+                """
+                UPDATE cat_facturas.catalogo_import_job
+                SET estatus = 'ERROR', error = 'Servidor reiniciado; se puede reanudar.', fecha_fin = now()
+                WHERE instancia = %s AND estatus IN ('PENDIENTE', 'EN_PROCESO')
+                """,
+                (_INSTANCE,),
+            )
+        except Exception as e:
+            print("No fue posible cerrar importaciones pendientes:", str(e))
+
+
+def stats() -> Dict[str, Any]:
+    with _executor_lock:
+        st = dict(_stats)
+    return {
+        **st,
+        "instance": _INSTANCE,
+        "chunk": CATALOGOS_JOB_CHUNK,
+        "ttl_s": CATALOGOS_JOB_TTL,
+    }
@@ -1,14 +1,21 @@
 # services/catalogos_service.py
 from __future__ import annotations
 
-from io import BytesIO
 import os
+import sys
 import unicodedata
 from datetime import datetime, date
+from decimal import Decimal
+from itertools import repeat
+from typing import Callable, Iterable, Iterator, NamedTuple
 
+import numpy as np
 import pandas as pd
+from core import data_version, executors
 from core.db import get_conn
 from core.audit import audit
+from core.security import is_password_hash, resolve_password_hash
+from core.xlsx_read import XLSX_READ_BATCH, Prefetch, open_workbook, read_sheet
 
 
 # Hojas canónicas y columnas esperadas
@@ -137,7 +144,8 @@ def safe_date(valor):
         return None
 
 
-def validate_excel_structure(xls: pd.ExcelFile, sheet_map: dict[str, str]) -> list[str]:
+def validate_excel_structure(encabezados: dict[str, list[str]], sheet_map: dict[str, str]) -> list[str]:
+    """encabezados: hoja canónica -> primera fila de la hoja (ver core.xlsx_read.read_sheet)."""
     errores = []
     for canonical, columnas_esperadas in HOJAS_REQUERIDAS.items():
         if canonical not in sheet_map:
@@ -148,8 +156,7 @@ def validate_excel_structure(xls: pd.ExcelFile, sheet_map: dict[str, str]) -> li
             continue
 
         real_sheet = sheet_map[canonical]
-        df0 = pd.read_excel(xls, sheet_name=real_sheet, nrows=0)
-        columnas_reales = list(df0.columns)
+        columnas_reales = encabezados.get(canonical, [])
 
         faltantes = [c for c in columnas_esperadas if c not in columnas_reales]
         extras = [c for c in columnas_reales if c not in columnas_esperadas]
@@ -180,497 +187,853 @@ def _get_id(row):
         return None
 
 
-def process_catalogos_excel(*, excel_bytes: bytes, filename: str, actor_email: str, request_log: str) -> dict:
-    xls = pd.ExcelFile(BytesIO(excel_bytes))
 
-    sheet_map = resolve_sheet_map(xls.sheet_names)
-    errores = validate_excel_structure(xls, sheet_map)
+
+# -----------------------------
+# Normalización por columna (equivalentes vectorizados de normalizar_texto / safe_*)
+# -----------------------------
+_COMBINING: dict | None = None
+
+
+def _combining() -> dict:
+    """Tabla para str.translate que elimina los caracteres combinantes (acentos tras NFKD)."""
+    global _COMBINING
+    if _COMBINING is None:
+        _COMBINING = {cp: None for cp in range(sys.maxunicode + 1) if unicodedata.combining(chr(cp))}
+    return _COMBINING
+
+
+def _como_texto(s: pd.Series) -> tuple[pd.Series, pd.Series]:
+    nulos = s.isna()
+    return s.astype(object).where(~nulos, "").astype(str).str.strip(), nulos
+
+
+def normalizar_texto_col(s: pd.Series, max_len: int | None = None) -> pd.Series:
+    """normalizar_texto por columna: strip, sin acentos, mayúsculas, recorte; None si vacío."""
+    v, _ = _como_texto(s)
+    v = v.str.normalize("NFKD").str.translate(_combining()).str.upper()
+    if max_len is not None:
+        v = v.str.slice(0, max_len)
+    return v.astype(object).where(v.ne(""), None)
+
+
+def texto_plano_col(s: pd.Series, max_len: int, lower: bool = False) -> pd.Series:
+    """strip + recorte sin normalizar acentos/mayúsculas (correo, nombre, pwd, entidad)."""
+    v, nulos = _como_texto(s)
+    if lower:
+        v = v.str.lower()
+    return v.str.slice(0, max_len).astype(object).where(~nulos, None)
+
+
+def _numero_col(s: pd.Series, default) -> pd.Series:
+    n = pd.to_numeric(s.astype(object).where(s.notna(), None), errors="coerce").astype(float)
+    return n.where(np.isfinite(n), default)
+
+
+def safe_int_col(s: pd.Series, default: int = 0) -> pd.Series:
+    return np.trunc(_numero_col(s, default)).astype("int64")
+
+
+def safe_float_col(s: pd.Series, default: float = 0.0) -> pd.Series:
+    return _numero_col(s, default)
+
+
+def safe_date_col(s: pd.Series) -> pd.Series:
+    """Fechas de Excel (datetime) o texto ISO; lo demás -> None."""
+    d = pd.to_datetime(s.astype(object).where(s.notna(), None), errors="coerce", format="ISO8601")
+    return d.dt.date.astype(object).where(d.notna(), None)
+
+
+def _faltantes(*cols: pd.Series) -> np.ndarray:
+    """Máscara de filas con alguno de los campos requeridos vacío (None o '')."""
+    mask = np.zeros(len(cols[0]), dtype=bool)
+    for c in cols:
+        mask |= (c.isna() | c.astype(object).eq("")).to_numpy()
+    return mask
+
+
+def _error(sheet: str, rowno: int, error: str) -> dict:
+    return {"sheet": sheet, "row": rowno, "error": error}
+
+
+def _armar_filas(df: pd.DataFrame, sheet: str, columnas: list, malas: np.ndarray, error: str):
+    """
+    (filas, errores) de un lote ya normalizado: filas = (rowno, *columnas) de las filas
+    buenas (None en columnas = constante None, p. ej. FK por resolver).
+    """
+    ok = ~malas
+    rownos = df.index.to_numpy()
+    valores = [repeat(None) if c is None else c[ok].tolist() for c in columnas]
+    filas = list(zip(rownos[ok].tolist(), *valores))
+    errores = [_error(sheet, r, error) for r in rownos[malas].tolist()]
+    return filas, errores
+
+
+# -----------------------------
+# Normalización por hoja: lote (DataFrame con índice = fila de Excel) -> (filas, errores)
+# Cada fila es (rowno, *columnas, *auxiliares) en el orden de _Hoja.columnas + _Hoja.auxiliares;
+# las columnas FK van en None y se llenan en _resolver_fks.
+# -----------------------------
+def _filas_area(df: pd.DataFrame):
+    nombre = normalizar_texto_col(df["NOMBRE_AREA"], 300)  # varchar(300)
+    desc = normalizar_texto_col(df["DESC_AREA"], 500)      # varchar(500)
+    return _armar_filas(df, "Área", [nombre, desc], _faltantes(nombre), "NOMBRE_AREA vacío")
+
+
+def _filas_proveedor(df: pd.DataFrame):
+    rfc = normalizar_texto_col(df["RFC"], 13)
+    razon = normalizar_texto_col(df["RAZON_SOCIAL"], 300)
+    tipo = normalizar_texto_col(df["TIPO_PERSONA"], 10)
+    columnas = [
+        rfc, razon, tipo,
+        normalizar_texto_col(df["TELEFONO"], 15),
+        texto_plano_col(df["EMAIL"], 100),
+        normalizar_texto_col(df["ESTATUS"], 10).fillna("ACTIVO"),
+        normalizar_texto_col(df["NOMBRE_COMERCIAL"], 300),
+    ]
+    return _armar_filas(df, "Proveedor", columnas, _faltantes(rfc, razon, tipo),
+                        "RFC/RAZON_SOCIAL/TIPO_PERSONA requerido")
+
+
+def _filas_usuario(df: pd.DataFrame):
+    nombre = texto_plano_col(df["NOMBRE"], 200)
+    pwd = texto_plano_col(df["PWD"], 255)
+    correo = texto_plano_col(df["EMAIL"], 100, lower=True)
+    rol = normalizar_texto_col(df["ROL"], 20)
+    estatus = normalizar_texto_col(df["ESTATUS"], 10).fillna("ACTIVO")
+    return _armar_filas(df, "Usuario", [nombre, pwd, correo, rol, estatus],
+                        _faltantes(correo, nombre, rol, pwd), "NOMBRE/EMAIL/ROL/PWD requerido")
+
+
+def _filas_contrato(df: pd.DataFrame):
+    num_contrato = normalizar_texto_col(df["NUM_CONTRATO"], 50)
+    f_inicio = safe_date_col(df["F_INICIO"])
+    f_fin = safe_date_col(df["F_FIN"])
+    area_txt = normalizar_texto_col(df["AREA"], 300)
+    columnas = [
+        normalizar_texto_col(df["RFC_PP"], 13),
+        f_inicio,
+        f_fin,
+        num_contrato,
+        safe_int_col(df["EJERCICIO"]),
+        safe_int_col(df["MES"]),
+        safe_float_col(df["MONTO_TOTAL"]),
+        safe_float_col(df["MONTO_MAXIMO"]),
+        safe_float_col(df["MONTO_EJERCIDO"]),
+        normalizar_texto_col(df["ESTATUS"], 10).fillna("ACTIVO"),
+        None,  # area: se resuelve por area_txt
+        normalizar_texto_col(df["OBSERVACIONES"], 255),
+        normalizar_texto_col(df["TIPO DE CONTRATO"], 100),
+        area_txt,
+    ]
+    return _armar_filas(df, "Contrato", columnas, _faltantes(num_contrato, area_txt, f_inicio, f_fin),
+                        "NUM_CONTRATO/AREA/F_INICIO/F_FIN requerido")
+
+
+def _filas_partida(df: pd.DataFrame):
+    contrato_txt = normalizar_texto_col(df["CONTRATO"], 50)
+    partida_especifica = normalizar_texto_col(df["PARTIDA_ESPECIFICA"], 10)
+    entidad_txt = texto_plano_col(df["ENTIDAD"], 50)
+    columnas = [
+        None,  # contrato: se resuelve por contrato_txt
+        normalizar_texto_col(df["CAPITULO"], 50),
+        normalizar_texto_col(df["DES_CAP"], 50),
+        normalizar_texto_col(df["CONCEPTO"], 10),
+        normalizar_texto_col(df["DES_CONCEPTO"], 50),
+        normalizar_texto_col(df["USO_PARTIDA"], 10),
+        normalizar_texto_col(df["DES_USO_PARTIDA"], 50),
+        partida_especifica,
+        normalizar_texto_col(df["DES_PE"], 50),
+        normalizar_texto_col(df["TIPO_GASTO"], 30),
+        normalizar_texto_col(df["AUSTERIDAD"], 50),
+        normalizar_texto_col(df["PP"], 10),
+        normalizar_texto_col(df["DES_PP"], 50),
+        None,  # entidad: se resuelve por entidad_txt
+        safe_float_col(df["MONTO_TOTAL"]),
+        normalizar_texto_col(df["OBSERVACIONES"], 255),
+        contrato_txt,
+        entidad_txt,
+    ]
+    return _armar_filas(df, "Partida", columnas, _faltantes(contrato_txt, partida_especifica, entidad_txt),
+                        "CONTRATO/PARTIDA_ESPECIFICA/ENTIDAD requerido")
+
+
+# -----------------------------
+# Contraseñas (hoja Usuario)
+# -----------------------------
+CATALOGOS_HASH_PARALELO = int(os.getenv("CATALOGOS_HASH_PARALELO", "8"))  # desde aquí se usa el pool de procesos
+
+
+def _passwords(h: _Hoja, filas: list[tuple], estado: dict, rehash: bool) -> list[tuple]:
+    """
+    PWD en texto plano -> hash argon2; si verifica contra el hash guardado se conserva el
+    guardado (la fila puede quedar unchanged). Los PWD que ya vienen como hash pasan tal cual.
+    argon2 es caro a propósito: a partir de CATALOGOS_HASH_PARALELO contraseñas el lote se
+    reparte en el pool de procesos (executors.map_cpu, un proceso por núcleo).
+    Con rehash=False (vista previa) sólo se verifica: el texto plano distinto queda como update.
+    """
+    i_pwd = 1 + h.columnas.index("pwd")
+    i_llave = [1 + h.columnas.index(c) for c in h.llave]
+    j_pwd = h.actualizar.index("pwd")
+    planos = [k for k, f in enumerate(filas) if not is_password_hash(f[i_pwd])]
+    if not planos:
+        return filas
+
+    valores, actuales = [], []
+    for k in planos:
+        previos = estado.get(tuple(filas[k][i] for i in i_llave))
+        valores.append(filas[k][i_pwd])
+        actuales.append(previos[j_pwd] if previos else None)
+
+    if len(planos) >= CATALOGOS_HASH_PARALELO:
+        chunksize = max(1, len(planos) // (executors.EXEC_BATCH_WORKERS * 4))
+        hashes = executors.map_cpu(resolve_password_hash, valores, actuales, repeat(rehash), chunksize=chunksize)
+    else:
+        hashes = list(map(resolve_password_hash, valores, actuales, repeat(rehash)))
+
+    filas = list(filas)
+    for k, pwd in zip(planos, hashes):
+        f = filas[k]
+        filas[k] = f[:i_pwd] + (pwd,) + f[i_pwd + 1:]
+    return filas
+
+
+# -----------------------------
+# Carga por conjuntos: COPY a staging temporal + INSERT ... ON CONFLICT
+# (los índices únicos de los ON CONFLICT están en sql/003_catalogos_upsert.sql)
+# -----------------------------
+class _FK(NamedTuple):
+    columna: str   # columna destino (id)
+    texto: str     # auxiliar con el texto del Excel
+    tabla: str     # tabla referida (llave en _LLAVES_FK)
+    mensaje: str
+
+
+# Llave natural -> id de las tablas referidas, tal como se comparan contra el texto del Excel
+_LLAVES_FK = {
+    "area": "upper(trim(nombre_area))",
+    "contrato": "num_contrato",
+    "entidad": "nombre",
+    "proveedor": "rfc",
+}
+
+
+class _Mapas:
+    """
+    Diccionarios llave -> id por tabla referida: se cargan con un SELECT la primera
+    vez que una hoja los usa y se actualizan con lo que insertan las hojas previas,
+    así las FKs se resuelven en memoria (sin una consulta por fila).
+    """
+
+    def __init__(self, cur) -> None:
+        self._cur = cur
+        self._mapas: dict[str, dict] = {}
+
+    def get(self, tabla: str) -> dict:
+        mapa = self._mapas.get(tabla)
+        if mapa is None:
+            self._cur.execute(f"SELECT id, {_LLAVES_FK[tabla]} AS llave FROM cat_facturas.{tabla} ORDER BY id")
+            mapa = {}
+            for r in self._cur.fetchall():
+                mapa.setdefault(r["llave"], r["id"])  # duplicados: el primero, como el LIMIT 1 anterior
+            self._mapas[tabla] = mapa
+        return mapa
+
+    def registrar(self, tabla: str, pares) -> None:
+        # si aún no se carga, el SELECT posterior (misma transacción) ya verá estas filas
+        mapa = self._mapas.get(tabla)
+        if mapa is not None:
+            for llave, id_ in pares:
+                mapa.setdefault(llave, id_)
+
+    def provisional(self, tabla: str, llaves) -> None:
+        """dry_run: llaves que se insertarían, con ids negativos para que las hojas siguientes resuelvan."""
+        mapa = self.get(tabla)
+        for llave in llaves:
+            if llave not in mapa:
+                mapa[llave] = -(len(mapa) + 1)
+
+
+class _Hoja(NamedTuple):
+    nombre: str                       # hoja canónica (llave de summary)
+    tabla: str                        # cat_facturas.<tabla>
+    columnas: tuple                   # columnas destino, en el orden de las filas
+    llave: tuple                      # llave natural (DISTINCT ON; si se repite gana la última fila)
+    conflicto: str                    # destino del ON CONFLICT
+    actualizar: tuple                 # columnas que se actualizan si ya existe
+    filas: Callable[[pd.DataFrame], tuple]
+    auxiliares: tuple = ()            # textos de FK (no se copian a staging)
+    fks: tuple = ()
+    auditoria: str | None = None      # "CONTRATO" / "PARTIDA": audita ALTA/EDICION por id
+    llave_sql: tuple = ()             # expresiones SQL de la llave (default: llave), como en el índice único
+    preparar: Callable | None = None  # (h, filas, snapshot, rehash) -> filas; antes del diff (Usuario: PWD)
+
+
+_HOJAS = (
+    _Hoja(
+        "Área", "area",
+        ("nombre_area", "desc_area"),
+        ("nombre_area",), "((upper(trim(nombre_area))))",
+        ("desc_area",),
+        _filas_area,
+        llave_sql=("upper(trim(nombre_area))",),
+    ),
+    _Hoja(
+        "Proveedor", "proveedor",
+        ("rfc", "razon_social", "tipo_persona", "telefono", "email", "estatus", "nombre_comercial"),
+        ("rfc",), "(rfc)",
+        ("razon_social", "tipo_persona", "telefono", "email", "estatus", "nombre_comercial"),
+        _filas_proveedor,
+    ),
+    _Hoja(
+        "Usuario", "usuario",
+        ("nombre", "pwd", "correo", "rol", "estatus"),
+        ("correo",), "((lower(correo)))",
+        ("nombre", "pwd", "rol", "estatus"),
+        _filas_usuario,
+        llave_sql=("lower(correo)",),
+        preparar=_passwords,
+    ),
+    _Hoja(
+        "Contrato", "contrato",
+        ("rfc_pp", "f_inicio", "f_fin", "num_contrato", "ejercicio", "mes",
+         "monto_total", "monto_maximo", "monto_ejercido", "estatus", "area", "observaciones", "tipo_de_contrato"),
+        ("num_contrato",), "(num_contrato)",
+        ("rfc_pp", "f_inicio", "f_fin", "ejercicio", "mes", "monto_total", "monto_maximo", "monto_ejercido",
+         "estatus", "area", "observaciones", "tipo_de_contrato"),
+        _filas_contrato,
+        auxiliares=("area_txt",),
+        fks=(_FK("area", "area_txt", "area", "Área no encontrada"),),
+        auditoria="CONTRATO",
+    ),
+    _Hoja(
+        "Partida", "partida",
+        ("contrato", "capitulo", "des_cap", "concepto", "des_concepto", "uso_partida", "des_uso_partida",
+         "partida_especifica", "des_pe", "tipo_gasto", "austeridad", "pp", "des_pp", "entidad",
+         "monto_total", "observaciones"),
+        ("contrato", "partida_especifica"), "(contrato, partida_especifica)",
+        ("capitulo", "des_cap", "concepto", "des_concepto", "uso_partida", "des_uso_partida", "des_pe",
+         "tipo_gasto", "austeridad", "pp", "des_pp", "entidad", "monto_total", "observaciones"),
+        _filas_partida,
+        auxiliares=("contrato_txt", "entidad_txt"),
+        fks=(
+            _FK("contrato", "contrato_txt", "contrato", "Contrato no encontrado"),
+            _FK("entidad", "entidad_txt", "entidad", "Entidad no encontrada"),
+        ),
+        auditoria="PARTIDA",
+    ),
+)
+
+# tablas cuyas llaves resuelven FKs de otras hojas
+_TABLAS_REFERIDAS = frozenset(fk.tabla for h in _HOJAS for fk in h.fks)
+
+
+def _sql_staging(h: _Hoja) -> str:
+    # mismos tipos que la tabla destino, sin constraints; se borra con el commit/rollback
+    return (
+        f"CREATE TEMP TABLE _stg_{h.tabla} ON COMMIT DROP AS "
+        f"SELECT NULL::int AS rowno, {', '.join(h.columnas)} "
+        f"FROM cat_facturas.{h.tabla} WITH NO DATA"
+    )
+
+
+def _sql_upsert(h: _Hoja) -> str:
+    cols = ", ".join(h.columnas)
+    llave = ", ".join(h.llave)
+    sets = ", ".join(f"{c}=EXCLUDED.{c}" for c in h.actualizar)
+    llave_fk = _LLAVES_FK.get(h.tabla, "NULL")
+    return (
+        f"INSERT INTO cat_facturas.{h.tabla} ({cols}) "
+        f"SELECT DISTINCT ON ({llave}) {cols} FROM _stg_{h.tabla} ORDER BY {llave}, rowno DESC "
+        f"ON CONFLICT {h.conflicto} DO UPDATE SET {sets} "
+        f"RETURNING id, (xmax = 0) AS inserted, {llave_fk} AS llave"
+    )
+
+
+def _resolver_fks(h: _Hoja, filas: list[tuple], mapas: _Mapas) -> tuple[list[tuple], list[dict]]:
+    """Sustituye los textos de FK por ids con los mapas; filas sin resolver se reportan juntas."""
+    if not h.fks:
+        return filas, []
+    n = 1 + len(h.columnas)
+    pos = [
+        (1 + h.columnas.index(fk.columna), n + h.auxiliares.index(fk.texto), mapas.get(fk.tabla), fk.mensaje)
+        for fk in h.fks
+    ]
+    resueltas, errores = [], []
+    for fila in filas:
+        fila = list(fila)
+        for i_col, i_txt, mapa, mensaje in pos:
+            id_ = mapa.get(fila[i_txt])
+            if id_ is None:
+                errores.append(_error(h.nombre, fila[0], f"{mensaje}: {fila[i_txt]}"))
+                break
+            fila[i_col] = id_
+        else:
+            resueltas.append(fila)
+    return resueltas, errores
+
+
+# -----------------------------
+# Diff contra lo que ya hay en BD (dry_run y omisión de filas sin cambios)
+# -----------------------------
+CATALOGOS_MUESTRAS = int(os.getenv("CATALOGOS_MUESTRAS", "20"))  # muestras por tipo y hoja
+_OCULTAS = frozenset({"pwd"})
+
+
+def _snapshot(cur, h: _Hoja) -> dict:
+    """llave natural -> valores actuales de las columnas que actualiza el upsert (un SELECT por hoja)."""
+    llaves = h.llave_sql or h.llave
+    cols = ", ".join([f"{e} AS _k{i}" for i, e in enumerate(llaves)] + list(h.actualizar))
+    cur.execute(f"SELECT {cols} FROM cat_facturas.{h.tabla}")
+    n = len(llaves)
+    estado: dict = {}
+    for r in cur.fetchall():
+        vals = tuple(r.values())
+        estado.setdefault(vals[:n], vals[n:])
+    return estado
+
+
+def _igual(a, b) -> bool:
+    if a is None or b is None:
+        return a is None and b is None
+    if isinstance(a, (int, float, Decimal)) and isinstance(b, (int, float, Decimal)):
+        return float(a) == float(b)
+    return a == b
+
+
+def _json(col: str, v):
+    if col in _OCULTAS and v is not None:
+        return "********"
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return v
+
+
+_FALTA = object()
+
+
+class _Diff:
+    """
+    Clasifica cada fila (insert / update / noop) contra el snapshot de la tabla, que se
+    va actualizando con las filas previas del mismo archivo (si una llave se repite se
+    compara contra la fila anterior: la última sigue ganando en el DISTINCT ON).
+    """
+
+    def __init__(self, h: _Hoja, estado: dict) -> None:
+        self.h = h
+        self.estado = estado
+        self.conteo = {"insert": 0, "update": 0, "noop": 0}
+        self.muestras: dict[str, list] = {"insert": [], "update": [], "noop": []}
+        self.nuevas: list = []  # llaves insertadas (dry_run: FKs provisionales)
+        self._undo: list | None = None  # (llave, valor previo) desde marcar()
+        self._marca: tuple = ()
+        self._llave = [1 + h.columnas.index(c) for c in h.llave]
+        self._act = [1 + h.columnas.index(c) for c in h.actualizar]
+        # en la llave visible, las FKs se muestran con el texto del Excel (no el id)
+        n = 1 + len(h.columnas)
+        textos = {fk.columna: n + h.auxiliares.index(fk.texto) for fk in h.fks}
+        self._visible = [textos.get(c, 1 + h.columnas.index(c)) for c in h.llave]
+
+    def filtrar(self, filas: list) -> list:
+        """Cuenta/muestrea las filas y regresa sólo las que hay que escribir."""
+        escribir = []
+        for fila in filas:
+            llave = tuple(fila[i] for i in self._llave)
+            nuevos = tuple(fila[i] for i in self._act)
+            previos = self.estado.get(llave)
+            if llave not in self.estado:
+                tipo = "insert"
+                self.nuevas.append(llave[0])
+            elif all(_igual(a, b) for a, b in zip(previos, nuevos)):
+                tipo = "noop"
+            else:
+                tipo = "update"
+            self.conteo[tipo] += 1
+            if len(self.muestras[tipo]) < CATALOGOS_MUESTRAS:
+                self.muestras[tipo].append(self._muestra(tipo, fila, previos, nuevos))
+            if tipo != "noop":
+                if self._undo is not None:
+                    self._undo.append((llave, self.estado.get(llave, _FALTA)))
+                self.estado[llave] = nuevos
+                escribir.append(fila)
+        return escribir
+
+    def marcar(self) -> None:
+        """Inicio de un lote: deshacer() regresa estado y conteos a este punto."""
+        self._undo = []
+        self._marca = (dict(self.conteo), len(self.nuevas))
+
+    def deshacer(self) -> int:
+        """El lote no se aplicó (rollback): revierte estado/conteos; regresa las filas del lote."""
+        for llave, previo in reversed(self._undo or ()):
+            if previo is _FALTA:
+                self.estado.pop(llave, None)
+            else:
+                self.estado[llave] = previo
+        conteo, nuevas = self._marca
+        filas = self.procesadas - sum(conteo.values())
+        self.conteo = dict(conteo)
+        del self.nuevas[nuevas:]
+        self._undo = []
+        return filas
+
+    def _muestra(self, tipo: str, fila, previos, nuevos) -> dict:
+        m = {"row": fila[0], "llave": " / ".join(str(fila[i]) for i in self._visible)}
+        if tipo == "insert":
+            m["valores"] = {c: _json(c, fila[1 + i]) for i, c in enumerate(self.h.columnas) if c not in self.h.llave}
+        elif tipo == "update":
+            m["cambios"] = {
+                c: [_json(c, a), _json(c, b)]
+                for c, a, b in zip(self.h.actualizar, previos, nuevos)
+                if not _igual(a, b)
+            }
+        return m
+
+    @property
+    def procesadas(self) -> int:
+        return sum(self.conteo.values())
+
+
+def _lotes_validos(
+    h: _Hoja,
+    lotes: Iterable[pd.DataFrame],
+    mapas: _Mapas,
+    row_errors: list,
+    desde_fila: int = 0,
+) -> Iterator[tuple[list, int, int]]:
+    """(filas válidas, última fila de Excel del lote, filas leídas); omite filas <= desde_fila (reanudación)."""
+    for df in lotes:
+        if desde_fila:
+            df = df[df.index > desde_fila]
+            if df.empty:
+                continue
+        filas, errores = h.filas(df)
+        filas, errores_fk = _resolver_fks(h, filas, mapas)
+        row_errors.extend(errores)
+        row_errors.extend(errores_fk)
+        yield filas, int(df.index[-1]), len(df)
+
+
+def _ordenar_errores(errores: list[dict]) -> list[dict]:
+    return sorted(errores, key=lambda e: e["row"] or 0)
+
+
+def _aplicar_hoja(
+    cur,
+    h: _Hoja,
+    lotes: Iterable[pd.DataFrame],
+    mapas: _Mapas,
+    sql_log: list[dict],
+    *,
+    summary: dict,
+    row_errors: list[dict],
+    dry_run: bool = False,
+    chunk: int | None = None,
+    desde_fila: int = 0,
+    al_lote: Callable[[_Hoja, list, int], None] | None = None,
+) -> dict:
+    """
+    Normaliza lote por lote (la hoja nunca está completa en memoria), compara contra el
+    snapshot de la tabla y copia a staging sólo las filas nuevas o con cambios; el upsert
+    se aplica cada `chunk` filas leídas (None = una vez por hoja). Cada lote corre en su
+    savepoint: si falla (constraint, tipo, lectura) sólo ese lote se reporta como error.
+    Tras cada lote aplicado se llama al_lote(h, ids [(id, inserted)], última fila).
+    Con dry_run sólo compara (no escribe nada).
+    Acumula conteos en summary[h.nombre] y errores en row_errors; regresa las muestras del diff.
+    """
+    cuenta = summary[h.nombre]
+    errores: list[dict] = []  # errores de normalización/FK del lote en curso
+
+    for fk in h.fks:
+        mapas.get(fk.tabla)  # antes del COPY: no se puede consultar con el COPY abierto
+    diff = _Diff(h, _snapshot(cur, h))
+    validos = _lotes_validos(h, lotes, mapas, errores, desde_fila)
+    if h.preparar:
+        validos = ((h.preparar(h, filas, diff.estado, not dry_run), u, n) for filas, u, n in validos)
+
+    def _sumar(conteo: dict, fallidas: int = 0) -> None:
+        cuenta["inserted"] += conteo["insert"]
+        cuenta["updated"] += conteo["update"]
+        cuenta["unchanged"] += conteo["noop"]
+        cuenta["errors"] += len(errores) + fallidas
+        row_errors.extend(_ordenar_errores(errores))
+        errores.clear()
+
+    if dry_run:
+        for filas, _, _ in validos:
+            diff.filtrar(filas)
+        if h.tabla in _TABLAS_REFERIDAS:
+            mapas.provisional(h.tabla, diff.nuevas)
+        muestras = {**diff.muestras, "errors": errores[:CATALOGOS_MUESTRAS]}
+        _sumar(diff.conteo)
+        return muestras
+
+    muestras_errores: list[dict] = []
+    n = 1 + len(h.columnas)
+    upsert = _sql_upsert(h)
+    pendiente = True
+    while pendiente:
+        diff.marcar()
+        antes = dict(diff.conteo)
+        ultima, leidas, escritas, returned = None, 0, 0, []
+        cur.execute("SAVEPOINT carga_lote")
+        try:
+            cur.execute(f"DROP TABLE IF EXISTS _stg_{h.tabla}")
+            cur.execute(_sql_staging(h))
+            with cur.copy(f"COPY _stg_{h.tabla} (rowno, {', '.join(h.columnas)}) FROM STDIN") as copy:
+                for filas, ultima, n_leidas in validos:
+                    for fila in diff.filtrar(filas):
+                        copy.write_row(fila[:n])
+                        escritas += 1
+                    leidas += n_leidas
+                    if chunk and leidas >= chunk:
+                        break
+                else:
+                    pendiente = False
+            if escritas:
+                sql_log.append({"sheet": h.nombre, "action": "UPSERT", "rows": escritas, "sql": upsert})
+                cur.execute(upsert)
+                returned = cur.fetchall()
+            cur.execute("RELEASE SAVEPOINT carga_lote")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT carga_lote")
+            # las filas del lote cuentan como error; el error del lote se reporta sin fila
+            lote = {"sheet": h.nombre, "row": None, "action": "UPSERT", "error": str(e)}
+            muestras_errores.extend(([lote] + errores)[: CATALOGOS_MUESTRAS - len(muestras_errores)])
+            _sumar({"insert": 0, "update": 0, "noop": 0}, diff.deshacer())
+            row_errors.append(lote)
+            if ultima is None:  # falló antes de leer (staging/lectura): no hay lote que saltar
+                break
+            if al_lote:
+                al_lote(h, [], ultima)
+            continue
+
+        if ultima is None:  # la hoja ya no tenía filas
+            break
+        muestras_errores.extend(errores[: CATALOGOS_MUESTRAS - len(muestras_errores)])
+        _sumar({k: diff.conteo[k] - antes[k] for k in antes})
+        if h.tabla in _LLAVES_FK:
+            mapas.registrar(h.tabla, ((r["llave"], r["id"]) for r in returned))
+        if al_lote:
+            al_lote(h, [(r["id"], r["inserted"]) for r in returned], ultima)
+
+    return {**diff.muestras, "errors": muestras_errores}
+
+
+def _auditar_ids(actor_email: str, entidad: str, ids: list[tuple]) -> None:
+    seccion = f"cat_facturas.{entidad.lower()}"
+    titulo = entidad.capitalize()
+    for id_, inserted in ids:
+        if inserted:
+            accion, descripcion = f"ALTA {entidad}", f"Alta {titulo} id={id_}"
+        else:
+            accion, descripcion = f"EDICION {entidad}", f"Edicion {titulo} id={id_}"
+        audit(
+            correo=actor_email,
+            accion=accion,
+            descripcion=descripcion,
+            log_accion="",
+            seccion=seccion,
+            id_sec=str(id_),
+        )
+
+
+def _lotes_hoja(encabezados: list[str], batches) -> Iterator[pd.DataFrame]:
+    # dtype=object: conserva los tipos de celda (un entero con huecos no se vuelve float)
+    for rownos, rows in batches:
+        yield pd.DataFrame(rows, columns=encabezados, index=rownos, dtype=object)
+
+
+# -----------------------------
+# Importación por lotes (trabajos en segundo plano: services/catalogos_jobs_service.py)
+# -----------------------------
+_LOCK_KEY = "cat_facturas.catalogos_import"
+
+
+class CatalogoImportEnCurso(RuntimeError):
+    """Otra importación de catálogos tiene el advisory lock."""
+
+
+class Lotes(NamedTuple):
+    """
+    Commit cada `filas` filas leídas. Tras cada lote (misma transacción, antes del commit)
+    se llama guardar(cur, punto) con el punto de control:
+        {"hoja", "fila", "filas", "filas_total", "summary", "row_errors", "sheet_map"}
+    Con `reanudar` (un punto previo) se omiten las hojas/filas ya confirmadas.
+    """
+    filas: int
+    guardar: Callable[[object, dict], None]
+    reanudar: dict | None = None
+
+
+def process_catalogos_excel(
+    *,
+    excel_bytes: bytes,
+    filename: str,
+    actor_email: str,
+    request_log: str,
+    dry_run: bool = False,
+    lotes: Lotes | None = None,
+) -> dict:
+    """
+    Carga masiva de catálogos. Con dry_run=True no escribe nada: regresa lo que haría
+    (summary + "diff" con muestras de inserts/updates/noops/errores por hoja).
+    Sin `lotes` todo va en una transacción; con `lotes` se confirma por bloques y se
+    puede reanudar. Si otra importación está en curso: CatalogoImportEnCurso.
+    """
+    wb = open_workbook(excel_bytes)
+    lectores: list[Prefetch] = []
+    try:
+        return _process_workbook(
+            wb, lectores, filename=filename, actor_email=actor_email, dry_run=dry_run, lotes=lotes
+        )
+    finally:
+        for lector in lectores:
+            lector.close()
+        wb.close()
+
+
+def _process_workbook(
+    wb,
+    lectores: list[Prefetch],
+    *,
+    filename: str,
+    actor_email: str,
+    dry_run: bool,
+    lotes: Lotes | None,
+) -> dict:
+    sheet_map = resolve_sheet_map(wb.sheetnames)
+
+    # Una pasada por hoja: la primera fila valida la estructura y el resto se lee en lotes
+    # (con commits por bloque el lote de lectura no excede el bloque)
+    batch = min(XLSX_READ_BATCH, lotes.filas) if lotes else XLSX_READ_BATCH
+    hojas = {
+        c: read_sheet(wb[real], batch_size=batch) for c, real in sheet_map.items() if c in HOJAS_REQUERIDAS
+    }
+    errores = validate_excel_structure({c: enc for c, (enc, _) in hojas.items()}, sheet_map)
     if errores:
         return {
             "ok": False,
             "message": "El Excel no cumple la estructura requerida (hojas/columnas).",
             "file": filename,
             "errors": errores,
-            "detected_sheets": xls.sheet_names,
+            "detected_sheets": wb.sheetnames,
             "sheet_map": sheet_map,
         }
 
-    # Lee usando nombres REALES (tolerancia aplicada)
-    df_area = pd.read_excel(xls, sheet_name=sheet_map["Área"])
-    df_prov = pd.read_excel(xls, sheet_name=sheet_map["Proveedor"])
-    df_user = pd.read_excel(xls, sheet_name=sheet_map["Usuario"])
-    df_contrato = pd.read_excel(xls, sheet_name=sheet_map["Contrato"])
-    df_partida = pd.read_excel(xls, sheet_name=sheet_map["Partida"])
-    df_orden = pd.read_excel(xls, sheet_name=sheet_map["Orden"])
-
-    summary = {
-        "Área": {"inserted": 0, "updated": 0, "errors": 0},
-        "Proveedor": {"inserted": 0, "updated": 0, "errors": 0},
-        "Usuario": {"inserted": 0, "updated": 0, "errors": 0},
-        "Contrato": {"inserted": 0, "updated": 0, "errors": 0},
-        "Partida": {"inserted": 0, "updated": 0, "errors": 0},
-        "Orden": {"inserted": 0, "updated": 0, "errors": 0},
+    # Punto de control previo (reanudación): hojas anteriores ya quedaron confirmadas
+    previo = (lotes.reanudar if lotes else None) or {}
+    nombres = [h.nombre for h in _HOJAS]
+    inicio = nombres.index(previo["hoja"]) if previo.get("hoja") in nombres else 0
+    pendientes = _HOJAS[inicio:]
+
+    # Las hojas se parsean en paralelo (un hilo c/u, XLSX_READ_AHEAD lotes por adelantado)
+    # mientras se aplican en orden de dependencias
+    lotes_hoja: dict[str, Prefetch] = {}
+    for h in pendientes:
+        encabezados, batches = hojas[h.nombre]
+        lotes_hoja[h.nombre] = Prefetch(_lotes_hoja(encabezados, batches), name=f"catalogos-{h.tabla}")
+        lectores.append(lotes_hoja[h.nombre])
+
+    summary = previo.get("summary") or {
+        "Área": {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0},
+        "Proveedor": {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0},
+        "Usuario": {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0},
+        "Contrato": {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0},
+        "Partida": {"inserted": 0, "updated": 0, "unchanged": 0, "errors": 0},
     }
 
-    row_errors: list[dict] = []
+    row_errors: list[dict] = list(previo.get("row_errors") or [])
+    diff: dict[str, dict] = {}
+    punto = {
+        "hoja": previo.get("hoja"),
+        "fila": previo.get("fila", 0),
+        "filas": previo.get("filas", 0),
+        # dimensión declarada de cada hoja (sin encabezado): estimado para el avance
+        "filas_total": sum(max(0, (wb[sheet_map[h.nombre]].max_row or 1) - 1) for h in _HOJAS),
+        "summary": summary,
+        "row_errors": row_errors,
+        "sheet_map": sheet_map,
+    }
 
     debug = os.getenv("DEBUG", "0") == "1"
     debug_attempts: list[dict] = []
 
+    # Orden de las hojas = orden de dependencias (Contrato usa Área, Partida usa Contrato)
     with get_conn() as conn:
+        bloqueado = False
         try:
             with conn.cursor() as cur:
-                def _log_attempt(sheet: str, rowno: int, action: str, sql: str, params):
-                    # Guarda intentos sólo en modo debug para no inflar la respuesta
-                    if debug:
-                        debug_attempts.append({
-                            "sheet": sheet,
-                            "row": rowno,
-                            "action": action,
-                            "sql": sql,
-                            "params": repr(params),
-                        })
-
-                def _exec_iou(sheet: str, rowno: int, action: str, sql: str, params):
-                    """Execute INSERT/UPDATE y registra error por fila; en debug incluye query+params."""
-                    _log_attempt(sheet, rowno, action, sql, params)
-                    try:
-                        cur.execute(sql, params)
-                        return True
-                    except Exception as e:
-                        err = {"sheet": sheet, "row": rowno, "action": action, "error": str(e)}
-                        if debug:
-                            err["sql"] = sql
-                            err["params"] = repr(params)
-                        row_errors.append(err)
-                        return False
-
-                # 1) ÁREA (upsert por nombre) - con recorte varchar(300/500)
-                for idx, r in df_area.iterrows():
-                    try:
-                        nombre = normalizar_texto(r.get("NOMBRE_AREA"), max_len=300)  # varchar(300)
-                        desc = normalizar_texto(r.get("DESC_AREA"), max_len=500)      # varchar(500)
-
-                        if not nombre:
-                            summary["Área"]["errors"] += 1
-                            row_errors.append({"sheet": "Área", "row": int(idx) + 2, "error": "NOMBRE_AREA vacío"})
-                            continue
-
-                        cur.execute(
-                            "SELECT id FROM cat_facturas.area WHERE upper(trim(nombre_area))=upper(trim(%s)) LIMIT 1",
-                            (nombre,),
-                        )
-                        hit = cur.fetchone()
-
-                        uid = _get_id(hit)
-
-                        if not hit:
-                            if _exec_iou("Área", int(idx)+2, "INSERT", "INSERT INTO cat_facturas.area (nombre_area, desc_area) VALUES (%s, %s)", (nombre, desc)):
-                                summary["Área"]["inserted"] += 1
-                        else:
-                            if _exec_iou("Área", int(idx)+2, "UPDATE", "UPDATE cat_facturas.area SET desc_area=%s WHERE id=%s", (desc, int(uid))):
-                                summary["Área"]["updated"] += 1
-                    except Exception as e:
-                        summary["Área"]["errors"] += 1
-                        row_errors.append({"sheet": "Área", "row": int(idx) + 2, "error": str(e)})
-
-                # 2) PROVEEDOR (upsert RFC)
-                for idx, r in df_prov.iterrows():
-                    rfc = normalizar_texto(r.get("RFC"), max_len=13)
-                    razon = normalizar_texto(r.get("RAZON_SOCIAL"), max_len=300)
-                    tipo = normalizar_texto(r.get("TIPO_PERSONA"), max_len=10)
-                    tel = normalizar_texto(r.get("TELEFONO"), max_len=15)
-                    email = (str(r.get("EMAIL")).strip()[:100] if r.get("EMAIL") is not None and not pd.isna(r.get("EMAIL")) else None)
-                    estatus = normalizar_texto(r.get("ESTATUS"), max_len=10) or "ACTIVO"
-                    nom_com = normalizar_texto(r.get("NOMBRE_COMERCIAL"), max_len=300)
-
-                    if not rfc or not razon or not tipo:
-                        summary["Proveedor"]["errors"] += 1
-                        row_errors.append({"sheet": "Proveedor", "row": int(idx) + 2, "error": "RFC/RAZON_SOCIAL/TIPO_PERSONA requerido"})
-                        continue
-                    
-                    
-                    cur.execute("SELECT id FROM cat_facturas.proveedor WHERE rfc=%s LIMIT 1", (rfc,))
-                    hit = cur.fetchone()
-                    prov_id = _get_id(hit)
-                    if not prov_id:
-                        if _exec_iou("Proveedor", int(idx)+2, "INSERT", """
-                            INSERT INTO cat_facturas.proveedor
-                            (rfc, razon_social, tipo_persona, telefono, email, estatus, nombre_comercial)
-                            VALUES (%s,%s,%s,%s,%s,%s,%s)
-                        """, (rfc, razon, tipo, tel, email, estatus, nom_com)):
-                            summary["Proveedor"]["inserted"] += 1
-                    else:
-                        #print(int(hit[0]))
-                        if _exec_iou("Proveedor", int(idx)+2, "UPDATE", """
-                            UPDATE cat_facturas.proveedor
-                            SET razon_social=%s, tipo_persona=%s, telefono=%s, email=%s, estatus=%s, nombre_comercial=%s
-                            WHERE id=%s
-                        """, (razon, tipo, tel, email, estatus, nom_com, int(prov_id))):
-                            summary["Proveedor"]["updated"] += 1
-
-                # 3) USUARIO (upsert correo)
-                for idx, r in df_user.iterrows():
-                    nombre = (str(r.get("NOMBRE")).strip()[:200] if r.get("NOMBRE") is not None and not pd.isna(r.get("NOMBRE")) else None)
-                    correo = (str(r.get("EMAIL")).strip().lower()[:100] if r.get("EMAIL") is not None and not pd.isna(r.get("EMAIL")) else None)
-                    rol = normalizar_texto(r.get("ROL"), max_len=20)
-                    estatus = normalizar_texto(r.get("ESTATUS"), max_len=10) or "ACTIVO"
-                    pwd = (str(r.get("PWD")).strip()[:255] if r.get("PWD") is not None and not pd.isna(r.get("PWD")) else None)
-
-                    if not correo or not nombre or not rol or not pwd:
-                        summary["Usuario"]["errors"] += 1
-                        row_errors.append({"sheet": "Usuario", "row": int(idx) + 2, "error": "NOMBRE/EMAIL/ROL/PWD requerido"})
-                        continue
-
-                    cur.execute("SELECT id FROM cat_facturas.usuario WHERE lower(correo)=lower(%s) LIMIT 1", (correo,))
-                    hit = cur.fetchone()
-                    uid = _get_id(hit)
-
-                    if not hit:
-                        if _exec_iou("Usuario", int(idx)+2, "INSERT", """
-                            INSERT INTO cat_facturas.usuario (nombre, pwd, correo, rol, estatus)
-                            VALUES (%s,%s,%s,%s,%s)
-                        """, (nombre, pwd, correo, rol, estatus)):
-                            summary["Usuario"]["inserted"] += 1
-                    else:
-                        if _exec_iou("Usuario", int(idx)+2, "UPDATE", """
-                            UPDATE cat_facturas.usuario
-                            SET nombre=%s, pwd=%s, rol=%s, estatus=%s
-                            WHERE id=%s
-                        """, (nombre, pwd, rol, estatus, int(uid))):
-                            summary["Usuario"]["updated"] += 1
-
-                # 4) CONTRATO (upsert num_contrato) + FK area por nombre_area
-                for idx, r in df_contrato.iterrows():
-                    rfc_pp = normalizar_texto(r.get("RFC_PP"), max_len=13)
-                    f_inicio = safe_date(r.get("F_INICIO"))
-                    f_fin = safe_date(r.get("F_FIN"))
-                    num_contrato = normalizar_texto(r.get("NUM_CONTRATO"), max_len=50)
-                    ejercicio = safe_int(r.get("EJERCICIO"))
-                    mes = safe_int(r.get("MES"))
-                    monto_total = safe_float(r.get("MONTO_TOTAL"))
-                    monto_maximo = safe_float(r.get("MONTO_MAXIMO"))
-                    monto_ejercido = safe_float(r.get("MONTO_EJERCIDO"))
-                    estatus = normalizar_texto(r.get("ESTATUS"), max_len=10) or "ACTIVO"
-                    area_txt = normalizar_texto(r.get("AREA"), max_len=300)
-                    obs = normalizar_texto(r.get("OBSERVACIONES"), max_len=255)
-                    tc = normalizar_texto(r.get("TIPO DE CONTRATO"),max_len = 100)
-
-
-                    if not num_contrato or not area_txt or not f_inicio or not f_fin:
-                        summary["Contrato"]["errors"] += 1
-                        row_errors.append({"sheet": "Contrato", "row": int(idx) + 2, "error": "NUM_CONTRATO/AREA/F_INICIO/F_FIN requerido"})
-                        continue
-
-                    cur.execute("SELECT id FROM cat_facturas.area WHERE upper(trim(nombre_area))=upper(trim(%s)) LIMIT 1", (area_txt,))
-                    area_row = cur.fetchone()
-                    prov_id = _get_id(area_row)
-                    if not area_row:
-                        summary["Contrato"]["errors"] += 1
-                        row_errors.append({"sheet": "Contrato", "row": int(idx) + 2, "error": f"Área no encontrada: {area_txt}"})
-                        continue
-                    area_id = int(prov_id)
-
-                    cur.execute("SELECT id FROM cat_facturas.contrato WHERE num_contrato=%s LIMIT 1", (num_contrato,))
-                    hit = cur.fetchone()
-                    cont_id = _get_id(hit);
-                    if not cont_id:
-                        if _exec_iou("Contrato", int(idx)+2, "INSERT", """
-                            INSERT INTO cat_facturas.contrato
-                            (rfc_pp, f_inicio, f_fin, num_contrato, ejercicio, mes,
-                             monto_total, monto_maximo, monto_ejercido, estatus, area, observaciones, tipo_de_contrato)
-                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s, %s)
-                        """, (rfc_pp, f_inicio, f_fin, num_contrato, ejercicio, mes,
-                              monto_total, monto_maximo, monto_ejercido, estatus, area_id, obs, tc)):
-                            summary["Contrato"]["inserted"] += 1
-                        
-                         # Obtener el id recién insertado
-                        cur.execute("SELECT id FROM cat_facturas.contrato WHERE num_contrato=%s LIMIT 1", (num_contrato,))
-                        row2 = cur.fetchone()
-                        part_idt2 = _get_id(row2)
-                       
-                        audit(
-                            correo=actor_email,
-                            accion="ALTA CONTRATO",
-                            descripcion=f"Alta Contrato id={part_idt2}",
-                            log_accion="",
-                            seccion="cat_facturas.contrato",
-                            id_sec= str(part_idt2)
-                        )
-
-                    else:
-                        if _exec_iou("Contrato", int(idx)+2, "UPDATE", """
-                            UPDATE cat_facturas.contrato
-                            SET rfc_pp=%s, f_inicio=%s, f_fin=%s, ejercicio=%s, mes=%s,
-                                monto_total=%s, monto_maximo=%s, monto_ejercido=%s,
-                                estatus=%s, area=%s, observaciones=%s, tipo_de_contrato=%s
-                            WHERE id=%s
-                        """, (rfc_pp, f_inicio, f_fin, ejercicio, mes,
-                              monto_total, monto_maximo, monto_ejercido,
-                              estatus, area_id, obs, tc, int(cont_id ))):
-                            summary["Contrato"]["updated"] += 1
-                        
-                        audit(
-                            correo=actor_email,
-                            accion="EDICION CONTRATO",
-                            descripcion=f"Edicion Contrato id={cont_id}",
-                            log_accion="",
-                            seccion="cat_facturas.contrato",
-                            id_sec= str(cont_id)
-                        )
-
-                # 5) PARTIDA (upsert contrato_id + partida_especifica) + FK entidad por nombre
-                for idx, r in df_partida.iterrows():
-                    contrato_txt = normalizar_texto(r.get("CONTRATO"), max_len=50)
-                    partida_especifica = normalizar_texto(r.get("PARTIDA_ESPECIFICA"), max_len=10)
-                    entidad_txt = (str(r.get("ENTIDAD")).strip()[:50] if r.get("ENTIDAD") is not None and not pd.isna(r.get("ENTIDAD")) else None)
-
-                    capitulo = normalizar_texto(r.get("CAPITULO"), max_len=50)
-                    des_cap = normalizar_texto(r.get("DES_CAP"), max_len=50)
-                    concepto = normalizar_texto(r.get("CONCEPTO"), max_len=10)
-                    des_concepto = normalizar_texto(r.get("DES_CONCEPTO"), max_len=50)
-                    uso_partida = normalizar_texto(r.get("USO_PARTIDA"), max_len=10)
-                    des_uso_partida = normalizar_texto(r.get("DES_USO_PARTIDA"), max_len=50)
-                    des_pe = normalizar_texto(r.get("DES_PE"), max_len=50)
-                    tipo_gasto = normalizar_texto(r.get("TIPO_GASTO"), max_len=30)
-                    austeridad = normalizar_texto(r.get("AUSTERIDAD"), max_len=50)
-                    pp = normalizar_texto(r.get("PP"), max_len=10)
-                    des_pp = normalizar_texto(r.get("DES_PP"), max_len=50)
-                    monto_total = safe_float(r.get("MONTO_TOTAL"))
-                    obs = normalizar_texto(r.get("OBSERVACIONES"), max_len=255)
-
-                    if not contrato_txt or not partida_especifica or not entidad_txt:
-                        summary["Partida"]["errors"] += 1
-                        row_errors.append({"sheet": "Partida", "row": int(idx) + 2, "error": "CONTRATO/PARTIDA_ESPECIFICA/ENTIDAD requerido"})
-                        continue
-
-                    cur.execute("SELECT id FROM cat_facturas.contrato WHERE num_contrato=%s LIMIT 1", (contrato_txt,))
-                    contrato_row = cur.fetchone()
-                    cont_id = _get_id(contrato_row)
-                    if not cont_id:
-                        summary["Partida"]["errors"] += 1
-                        row_errors.append({"sheet": "Partida", "row": int(idx) + 2, "error": f"Contrato no encontrado: {contrato_txt}"})
-                        continue
-                    contrato_id = int(cont_id)
-
-                    cur.execute("SELECT id FROM cat_facturas.entidad WHERE nombre=%s LIMIT 1", (entidad_txt,))
-                    entidad_row = cur.fetchone()
-                    entidad_id = _get_id(entidad_row)
-                    if not entidad_id:
-                        summary["Partida"]["errors"] += 1
-                        row_errors.append({"sheet": "Partida", "row": int(idx) + 2, "error": f"Entidad no encontrada: {entidad_txt}"})
-                        continue
-                    
-                    cur.execute("""
-                        SELECT id FROM cat_facturas.partida
-                        WHERE contrato=%s AND partida_especifica=%s
-                        LIMIT 1
-                    """, (contrato_id, partida_especifica))
-                    hit = cur.fetchone()
-                    part_id = _get_id(hit)
-#
-                    if not part_id:
-                        if _exec_iou("Partida", int(idx)+2, "INSERT", """
-                            INSERT INTO cat_facturas.partida
-                            (contrato, capitulo, des_cap, concepto, des_concepto,
-                             uso_partida, des_uso_partida, partida_especifica, des_pe,
-                             tipo_gasto, austeridad, pp, des_pp, entidad, monto_total, observaciones)
-                            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                        """, (contrato_id, capitulo, des_cap, concepto, des_concepto,
-                              uso_partida, des_uso_partida, partida_especifica, des_pe,
-                              tipo_gasto, austeridad, pp, des_pp, entidad_id, monto_total, obs)):
-                            summary["Partida"]["inserted"] += 1
-
-                        # Obtener el id recién insertado
-                        cur.execute("""
-                            SELECT id FROM cat_facturas.partida
-                            WHERE contrato=%s AND partida_especifica=%s
-                            LIMIT 1
-                        """, (contrato_id, partida_especifica))
-                        row1 = cur.fetchone()
-                        part_idt = _get_id(row1)
-                       
-                        audit(
-                            correo=actor_email,
-                            accion="ALTA PARTIDA",
-                            descripcion=f"Alta Partida id={part_idt}",
-                            log_accion="",
-                            seccion="cat_facturas.partida",
-                            id_sec= str(part_idt)
-                        )
-
-                    else:
-                        if _exec_iou("Partida", int(idx)+2, "UPDATE", """
-                            UPDATE cat_facturas.partida
-                            SET capitulo=%s, des_cap=%s, concepto=%s, des_concepto=%s,
-                                uso_partida=%s, des_uso_partida=%s, des_pe=%s,
-                                tipo_gasto=%s, austeridad=%s, pp=%s, des_pp=%s,
-                                entidad=%s, monto_total=%s, observaciones=%s
-                            WHERE id=%s
-                        """, (capitulo, des_cap, concepto, des_concepto,
-                              uso_partida, des_uso_partida, des_pe,
-                              tipo_gasto, austeridad, pp, des_pp,
-                              entidad_id, monto_total, obs, int(part_id))):
-                            summary["Partida"]["updated"] += 1
-
-                        audit(
-                            correo=actor_email,
-                            accion="EDICION PARTIDA",
-                            descripcion=f"Edicion Partida id={part_id}",
-                            log_accion="",
-                            seccion="cat_facturas.partida",
-                            id_sec= str(part_id)
-                        )
-#
-                # 6) ORDEN SUMINISTRO: PROVEEDOR en Excel = RFC
-                #for idx, r in df_orden.iterrows():
-                 #   rowno = int(idx) + 2
-                  #  partida_txt = normalizar_texto(r.get("PARTIDA"), max_len=10)
-                #    proveedor = normalizar_texto(r.get("PROVEEDOR"))
-
-##
-#                    fecha_orden = safe_date(r.get("FECHA_ORDEN"))
-#                    folio_oficio = normalizar_texto(r.get("FOLIO_OFICIO"), max_len=20)
-#                    fecha_factura = safe_date(r.get("FECHA_FACTURA"))
-#                    folio_interno = normalizar_texto(r.get("FOLIO_INTERNO"), max_len=20)
-#                    cuenta_bancaria = normalizar_texto(r.get("CUENTA_BANCARIA"), max_len=30)
-#                    banco = normalizar_texto(r.get("BANCO"), max_len=20)
-#                    mes_servicio = normalizar_texto(r.get("MES_SERVICIO"), max_len=10)
-##
-#                    monto_siniva = safe_float(r.get("MONTO_SINIVA"))
-#                    iva = safe_float(r.get("IVA"))
-#                    monto_c_iva = safe_float(r.get("MONTO_C_IVA"))
-#                    isr = safe_float(r.get("ISR"))
-#                    ieps = safe_float(r.get("IEPS"))
-#                    descuento = safe_float(r.get("DESCUENTO"))
-#                    otras_contrib = safe_float(r.get("OTRAS_CONTRIBUCIONES"))
-#                    retenciones = safe_float(r.get("RETENCIONES"))
-#                    penalizacion = safe_float(r.get("PENALIZACION"))
-#                    deductiva = safe_float(r.get("DEDUCTIVA"))
-#                    importe_pago = safe_float(r.get("IMPORTE_PAGO"))
-#                    importe_p_comp = safe_float(r.get("IMPORTE_P_COMPROMISO"))
-#                    no_comp = safe_int(r.get("NO_COMPROMISO"))
-#                    estatus = safe_int(r.get("ESTATUS"), 1)
-#                    fecha_pago = safe_date(r.get("FECHA_PAGO"))
-#                    archivo = normalizar_texto(r.get("ARCHIVO"), max_len=100)
-#                    obs = normalizar_texto(r.get("OBSERVACIONES"), max_len=255)
-##
-#                    # Validaciones básicas
-#                    if not partida_txt or not proveedor:
-#                        summary["Orden"]["errors"] += 1
-#                        row_errors.append({"sheet": "Orden", "row": rowno, "error": "PARTIDA/PROVEEDOR(RFC) requerido"})
-#                        continue
-#                    
-#                    
-#                    # Obtener ID de partida
-#                    cur.execute("SELECT id FROM cat_facturas.partida WHERE partida_especifica=%s LIMIT 1", (partida_txt,))
-#                    partida_row = cur.fetchone()
-#                    if not partida_row:
-#                        summary["Orden"]["errors"] += 1
-#                        row_errors.append({"sheet": "Orden", "row": rowno, "error": f"Partida no encontrada: {partida_txt}"})
-#                        continue
-#                    partida_id = _get_id(partida_row)
-#
-#                    # Obtener ID de proveedor
-#                    cur.execute("SELECT id FROM cat_facturas.proveedor WHERE razon_social=%s LIMIT 1", (proveedor,))
-#                    prov_row = cur.fetchone()
-#                    if not prov_row:
-#                        summary["Orden"]["errors"] += 1
-#                        row_errors.append({"sheet": "Orden", "row": rowno, "error": f"Proveedor no encontrado por RFC: {proveedor}"})
-#                        continue
-#                    prov_id = _get_id(prov_row)
-#
-#                    # Buscar orden existente
-#                    cur.execute("""
-#                        SELECT id FROM cat_facturas.orden_suministro
-#                        WHERE partida=%s AND proveedor=%s
-#                        LIMIT 1
-#                    """, (partida_id, prov_id))
-#                    hit = cur.fetchone()
-#                    uid = _get_id(hit)
-#
-#                    if not hit:
-#                        if _exec_iou("Orden", int(idx)+2, "INSERT", """
-#                            INSERT INTO cat_facturas.orden_suministro
-#                            (partida, proveedor, fecha_orden, folio_oficio, fecha_factura, folio_interno,
-#                             cuenta_bancaria, banco, mes_servicio, monto_siniva, iva, monto_c_iva, isr, ieps,
-#                             descuento, otras_contribuciones, retenciones, penalizacion, deductiva,
-#                             importe_pago, importe_p_compromiso, no_compromiso, observaciones,
-#                             estatus, fecha_pago, archivo)
-#                            VALUES
-#                            (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-#                        """, (partida_id, prov_id, fecha_orden, folio_oficio, fecha_factura, folio_interno,
-#                              cuenta_bancaria, banco, mes_servicio, monto_siniva, iva, monto_c_iva, isr, ieps,
-#                              descuento, otras_contrib, retenciones, penalizacion, deductiva,
-#                              importe_pago, importe_p_comp, no_comp, obs,
-#                              estatus, fecha_pago, archivo)):
-#                            summary["Orden"]["inserted"] += 1
-#
-#                         # Obtener el id recién insertado
-#                        cur.execute("""
-#                        SELECT id FROM cat_facturas.orden_suministro
-#                        WHERE partida=%s AND proveedor=%s
-#                        LIMIT 1
-#                    """, (partida_id, prov_id))
-#                        row3 = cur.fetchone()
-#                        part_idt3 = _get_id(row3)
-#                       
-#                        audit(
-#                            correo=actor_email,
-#                            accion="ALTA ORDEN",
-#                            descripcion=f"Alta Orden id={part_idt3}",
-#                            log_accion="",
-#                            seccion="cat_facturas.orden_suministro",
-#                            id_sec= str(part_idt3)
-#                        )   
-#
-#                    else:
-#                        if _exec_iou("Orden", int(idx)+2, "UPDATE", """
-#                            UPDATE cat_facturas.orden_suministro
-#                            SET fecha_orden=%s, folio_oficio=%s, fecha_factura=%s, folio_interno=%s,
-#                                cuenta_bancaria=%s, banco=%s, mes_servicio=%s,
-#                                monto_siniva=%s, iva=%s, monto_c_iva=%s, isr=%s, ieps=%s, descuento=%s,
-#                                otras_contribuciones=%s, retenciones=%s, penalizacion=%s, deductiva=%s,
-#                                importe_pago=%s, importe_p_compromiso=%s, no_compromiso=%s,
-#                                observaciones=%s, estatus=%s, fecha_pago=%s, archivo=%s
-#                            WHERE id=%s
-#                        """, (fecha_orden, folio_oficio, fecha_factura, folio_interno,
-#                              cuenta_bancaria, banco, mes_servicio,
-#                              monto_siniva, iva, monto_c_iva, isr, ieps, descuento,
-#                              otras_contrib, retenciones, penalizacion, deductiva,
-#                              importe_pago, importe_p_comp, no_comp,
-#                              obs, estatus, fecha_pago, archivo, int(uid))):
-#                            summary["Orden"]["updated"] += 1
-#
-#                        audit(
-#                            correo=actor_email,
-#                            accion="EDICION ORDEN",
-#                            descripcion=f"Edicion Orden id={uid}",
-#                            log_accion="",
-#                            seccion="cat_facturas.orden_suministro",
-#                            id_sec= str(uid)
-#                        )
-
-            conn.commit()
+                if not dry_run:
+                    # una importación a la vez (sesión: sobrevive a los commits por lote)
+                    cur.execute("SELECT pg_try_advisory_lock(hashtext(%s)) AS ok", (_LOCK_KEY,))
+                    bloqueado = cur.fetchone()["ok"]
+                    if not bloqueado:
+                        raise CatalogoImportEnCurso("Hay otra importación de catálogos en curso; intenta más tarde.")
+
+                def al_lote(h: _Hoja, ids: list, fila: int) -> None:
+                    if h.auditoria:
+                        _auditar_ids(actor_email, h.auditoria, ids)
+                    if lotes is None:
+                        return
+                    punto["filas"] += max(0, fila - punto["fila"])
+                    punto["fila"] = fila
+                    lotes.guardar(cur, punto)
+                    conn.commit()
+                    data_version.touch()
+
+                mapas = _Mapas(cur)
+                for h in pendientes:
+                    if punto["hoja"] != h.nombre:
+                        punto.update(hoja=h.nombre, fila=1)  # fila 1 = encabezados
+                    diff[h.nombre] = _aplicar_hoja(
+                        cur, h, lotes_hoja[h.nombre], mapas, debug_attempts,
+                        summary=summary,
+                        row_errors=row_errors,
+                        dry_run=dry_run,
+                        chunk=lotes.filas if lotes else None,
+                        desde_fila=previo.get("fila", 0) if h.nombre == previo.get("hoja") else 0,
+                        al_lote=al_lote,
+                    )
+
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+                data_version.touch()
 
         except Exception:
             conn.rollback()
             raise
+        finally:
+            if bloqueado:
+                try:
+                    conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", (_LOCK_KEY,))
+                    conn.commit()
+                except Exception as e:
+                    # conexión rota: el servidor ya liberó el lock de la sesión
+                    print("No fue posible liberar el lock de catálogos:", str(e))
 
     result = {
         "ok": True,
-        "message": "Archivo procesado correctamente.",
+        "dry_run": dry_run,
+        "message": "Vista previa: no se guardó ningún cambio." if dry_run else "Archivo procesado correctamente.",
         "file": filename,
         "total_sheets": len(HOJAS_REQUERIDAS),
         "sheet_map": sheet_map,
         "summary": summary,
         "row_errors": row_errors[:2000],
+        "diff": diff,
         "notes": [
             "Se aceptan variantes de nombres de hoja (acentos/mayúsculas/espacios).",
-            "Orden.PROVEEDOR debe ser RFC (12/13) y debe existir previamente en cat_facturas.proveedor.",
-            "Usuario.PWD debe venir como hash compatible con tu login (ej. $argon2id$...).",
+            "Usuario.PWD puede venir en texto plano (se guarda su hash argon2) o ya como hash $argon2id$...; "
+            "si coincide con la contraseña actual no se modifica.",
             "Partida.ENTIDAD se busca por nombre en cat_facturas.entidad; debe existir previamente.",
-            "Se recortan textos a longitudes de columnas para evitar errores varchar."
+            "Se recortan textos a longitudes de columnas para evitar errores varchar.",
+            "Si una llave (nombre de área, RFC, correo, num. contrato, contrato+partida) se repite en una hoja, gana la última fila.",
+            "Las filas idénticas a lo que ya existe no se escriben (unchanged).",
         ],
     }
 
@@ -3,6 +3,7 @@ from __future__ import annotations
 
 from typing import Optional
 from psycopg.rows import dict_row
+from core import data_version
 from core.db import get_conn
 
 def os_exists(os_id: int) -> bool:
@@ -46,7 +47,8 @@ def insert_cfdi(os_id: int, uuid: str, rfc_emisor: str, fecha_recepcion, fecha_e
         with conn.cursor(row_factory=dict_row) as cur:
             cur.execute(sql, (os_id, uuid, rfc_emisor, fecha_recepcion, fecha_emision, observaciones, xml_factura))
             row = cur.fetchone()
-            conn.commit() 
+            conn.commit()
+            data_version.touch()
             return int(row["id"])
 
 def update_cfdi_meta(cfdi_id: int, fecha_recepcion, fecha_emision, observaciones: str | None) -> None:
@@ -58,6 +60,7 @@ def update_cfdi_meta(cfdi_id: int, fecha_recepcion, fecha_emision, observaciones
               WHERE id=%s;
             """, (fecha_recepcion, fecha_emision, observaciones, cfdi_id))
             conn.commit()
+            data_version.touch()
 
 def update_cfdi_xml(cfdi_id: int, uuid: str, rfc_emisor: str, fecha_recepcion, fecha_emision, xml_factura: str) -> None:
     with get_conn() as conn:
@@ -68,9 +71,11 @@ def update_cfdi_xml(cfdi_id: int, uuid: str, rfc_emisor: str, fecha_recepcion, f
               WHERE id=%s;
             """, (uuid, rfc_emisor, fecha_recepcion, fecha_emision, xml_factura, cfdi_id))
             conn.commit()
+            data_version.touch()
  
 def delete_cfdi(cfdi_id: int) -> None:
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM cat_facturas.cfdi WHERE id=%s;", (cfdi_id,))
             conn.commit()
+            data_version.touch()
@@ -3,9 +3,11 @@ from __future__ import annotations
 
 import os
 from datetime import datetime, date
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from core.db import get_conn
+from core.db import get_conn, unit_of_work
+from core.db_async import get_aconn
+from core import cfdi_batch, data_version
 from core.cfdi_core import build_validation_checklist, extract_cfdi_fields
 from core.audit import audit, build_log
 
@@ -29,53 +31,55 @@ def _to_date(s: str) -> Optional[date]:
         return None
     return datetime.fromisoformat(s).date()
 
+def _list_facturas_query(q: str) -> tuple[str, list]:
+    sql = """
+    SELECT
+      c.id as cfdi_id,
+      c.uuid,
+      c.rfc_emisor,
+      c.fecha_emision,
+      c.fecha_recepcion,
+      c.estatus as cfdi_estatus,
+      c.orden_suministro as os_id,
+
+      os.partida as partida_id,
+      p.contrato as contrato_id,
+
+      pr.id as proveedor_id,
+      pr.rfc as proveedor_rfc,
+      pr.razon_social as proveedor_razon,
+
+      p.partida_especifica as partida,
+      ct.num_contrato as contrato,
+      ct.tipo_de_contrato,
+      eo.estatus_reporte,
+
+      CASE WHEN os.partida IS NOT NULL THEN TRUE ELSE FALSE END as os_tiene_partida,
+      CASE WHEN p.id IS NOT NULL THEN TRUE ELSE FALSE END as partida_existe,
+      CASE WHEN ct.id IS NOT NULL THEN TRUE ELSE FALSE END as contrato_existe
+    FROM cat_facturas.cfdi c
+    LEFT JOIN cat_facturas.orden_suministro os ON os.id = c.orden_suministro
+    LEFT JOIN cat_facturas.estado_orden eo ON eo.id = os.estatus
+    LEFT JOIN cat_facturas.partida p ON p.id = os.partida
+    LEFT JOIN cat_facturas.contrato ct ON ct.id = p.contrato
+    LEFT JOIN cat_facturas.proveedor pr ON pr.id = os.proveedor
+    WHERE 1=1
+    """
+    params = []
+    if q:
+        sql += " AND (c.uuid ILIKE %s OR c.rfc_emisor ILIKE %s OR pr.rfc ILIKE %s OR pr.razon_social ILIKE %s)"
+        like = f"%{q}%"
+        params += [like, like, like, like]
+    sql += " ORDER BY c.id DESC LIMIT 500"
+    return sql, params
+
 def list_facturas(q: str = "") -> List[Dict[str, Any]]:
     """
     Lista CFDI (facturas) con proveedor y OS/partida/contrato para flags.
     """
-    q = (q or "").strip()
+    sql, params = _list_facturas_query((q or "").strip())
     with get_conn() as conn:
         with conn.cursor() as cur:
-            sql = """
-            SELECT
-              c.id as cfdi_id,
-              c.uuid,
-              c.rfc_emisor,
-              c.fecha_emision,
-              c.fecha_recepcion,
-              c.estatus as cfdi_estatus,
-              c.orden_suministro as os_id,
-
-              os.partida as partida_id,
-              p.contrato as contrato_id,
-
-              pr.id as proveedor_id,
-              pr.rfc as proveedor_rfc,
-              pr.razon_social as proveedor_razon,
-
-              p.partida_especifica as partida,
-              ct.num_contrato as contrato,
-              ct.tipo_de_contrato,
-              eo.estatus_reporte,
-
-              CASE WHEN os.partida IS NOT NULL THEN TRUE ELSE FALSE END as os_tiene_partida,
-              CASE WHEN p.id IS NOT NULL THEN TRUE ELSE FALSE END as partida_existe,
-              CASE WHEN ct.id IS NOT NULL THEN TRUE ELSE FALSE END as contrato_existe
-            FROM cat_facturas.cfdi c
-            LEFT JOIN cat_facturas.orden_suministro os ON os.id = c.orden_suministro
-            LEFT JOIN cat_facturas.estado_orden eo ON eo.id = os.estatus
-            LEFT JOIN cat_facturas.partida p ON p.id = os.partida
-            LEFT JOIN cat_facturas.contrato ct ON ct.id = p.contrato
-            LEFT JOIN cat_facturas.proveedor pr ON pr.id = os.proveedor
-            WHERE 1=1
-            """
-            params = []
-            if q:
-                sql += " AND (c.uuid ILIKE %s OR c.rfc_emisor ILIKE %s OR pr.rfc ILIKE %s OR pr.razon_social ILIKE %s)"
-                like = f"%{q}%"
-                params += [like, like, like, like]
-            sql += " ORDER BY c.id DESC LIMIT 500"
-
             cur.execute(sql, params)
             cols = [d[0] for d in cur.description]
             out = []
@@ -86,6 +90,13 @@ def list_facturas(q: str = "") -> List[Dict[str, Any]]:
                     out.append(dict(zip(cols, row)))
             return out
 
+async def list_facturas_async(q: str = "") -> List[Dict[str, Any]]:
+    sql, params = _list_facturas_query((q or "").strip())
+    async with get_aconn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
+
 def get_factura_audit(cfdi_id: str) -> List[Dict[str, Any]]:
     with get_conn() as conn:
         with conn.cursor() as cur:
@@ -154,44 +165,59 @@ def get_factura_detalle(cfdi_id: int) -> Optional[Dict[str, Any]]:
             cols = [d[0] for d in cur.description]
             return dict(zip(cols, row))
   
-def list_contratos() -> List[Dict[str, Any]]:
+_CONTRATOS_SQL = "SELECT id, num_contrato, rfc_pp, ejercicio, mes, tipo_de_contrato FROM cat_facturas.contrato WHERE estatus='ACTIVO' ORDER BY id DESC"
+_PARTIDAS_SQL = """
+    SELECT id, partida_especifica, des_pe, monto_total
+    FROM cat_facturas.partida
+    WHERE contrato=%s
+    ORDER BY id DESC
+"""
+_EST_SIAF_SQL = "select id, nombre as estado_siaf from cat_facturas.estatus_siaf order by 1"
+_FISCALIZADOR_SQL = "select id, nombre as fiscalizador from cat_facturas.usuario where tipo = 'FISCALIZACION' order by 1"
+
+def _fetch_all(sql: str, params=None) -> List[Dict[str, Any]]:
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT id, num_contrato, rfc_pp, ejercicio, mes, tipo_de_contrato FROM cat_facturas.contrato WHERE estatus='ACTIVO' ORDER BY id DESC")
-            cols = [d[0] for d in cur.description]
-            items = [dict(r) for r in cur.fetchall()]
-            #print(items)
-            return items 
+            cur.execute(sql, params)
+            return [dict(r) for r in cur.fetchall()]
+
+async def _fetch_all_async(sql: str, params=None) -> List[Dict[str, Any]]:
+    async with get_aconn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchall()
+
+def list_contratos() -> List[Dict[str, Any]]:
+    return _fetch_all(_CONTRATOS_SQL)
 
 def list_partidas_by_contrato(contrato_id: int) -> List[Dict[str, Any]]:
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT id, partida_especifica, des_pe, monto_total
-                FROM cat_facturas.partida
-                WHERE contrato=%s
-                ORDER BY id DESC
-            """, (contrato_id,))  
-            #cols = [d[0] for d in cur.description]
-            return [dict(r) for r in cur.fetchall()]
+    return _fetch_all(_PARTIDAS_SQL, (contrato_id,))
 
 def list_est_siaf() -> List[dict[str,Any]]:
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("select id, nombre as estado_siaf from cat_facturas.estatus_siaf order by 1")
-            items = [dict(r) for r in cur.fetchall()]
-            return items
+    return _fetch_all(_EST_SIAF_SQL)
 
 def list_fiscalizador() -> List[dict[str,Any]]:
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("select id, nombre as fiscalizador from cat_facturas.usuario where tipo = 'FISCALIZACION' order by 1")
-            items = [dict(r) for r in cur.fetchall()]
-            return items
+    return _fetch_all(_FISCALIZADOR_SQL)
 
-def validate_cfdi(xml_bytes: bytes) -> Dict[str, Any]:
-    checklist = build_validation_checklist(xml_bytes)
+async def list_contratos_async() -> List[Dict[str, Any]]:
+    return await _fetch_all_async(_CONTRATOS_SQL)
+
+async def list_partidas_by_contrato_async(contrato_id: int) -> List[Dict[str, Any]]:
+    return await _fetch_all_async(_PARTIDAS_SQL, (contrato_id,))
+
+async def list_est_siaf_async() -> List[dict[str,Any]]:
+    return await _fetch_all_async(_EST_SIAF_SQL)
+
+async def list_fiscalizador_async() -> List[dict[str,Any]]:
+    return await _fetch_all_async(_FISCALIZADOR_SQL)
 
+def _apply_lookups(
+    checklist: Dict[str, Any],
+    proveedor_id: Optional[int],
+    cfdi_id: Optional[int],
+    dup_file: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Completa el checklist con el resultado de las búsquedas de RFC (proveedor) y UUID (cfdi)."""
     extracted = checklist.get("extracted") or {}
     rfc_emisor = extracted.get("rfc_emisor")
     uuid = extracted.get("uuid")
@@ -200,29 +226,23 @@ def validate_cfdi(xml_bytes: bytes) -> Dict[str, Any]:
     rfc_ok = False
     rfc_msg = "RFC emisor no detectado en XML."
     if rfc_emisor:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id FROM cat_facturas.proveedor WHERE rfc=%s LIMIT 1", (rfc_emisor,))
-                hit = cur.fetchone()
-                rfc_ok = bool(_get_id(hit))
-                rfc_msg = "RFC existe en catálogo de proveedores." if rfc_ok else "RFC NO existe en catálogo de proveedores."
-    checklist["rfc_ok"] = rfc_ok
-    checklist["messages"].append(rfc_msg)
+        rfc_ok = bool(proveedor_id)
+        rfc_msg = "RFC existe en catálogo de proveedores." if rfc_ok else "RFC NO existe en catálogo de proveedores."
 
-    # 2) UUID no duplicado
+    # 2) UUID no duplicado (en BD o, para lotes, dentro del mismo lote)
     uuid_ok = False
     uuid_msg = "UUID no detectado en XML."
     if uuid:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id FROM cat_facturas.cfdi WHERE uuid=%s LIMIT 1", (uuid,))
-                hit = cur.fetchone()
-                if hit:
-                    uuid_ok = False
-                    uuid_msg = f"UUID ya registrado (cfdi.id={_get_id(hit)})."
-                else:
-                    uuid_ok = True
-                    uuid_msg = "UUID no existe en BD (OK)."
+        if cfdi_id:
+            uuid_msg = f"UUID ya registrado (cfdi.id={cfdi_id})."
+        elif dup_file:
+            uuid_msg = f"UUID repetido en el lote ({dup_file})."
+        else:
+            uuid_ok = True
+            uuid_msg = "UUID no existe en BD (OK)."
+
+    checklist["rfc_ok"] = rfc_ok
+    checklist["messages"].append(rfc_msg)
 
     checklist["uuid_ok"] = uuid_ok
     checklist["messages"].append(uuid_msg)
@@ -234,6 +254,92 @@ def validate_cfdi(xml_bytes: bytes) -> Dict[str, Any]:
     return checklist
 
 
+def validate_cfdi(xml_bytes: bytes) -> Dict[str, Any]:
+    return lookup_cfdi(build_validation_checklist(xml_bytes))
+
+
+def lookup_cfdi(checklist: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Parte de BD de validate_cfdi: RFC en proveedores y UUID no duplicado.
+    Recibe el checklist de build_validation_checklist (que puede correr en otro proceso).
+    """
+    extracted = checklist.get("extracted") or {}
+    rfc_emisor = extracted.get("rfc_emisor")
+    uuid = extracted.get("uuid")
+
+    proveedor_id = cfdi_id = None
+    if rfc_emisor or uuid:
+        # una sola conexión para ambas búsquedas
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                if rfc_emisor:
+                    cur.execute("SELECT id FROM cat_facturas.proveedor WHERE rfc=%s LIMIT 1", (rfc_emisor,))
+                    proveedor_id = _get_id(cur.fetchone())
+                if uuid:
+                    cur.execute("SELECT id FROM cat_facturas.cfdi WHERE uuid=%s LIMIT 1", (uuid,))
+                    cfdi_id = _get_id(cur.fetchone())
+    return _apply_lookups(checklist, proveedor_id, cfdi_id)
+
+
+_LOTE_RFC_SQL = "SELECT rfc, MIN(id) AS id FROM cat_facturas.proveedor WHERE rfc = ANY(%s) GROUP BY rfc"
+_LOTE_UUID_SQL = "SELECT uuid, MIN(id) AS id FROM cat_facturas.cfdi WHERE uuid = ANY(%s) GROUP BY uuid"
+
+
+async def _lookup_lote_async(rfcs: List[str], uuids: List[str]) -> tuple[Dict[str, int], Dict[str, int]]:
+    """RFC -> proveedor.id y UUID -> cfdi.id con una consulta = ANY(%s) cada una."""
+    rfc_ids: Dict[str, int] = {}
+    uuid_ids: Dict[str, int] = {}
+    if not rfcs and not uuids:
+        return rfc_ids, uuid_ids
+    async with get_aconn() as conn:
+        async with conn.cursor() as cur:
+            if rfcs:
+                await cur.execute(_LOTE_RFC_SQL, (rfcs,))
+                rfc_ids = {r["rfc"]: r["id"] for r in await cur.fetchall()}
+            if uuids:
+                await cur.execute(_LOTE_UUID_SQL, (uuids,))
+                uuid_ids = {r["uuid"]: r["id"] for r in await cur.fetchall()}
+    return rfc_ids, uuid_ids
+
+
+async def validate_cfdi_lote_async(
+    items: List[tuple[str, bytes]],
+    chunk_size: int = 0,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Valida un lote [(nombre, xml_bytes)] y produce un reporte por archivo (en orden).
+    XML/XSD/timbre van al pool de procesos; RFC/UUID se resuelven por bloque
+    con una consulta cada uno. chunk_size=0 procesa todo el lote en un solo bloque.
+    """
+    seen: Dict[str, str] = {}  # uuid -> primer archivo del lote que lo trae
+    size = chunk_size or len(items) or 1
+    for start in range(0, len(items), size):
+        checks = await cfdi_batch.validate_many(items[start:start + size])
+
+        rfcs = {(c.get("extracted") or {}).get("rfc_emisor") for c in checks} - {None}
+        uuids = {(c.get("extracted") or {}).get("uuid") for c in checks} - {None}
+        rfc_ids, uuid_ids = await _lookup_lote_async(sorted(rfcs), sorted(uuids))
+
+        for c in checks:
+            extracted = c.get("extracted") or {}
+            uuid = extracted.get("uuid")
+            dup_file = seen.get(uuid) if uuid else None
+            if uuid and dup_file is None:
+                seen[uuid] = c["file"]
+            c.pop("timings_ms", None)
+            yield _apply_lookups(c, rfc_ids.get(extracted.get("rfc_emisor")), uuid_ids.get(uuid), dup_file)
+
+
+def _lock_uuid(cur, uuid: str) -> Optional[int]:
+    """
+    Toma un advisory lock de transacción sobre el UUID y regresa el id del CFDI
+    si ya existe. El candado se libera en el commit/rollback del unit of work.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ("cfdi.uuid:" + uuid,))
+    cur.execute("SELECT id FROM cat_facturas.cfdi WHERE uuid=%s LIMIT 1", (uuid,))
+    return _get_id(cur.fetchone())
+
+
 def create_factura_and_os(
     actor_email: str,
     log: str,
@@ -306,14 +412,19 @@ def create_factura_and_os(
     numero_solicitud27: Optional[str] = None,
     clc27: Optional[str] = None,
     capturista: Optional[str] = None,
-    
+
+    # campos ya extraídos en /validar (ticket); si no vienen se extraen del XML
+    extracted: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     # Extrae del XML ORIGINAL (incluye timbre)
-    extracted = extract_cfdi_fields(xml_bytes)
+    if extracted is None:
+        extracted = extract_cfdi_fields(xml_bytes)
     #Datos de factura
     uuid = extracted.get("uuid")
     rfc_emisor = extracted.get("rfc_emisor")
     fecha_emision = extracted.get("fecha_emision")#fecha_factura
+    if isinstance(fecha_emision, str):
+        fecha_emision = _to_date(fecha_emision)
     monto_siniva = extracted.get("subtotal")
     iva = extracted.get("iva")
     monto_c_iva = extracted.get("con_iva")
@@ -331,8 +442,14 @@ def create_factura_and_os(
         return {"ok": False, "message": "No ha seleccionado una partida"}
     
     xml_str = xml_bytes.decode("utf-8", errors="replace")  
-    with get_conn() as conn:
+    # OS + CFDI + auditorías en una sola transacción (se une al unit of work del request si existe)
+    with unit_of_work(), get_conn() as conn:
         with conn.cursor() as cur:
+            # UUID único: candado por UUID hasta el commit (evita altas duplicadas concurrentes)
+            dup_id = _lock_uuid(cur, uuid)
+            if dup_id:
+                return {"ok": False, "message": f"UUID ya registrado (cfdi.id={dup_id})."}
+
             # crea OS
             cur.execute("""
                 INSERT INTO cat_facturas.orden_suministro
@@ -414,6 +531,7 @@ def create_factura_and_os(
                 id_sec= str(cfdi_id)
             )
         conn.commit()
+        data_version.touch()
     return ret
     
 
@@ -480,7 +598,7 @@ def update_factura_and_os(
     numero_solicitud27: Optional[str] = None,
     clc27: Optional[str] = None,
 ) -> Dict[str, Any]:
-    with get_conn() as conn:
+    with unit_of_work(), get_conn() as conn:
         with conn.cursor() as cur:
             # obtener OS padre
             cur.execute("SELECT orden_suministro FROM cat_facturas.cfdi WHERE id=%s", (cfdi_id,))
@@ -618,6 +736,7 @@ def update_factura_and_os(
             )
         )
         conn.commit()
+        data_version.touch()
     ret = {"ok":True,"message":"Registro actualizado correctamente"}
     return ret
 
@@ -630,4 +749,5 @@ def set_cfdi_estatus(cfdi_id: int, estatus: str) -> Dict[str, Any]:
         with conn.cursor() as cur:
             cur.execute("UPDATE cat_facturas.cfdi SET estatus=%s WHERE id=%s", (estatus, cfdi_id))
             conn.commit()
+            data_version.touch()
     return {"ok": True}
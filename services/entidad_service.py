@@ -1,6 +1,7 @@
 # services/entidad_service.py
 from __future__ import annotations
 from psycopg.rows import dict_row
+from core import data_version
 from core.db import get_conn
 
 ESTATUS = {"ACTIVO", "INACTIVO"}
@@ -56,6 +57,7 @@ def create_entidad(data: dict):
         with conn.cursor() as cur:
             cur.execute(sql, payload)
             conn.commit()
+            data_version.touch()
 
 def update_entidad(eid: str, data: dict):
     validate_entidad(data)
@@ -76,3 +78,4 @@ def update_entidad(eid: str, data: dict):
         with conn.cursor() as cur:
             cur.execute(sql, payload)
             conn.commit()
+            data_version.touch()
@@ -1,6 +1,7 @@
 # services/estado_orden_service.py
 from __future__ import annotations
 from psycopg.rows import dict_row
+from core import data_version
 from core.db import get_conn
 
 def validate_estado_orden(data: dict) -> dict:
@@ -56,6 +57,7 @@ def create_estado_orden(data: dict) -> int:
             cur.execute(sql, payload)
             row = cur.fetchone()
             conn.commit()
+            data_version.touch()
             return int(row["id"])
 
 def update_estado_orden(eid: int, data: dict) -> None:
@@ -72,3 +74,4 @@ def update_estado_orden(eid: int, data: dict) -> None:
         with conn.cursor() as cur:
             cur.execute(sql, payload)
             conn.commit()
+            data_version.touch()
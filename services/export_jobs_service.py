@@ -0,0 +1,396 @@
+# services/export_jobs_service.py
+"""
+Exportaciones en segundo plano.
+submit_job registra el trabajo en cat_facturas.export_job y lo encola en un pool de
+hilos local; el worker guarda el archivo en BD (cat_facturas.export_job_parte, en partes
+de EXPORT_JOB_PART_BYTES) y va guardando las filas escritas. Estado y archivo viven en
+BD: cualquier instancia responde el avance y sirve la descarga.
+"""
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+import uuid as uuid_mod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from psycopg.types.json import Jsonb
+
+from core.db import get_conn
+from core.stream_export import FORMATS, check_format
+from services.reportes_export import (
+    exportar_reporte,
+    get_reporte,
+    normalizar_filtros,
+    puede_exportar,
+    total_reporte,
+)
+
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2"))
+EXPORT_JOBS_PER_USER = int(os.getenv("EXPORT_JOBS_PER_USER", "2"))   # pendientes/en proceso por usuario
+EXPORT_JOB_TTL = int(os.getenv("EXPORT_JOB_TTL", str(24 * 3600)))     # segundos que se conserva el archivo
+EXPORT_JOB_STALE = int(os.getenv("EXPORT_JOB_STALE", "900"))          # sin avance => ERROR
+EXPORT_JOB_SWEEP = float(os.getenv("EXPORT_JOB_SWEEP", "300"))        # cada cuánto se limpia
+EXPORT_JOB_PART_BYTES = int(os.getenv("EXPORT_JOB_PART_BYTES", str(4 * 1024 * 1024)))  # bytes por parte en BD
+
+_PROGRESS_EVERY = 1000      # filas entre revisiones del reloj
+_PROGRESS_SECONDS = 2.0     # mínimo entre escrituras de avance en BD
+_INSTANCE = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ExportJobLimit(ValueError):
+    """El usuario ya tiene EXPORT_JOBS_PER_USER exportaciones en curso."""
+
+
+# -----------------------------
+# SQL
+# -----------------------------
+_COLS = """
+    id, correo, reporte, formato, parametros, estatus, filas, filas_total, archivo, nombre_descarga,
+    bytes, error, fecha_creacion, fecha_inicio, fecha_fin, fecha_expira
+"""
+
+_ACTIVOS_SQL = """
+    SELECT COUNT(*) AS n
+    FROM cat_facturas.export_job
+    WHERE correo = %s AND estatus IN ('PENDIENTE', 'EN_PROCESO')
+      AND fecha_actualizacion > now() - make_interval(secs => %s)
+"""
+
+_INSERT_SQL = f"""
+    INSERT INTO cat_facturas.export_job (id, correo, reporte, formato, parametros, nombre_descarga, instancia)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    RETURNING {_COLS}
+"""
+
+_CLAIM_SQL = f"""
+    UPDATE cat_facturas.export_job
+    SET estatus = 'EN_PROCESO', fecha_inicio = now(), fecha_actualizacion = now(), instancia = %s
+    WHERE id = %s AND estatus = 'PENDIENTE'
+    RETURNING {_COLS}
+"""
+
+_PROGRESS_SQL = """
+    UPDATE cat_facturas.export_job
+    SET filas = %s, filas_total = COALESCE(%s, filas_total), fecha_actualizacion = now()
+    WHERE id = %s AND estatus = 'EN_PROCESO'
+"""
+
+_FINISH_SQL = """
+    UPDATE cat_facturas.export_job
+    SET estatus = 'TERMINADO', filas = %s, archivo = %s, bytes = %s,
+        fecha_fin = now(), fecha_actualizacion = now(), fecha_expira = now() + make_interval(secs => %s)
+    WHERE id = %s
+"""
+
+_PARTE_SQL = "INSERT INTO cat_facturas.export_job_parte (job_id, n, datos) VALUES (%s, %s, %s)"
+
+_PARTES_DEL_SQL = "DELETE FROM cat_facturas.export_job_parte WHERE job_id = %s"
+
+_FAIL_SQL = """
+    UPDATE cat_facturas.export_job
+    SET estatus = 'ERROR', error = %s, fecha_fin = now(), fecha_actualizacion = now()
+    WHERE id = %s AND estatus IN ('PENDIENTE', 'EN_PROCESO')
+"""
+
+
+def _exec(sql: str, params: Sequence[Any], fetch: bool = False) -> Any:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall() if fetch else cur.rowcount
+
+
+# -----------------------------
+# API
+# -----------------------------
+def submit_job(correo: str, rol: str, reporte: str, formato: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Registra y encola una exportación.
+    ValueError si el reporte/formato/parámetros no son válidos, PermissionError si el rol
+    no puede exportar el reporte, ExportJobLimit si ya tiene EXPORT_JOBS_PER_USER en curso.
+    """
+    rep = get_reporte(reporte)
+    if not puede_exportar(rep, rol):
+        raise PermissionError("No autorizado para este reporte.")
+    formato = check_format(formato)
+    params = normalizar_filtros(rep, params)
+    job_id = uuid_mod.uuid4()
+    nombre = f"{rep.nombre}_{time.strftime('%Y%m%d_%H%M%S')}.{FORMATS[formato].extension}"
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # serializa los envíos del mismo usuario para que el límite no se rebase por carrera
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", ("export_job:" + correo.lower(),))
+            cur.execute(_ACTIVOS_SQL, (correo, EXPORT_JOB_STALE))
+            if cur.fetchone()["n"] >= EXPORT_JOBS_PER_USER:
+                raise ExportJobLimit(
+                    f"Ya tienes {EXPORT_JOBS_PER_USER} exportaciones en curso; espera a que terminen."
+                )
+            cur.execute(_INSERT_SQL, (job_id, correo, rep.nombre, formato, Jsonb(params), nombre, _INSTANCE))
+            row = cur.fetchone()
+        conn.commit()
+
+    _pool().submit(_run_job, job_id)
+    _count("submitted", 1)
+    return _job_result(row)
+
+
+def get_job(job_id: str, correo: str) -> Optional[Dict[str, Any]]:
+    """Trabajo del usuario (o None si no existe / es de otro)."""
+    row = _get_row(job_id, correo)
+    return _job_result(row) if row else None
+
+
+def list_jobs(correo: str, limit: int = 20) -> List[Dict[str, Any]]:
+    rows = _exec(
+        f"SELECT {_COLS} FROM cat_facturas.export_job WHERE correo = %s ORDER BY fecha_creacion DESC LIMIT %s",
+        (correo, max(1, min(int(limit), 100))),
+        fetch=True,
+    )
+    return [_job_result(r) for r in rows]
+
+
+def job_file(job_id: str, correo: str) -> Optional[Tuple[Iterator[bytes], str, str, int]]:
+    """(chunks, nombre de descarga, media type, bytes) si el trabajo terminó y no ha expirado."""
+    row = _get_row(job_id, correo)
+    if not row or row["estatus"] != "TERMINADO":
+        return None
+    return _leer_partes(row["id"]), row["nombre_descarga"], FORMATS[row["formato"]].media_type, row["bytes"]
+
+
+def _leer_partes(job_id: uuid_mod.UUID) -> Iterator[bytes]:
+    # una parte por consulta: sólo una vive en memoria y no se retiene conexión entre partes
+    n = 0
+    while True:
+        rows = _exec(
+            "SELECT datos FROM cat_facturas.export_job_parte WHERE job_id = %s AND n = %s", (job_id, n), fetch=True
+        )
+        if not rows:
+            return
+        yield bytes(rows[0]["datos"])
+        n += 1
+
+
+def _get_row(job_id: str, correo: str) -> Optional[dict]:
+    try:
+        job_uuid = uuid_mod.UUID(str(job_id))
+    except ValueError:
+        return None
+    rows = _exec(
+        f"SELECT {_COLS} FROM cat_facturas.export_job WHERE id = %s AND correo = %s",
+        (job_uuid, correo),
+        fetch=True,
+    )
+    return rows[0] if rows else None
+
+
+def _job_result(row: dict) -> Dict[str, Any]:
+    total = row["filas_total"]
+    if row["estatus"] == "TERMINADO":
+        progreso = 100
+    elif total:
+        progreso = min(99, int(row["filas"] * 100 / total))
+    else:
+        progreso = 0
+    return {
+        "id": str(row["id"]),
+        "reporte": row["reporte"],
+        "formato": row["formato"],
+        "parametros": row["parametros"],
+        "estatus": row["estatus"],
+        "filas": row["filas"],
+        "filas_total": total,
+        "progreso": progreso,
+        "bytes": row["bytes"],
+        "error": row["error"],
+        "nombre": row["nombre_descarga"],
+        "fecha_creacion": row["fecha_creacion"].isoformat() if row["fecha_creacion"] else None,
+        "fecha_fin": row["fecha_fin"].isoformat() if row["fecha_fin"] else None,
+        "fecha_expira": row["fecha_expira"].isoformat() if row["fecha_expira"] else None,
+        "descarga": f"/api/export/jobs/{row['id']}/descarga" if row["estatus"] == "TERMINADO" else None,
+    }
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+class _Avance:
+    """Cuenta filas al pasar y guarda el avance en BD cada _PROGRESS_SECONDS."""
+
+    def __init__(self, job_id: uuid_mod.UUID, total: Optional[int]) -> None:
+        self.job_id = job_id
+        self.total = total
+        self.filas = 0
+        self._last = time.monotonic()
+
+    def contar(self, rows: Iterable[dict]) -> Iterator[dict]:
+        for row in rows:
+            self.filas += 1
+            if self.filas % _PROGRESS_EVERY == 0 and time.monotonic() - self._last >= _PROGRESS_SECONDS:
+                _exec(_PROGRESS_SQL, (self.filas, None, self.job_id))
+                self._last = time.monotonic()
+            yield row
+
+
+def _run_job(job_id: uuid_mod.UUID) -> None:
+    rows = _exec(_CLAIM_SQL, (_INSTANCE, job_id), fetch=True)
+    if not rows:
+        return
+    _count("running", 1)
+    job = rows[0]
+    archivo = f"{job_id}.{FORMATS[job['formato']].extension}"
+    try:
+        rep = get_reporte(job["reporte"])
+        params = job["parametros"] or {}
+        total = total_reporte(rep, params)
+        _exec(_PROGRESS_SQL, (0, total, job_id))
+        avance = _Avance(job_id, total)
+        content, _ = exportar_reporte(rep, job["formato"], params, contar=avance.contar)
+        size = _guardar_partes(job_id, content)
+        # servido desde core.export_cache: las filas no pasan por _Avance
+        filas = avance.filas or total or 0
+        _exec(_FINISH_SQL, (filas, archivo, size, EXPORT_JOB_TTL, job_id))
+        _count("completed", 1)
+    except Exception as e:
+        _count("failed", 1)
+        print(f"Exportación {job_id} falló:", str(e))
+        try:
+            _exec(_PARTES_DEL_SQL, (job_id,))
+        except Exception as e2:
+            print(f"No fue posible borrar las partes de {job_id}:", str(e2))
+        _exec(_FAIL_SQL, (str(e)[:500], job_id))
+    finally:
+        _count("running", -1)
+
+
+def _guardar_partes(job_id: uuid_mod.UUID, chunks: Iterable[bytes]) -> int:
+    """Escribe el archivo en export_job_parte (un commit por parte); regresa los bytes."""
+    buf = bytearray()
+    n = size = 0
+    for chunk in chunks:
+        buf += chunk
+        size += len(chunk)
+        while len(buf) >= EXPORT_JOB_PART_BYTES:
+            _exec(_PARTE_SQL, (job_id, n, bytes(buf[:EXPORT_JOB_PART_BYTES])))
+            del buf[:EXPORT_JOB_PART_BYTES]
+            n += 1
+    if buf or n == 0:
+        _exec(_PARTE_SQL, (job_id, n, bytes(buf)))
+    return size
+
+
+# -----------------------------
+# Limpieza
+# -----------------------------
+def sweep() -> Dict[str, int]:
+    """
+    Marca como ERROR los trabajos sin avance y borra los archivos vencidos.
+    Los PENDIENTE de esta instancia siguen en la cola local (sin latido propio): se
+    refrescan aquí para que no se den por abandonados mientras esperan worker.
+    """
+    _exec(
+        """
+        UPDATE cat_facturas.export_job
+        SET fecha_actualizacion = now()
+        WHERE instancia = %s AND estatus = 'PENDIENTE'
+        """,
+        (_INSTANCE,),
+    )
+    stale = _exec(
+        """
+        UPDATE cat_facturas.export_job
+        SET estatus = 'ERROR', error = 'Exportación interrumpida (sin avance).', fecha_fin = now()
+        WHERE estatus IN ('PENDIENTE', 'EN_PROCESO')
+          AND fecha_actualizacion < now() - make_interval(secs => %s)
+        """,
+        (EXPORT_JOB_STALE,),
+    )
+    expired = _exec(
+        """
+        WITH vencidos AS (
+            UPDATE cat_facturas.export_job
+            SET estatus = 'EXPIRADO', fecha_actualizacion = now()
+            WHERE estatus = 'TERMINADO' AND fecha_expira < now()
+            RETURNING id
+        )
+        DELETE FROM cat_facturas.export_job_parte p
+        USING vencidos v
+        WHERE p.job_id = v.id
+        """,
+        (),
+    )
+    return {"stale": stale, "parts_removed": expired}
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_stats = {"submitted": 0, "running": 0, "completed": 0, "failed": 0}
+_stop = threading.Event()
+_sweeper: Optional[threading.Thread] = None
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export-job")
+    return _executor
+
+
+def _count(key: str, n: int) -> None:
+    with _executor_lock:
+        _stats[key] += n
+
+
+def _sweep_loop() -> None:
+    while not _stop.wait(EXPORT_JOB_SWEEP):
+        try:
+            sweep()
+        except Exception as e:
+            print("Limpieza de exportaciones falló:", str(e))
+
+
+def start() -> None:
+    global _sweeper
+    _stop.clear()
+    if _sweeper is None or not _sweeper.is_alive():
+        _sweeper = threading.Thread(target=_sweep_loop, name="export-job-sweeper", daemon=True)
+        _sweeper.start()
+
+
+def shutdown() -> None:
+    """Detiene la limpieza y el pool; lo que quedó pendiente en esta instancia pasa a ERROR."""
+    global _executor
+    _stop.set()
+    with _executor_lock:
+        ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=False, cancel_futures=True)
+        try:
+            _exec(
+                """
+                UPDATE cat_facturas.export_job
+                SET estatus = 'ERROR', error = 'Servidor reiniciado.', fecha_fin = now()
+                WHERE instancia = %s AND estatus IN ('PENDIENTE', 'EN_PROCESO')
+                """,
+                (_INSTANCE,),
+            )
+        except Exception as e:
+            print("No fue posible cerrar exportaciones pendientes:", str(e))
+
+
+def stats() -> Dict[str, Any]:
+    with _executor_lock:
+        st = dict(_stats)
+    return {
+        **st,
+        "instance": _INSTANCE,
+        "part_bytes": EXPORT_JOB_PART_BYTES,
+        "workers": EXPORT_JOB_WORKERS,
+        "per_user": EXPORT_JOBS_PER_USER,
+        "ttl_s": EXPORT_JOB_TTL,
+    }
@@ -4,15 +4,23 @@ Servicio para listado de facturas con paginación, filtros y exportación
 """
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, date
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from itertools import chain, islice
 
-import pandas as pd
-import tempfile
+import base64
+import json
+import threading
+import time
 import os
 
+from core import data_version
 from core.db import get_conn
+from core.db_async import get_aconn
+from core.export_cache import export_cache, fingerprint
+from core.stream_export import check_format, stream_rows
+from core.xlsx_stream import rows_from_dicts
 
 
 def _to_dict(row, cols):
@@ -22,316 +30,712 @@ def _to_dict(row, cols):
     return dict(zip(cols, row))
 
 
-def list_facturas_paginado(
-    page: int = 1,
-    per_page: int = 50,
+def _listado_filtros(
     proveedor: Optional[str] = None,
     uuid: Optional[str] = None,
     area: Optional[int] = None,
     estatus_os: Optional[int] = None,
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
-) -> Dict[str, Any]:
-    """
-    Lista facturas con paginación y filtros múltiples.
-   
-    Returns:
-        Dict con: items, total, page, per_page, total_pages
-    """
-    offset = (page - 1) * per_page
+) -> Tuple[List[str], list, set]:
+    """Condiciones WHERE de los filtros, sus parámetros y las tablas que requieren (alias de _JOINS)."""
+    conds: List[str] = []
     params = []
-   
-    # Query base con TODOS los campos necesarios según factura_detalle.xlsx
-    sql = """
-            SELECT  
-        --Campos de recepción
-        row_number() OVER () AS "NO",
-        u.nombre AS "RESPONSABLE DE CAPTURA A BASE",
-        c.fecha_recepcion as "FECHA DE RECEPCION",
-        a.nombre_area as "UNIDAD EJECUTORA DEL GASTO",
-        
-        --datos pago
-        os.folio_oficio as "OFICIO",
-        pr.rfc AS "RFC",
-        pr.razon_social as "PROVEEDOR",
-        os.cuenta_bancaria as "CUENTA BANCARIA",
-        ct.num_contrato AS "CONTRATO",
-        os.orden_suministro AS "ORDEN DE SUMINISTRO",
-        os.folio_interno as "FOLIO INTERNO",
-        c.uuid as "FOLIO FISCAL",
-        os.validacion as "VALIDACION",
-        os.mes_servicio as "MES DE SERVICIO",
-        ct.ejercicio as "EJERCICIO FISCAL",
-        os.monto_siniva as "MONTO SIN IVA",
-        os.iva as "IVA",
-        os.monto_c_iva AS "MONTO CON IVA",
-        os.isr AS "ISR",
-        os._5millar as "5 AL MILLAR",
-        os.ieps AS "IEPS",
-        os.re_imp_nomina AS "RETENCION IMPUESTO SOBRE LA NOMINA",
-        os.riva as "RIVA",
-        os.risr as "RISR",
-        os.descuento AS "DESCUENTO",
-        os.otras_contribuciones AS "OTRAS CONTRIBUCIONES",
-        os.retenciones AS "RETENCION",
-        os.penalizacion AS "PENALIZACION",
-        os.deductiva AS "DEDUCTIVA",
-        os.importe_pago AS "IMPORTE A PAGAR",
-        os.importe_p_compromiso AS "IMPORTE PARA COMPROMISO",
-        os.no_compromiso as "NO COMPROMISO",
-        
-        --ESTATUS
-        eo.estatus_general "ESTATUS GENERAL",
-        eo.estatus_reporte AS "ESTATUS REPORTE",    
-        
-        --DATOS PRESUPUESTALES
-        p.capitulo AS "CAPITULO",
-        p.partida_especifica AS "PARTIDA PRESUPUESTAL",
-        p.pp AS "PROGRAMA PRESUPUESTAL",
-        e.nombre as "ENTIDAD",
-        e.id as "EF #",       
-        
-        --DATOS DE FISCALIZACION
-        os.fecha_fiscalizacion as "FECHA DE FISCALIZACION",
-        os.fiscalizador as "FISCALIZADOR",
-        os.fecha_carga_sicop as "FECHA DE CARGA EN SICOP",
-        os.responsable_carga_sicop as "RESPONSABLE DE CARGA SICOP",
-        os.clc AS "CLC 2024",
-        os.numero_solicitud_pago AS "NUMERO DE SOLICITUD DE PAGO 2024",
-        os.clc25 AS "CLC 2025",
-        os.numero_solicitud_pago25 AS "NUMERO DE SOLICITUD DE PAGO 2025",
-        os.clc26 AS "CLC 2026",
-        os.numero_solicitud_pago26 AS "NUMERO DE SOLICITUD DE PAGO 2026",
-        os.clc27 AS "CLC 2027",
-        os.numero_solicitud_pago27 AS "NUMERO DE SOLICITUD DE PAGO 2027",
-        os.estatus_siaff as "ESTATUS SIAFF",
-        os.fecha_pago AS "FECHA DE PAGO",
-        
-        --devolucion
-        os.oficio_dev AS "OFICIO DEV",
-        os.fecha_dev AS "FECHA DEV",
-        os.motivo_dev AS "MOTIVO DEV",    
-        
-        --final
-        os.observaciones as observaciones_os,
-        os.responsable_fis as "RESPONSABLE DOC FIS",
-        
-        --nuevos
-        os.fecha_pr AS "FECHA DE PAGO REFERENCIADO",
-        os.inmueble AS "INMUEBLE",
-        os.periodo AS "PERIODO",
-        os.recargos AS "RECARGARGOS EN PAGO DE SERVICIOS",
-        os.observacion_pr AS "OBSERVACION",
-        os.corte_presupuesto AS "CORTE PRESUPUESTO",
-        os.fecha_turno AS "FECHA DE TURNO",
-        
-        --campos sin uso definido
-        ct.rfc_pp,
-        ct.f_inicio as contrato_f_inicio,
-        ct.f_fin as contrato_f_fin,
-        ct.mes as contrato_mes,
-        ct.monto_total as contrato_monto_total,
-        ct.monto_maximo as contrato_monto_maximo,
-        ct.monto_ejercido as contrato_monto_ejercido,
-        ct.saldo_disponible as contrato_saldo_disponible,
-        ct.estatus as contrato_estatus, 
-        a.desc_area,
-        os.fecha_orden,
-        c.rfc_emisor,
-        pr.tipo_persona as proveedor_tipo,
-        eo.estado_resumen,
-        p.des_cap,
-        p.concepto,
-        p.des_concepto,
-        p.uso_partida,
-        p.des_uso_partida,
-        p.des_pe,
-        p.tipo_gasto,
-        p.austeridad,    
-        p.des_pp,
-        p.monto_total as partida_monto_total,
-        p.observaciones as partida_observaciones,
-        c.fecha_emision,
-        c.monto_total,
-        c.estatus as cfdi_estatus,
-        c.onservaciones as observaciones_cfdi,
-        os.fecha_factura,
-        os.estatus as estatus_os,
-        os.solicitud,
-        --ids
-        c.id as cfdi_id,
-        a.id as area_id,
-        os.id as os_id,
-        ct.id as contrato_id,
-        pr.id as proveedor_id,
-        eo.id as estado_orden_id,
-        p.id as partida_id
-    FROM cat_facturas.cfdi c
-    INNER JOIN cat_facturas.orden_suministro os ON os.id = c.orden_suministro
-    LEFT JOIN cat_facturas.proveedor pr ON pr.id = os.proveedor
-    LEFT JOIN cat_facturas.partida p ON p.id = os.partida
-    LEFT JOIN cat_facturas.contrato ct ON ct.id = p.contrato
-    LEFT JOIN cat_facturas.area a ON a.id = ct.area
-    LEFT JOIN cat_facturas.entidad e ON e.id = p.entidad
-    LEFT JOIN cat_facturas.estado_orden eo ON eo.id = os.estatus
-    left join cat_facturas.usuario u on c.resp_captura= u.correo
-    """
-   
-    # Aplicar filtros
+    joins = set()
+
     if proveedor:
-        sql += " AND (pr.rfc ILIKE %s OR pr.razon_social ILIKE %s)"
+        conds.append("(pr.rfc ILIKE %s OR pr.razon_social ILIKE %s)")
         like_prov = f"%{proveedor}%"
         params.extend([like_prov, like_prov])
+        joins.add("pr")
    
     if uuid:
-        sql += " AND c.uuid ILIKE %s"
+        conds.append("c.uuid ILIKE %s")
         params.append(f"%{uuid}%")
    
     if area:
-        sql += " AND a.id = %s"
+        # ct.area = a.id: el filtro no necesita unir area
+        conds.append("ct.area = %s")
         params.append(area)
+        joins.add("ct")
    
     if estatus_os:
-        sql += " AND os.estatus = %s"
+        conds.append("os.estatus = %s")
         params.append(estatus_os)
    
     if fecha_inicio:
-        sql += " AND c.fecha_recepcion >= %s"
+        conds.append("c.fecha_recepcion >= %s")
         params.append(fecha_inicio)
    
     if fecha_fin:
-        sql += " AND c.fecha_recepcion <= %s"
+        conds.append("c.fecha_recepcion <= %s")
         params.append(fecha_fin)
+
+    return conds, params, joins
+
+
+# Columnas del listado (alias -> expresión), según factura_detalle.xlsx.
+# El prefijo de la expresión indica la tabla que requiere (ver _JOINS).
+_LISTADO_COLUMNAS: Dict[str, str] = {
+    # Campos de recepción
+    "RESPONSABLE DE CAPTURA A BASE": "u.nombre",
+    "FECHA DE RECEPCION": "c.fecha_recepcion",
+    "UNIDAD EJECUTORA DEL GASTO": "a.nombre_area",
+
+    # datos pago
+    "OFICIO": "os.folio_oficio",
+    "RFC": "pr.rfc",
+    "PROVEEDOR": "pr.razon_social",
+    "CUENTA BANCARIA": "os.cuenta_bancaria",
+    "CONTRATO": "ct.num_contrato",
+    "ORDEN DE SUMINISTRO": "os.orden_suministro",
+    "FOLIO INTERNO": "os.folio_interno",
+    "FOLIO FISCAL": "c.uuid",
+    "VALIDACION": "os.validacion",
+    "MES DE SERVICIO": "os.mes_servicio",
+    "EJERCICIO FISCAL": "ct.ejercicio",
+    "MONTO SIN IVA": "os.monto_siniva",
+    "IVA": "os.iva",
+    "MONTO CON IVA": "os.monto_c_iva",
+    "ISR": "os.isr",
+    "5 AL MILLAR": "os._5millar",
+    "IEPS": "os.ieps",
+    "RETENCION IMPUESTO SOBRE LA NOMINA": "os.re_imp_nomina",
+    "RIVA": "os.riva",
+    "RISR": "os.risr",
+    "DESCUENTO": "os.descuento",
+    "OTRAS CONTRIBUCIONES": "os.otras_contribuciones",
+    "RETENCION": "os.retenciones",
+    "PENALIZACION": "os.penalizacion",
+    "DEDUCTIVA": "os.deductiva",
+    "IMPORTE A PAGAR": "os.importe_pago",
+    "IMPORTE PARA COMPROMISO": "os.importe_p_compromiso",
+    "NO COMPROMISO": "os.no_compromiso",
+
+    # ESTATUS
+    "ESTATUS GENERAL": "eo.estatus_general",
+    "ESTATUS REPORTE": "eo.estatus_reporte",
+
+    # DATOS PRESUPUESTALES
+    "CAPITULO": "p.capitulo",
+    "PARTIDA PRESUPUESTAL": "p.partida_especifica",
+    "PROGRAMA PRESUPUESTAL": "p.pp",
+    "ENTIDAD": "e.nombre",
+    "EF #": "e.id",
+
+    # DATOS DE FISCALIZACION
+    "FECHA DE FISCALIZACION": "os.fecha_fiscalizacion",
+    "FISCALIZADOR": "os.fiscalizador",
+    "FECHA DE CARGA EN SICOP": "os.fecha_carga_sicop",
+    "RESPONSABLE DE CARGA SICOP": "os.responsable_carga_sicop",
+    "CLC 2024": "os.clc",
+    "NUMERO DE SOLICITUD DE PAGO 2024": "os.numero_solicitud_pago",
+    "CLC 2025": "os.clc25",
+    "NUMERO DE SOLICITUD DE PAGO 2025": "os.numero_solicitud_pago25",
+    "CLC 2026": "os.clc26",
+    "NUMERO DE SOLICITUD DE PAGO 2026": "os.numero_solicitud_pago26",
+    "CLC 2027": "os.clc27",
+    "NUMERO DE SOLICITUD DE PAGO 2027": "os.numero_solicitud_pago27",
+    "ESTATUS SIAFF": "os.estatus_siaff",
+    "FECHA DE PAGO": "os.fecha_pago",
+
+    # devolucion
+    "OFICIO DEV": "os.oficio_dev",
+    "FECHA DEV": "os.fecha_dev",
+    "MOTIVO DEV": "os.motivo_dev",
+
+    # final
+    "observaciones_os": "os.observaciones",
+    "RESPONSABLE DOC FIS": "os.responsable_fis",
+
+    # nuevos
+    "FECHA DE PAGO REFERENCIADO": "os.fecha_pr",
+    "INMUEBLE": "os.inmueble",
+    "PERIODO": "os.periodo",
+    "RECARGARGOS EN PAGO DE SERVICIOS": "os.recargos",
+    "OBSERVACION": "os.observacion_pr",
+    "CORTE PRESUPUESTO": "os.corte_presupuesto",
+    "FECHA DE TURNO": "os.fecha_turno",
+
+    # campos sin uso definido
+    "rfc_pp": "ct.rfc_pp",
+    "contrato_f_inicio": "ct.f_inicio",
+    "contrato_f_fin": "ct.f_fin",
+    "contrato_mes": "ct.mes",
+    "contrato_monto_total": "ct.monto_total",
+    "contrato_monto_maximo": "ct.monto_maximo",
+    "contrato_monto_ejercido": "ct.monto_ejercido",
+    "contrato_saldo_disponible": "ct.saldo_disponible",
+    "contrato_estatus": "ct.estatus",
+    "desc_area": "a.desc_area",
+    "fecha_orden": "os.fecha_orden",
+    "rfc_emisor": "c.rfc_emisor",
+    "proveedor_tipo": "pr.tipo_persona",
+    "estado_resumen": "eo.estado_resumen",
+    "des_cap": "p.des_cap",
+    "concepto": "p.concepto",
+    "des_concepto": "p.des_concepto",
+    "uso_partida": "p.uso_partida",
+    "des_uso_partida": "p.des_uso_partida",
+    "des_pe": "p.des_pe",
+    "tipo_gasto": "p.tipo_gasto",
+    "austeridad": "p.austeridad",
+    "des_pp": "p.des_pp",
+    "partida_monto_total": "p.monto_total",
+    "partida_observaciones": "p.observaciones",
+    "fecha_emision": "c.fecha_emision",
+    "monto_total": "c.monto_total",
+    "cfdi_estatus": "c.estatus",
+    "observaciones_cfdi": "c.onservaciones",
+    "fecha_factura": "os.fecha_factura",
+    "estatus_os": "os.estatus",
+    "solicitud": "os.solicitud",
+    # ids
+    "cfdi_id": "c.id",
+    "area_id": "a.id",
+    "os_id": "os.id",
+    "contrato_id": "ct.id",
+    "proveedor_id": "pr.id",
+    "estado_orden_id": "eo.id",
+    "partida_id": "p.id",
+}
+
+# Joins en orden de dependencia: (alias, SQL, alias de los que depende)
+_JOINS = (
+    ("pr", "LEFT JOIN cat_facturas.proveedor pr ON pr.id = os.proveedor", ()),
+    ("p", "LEFT JOIN cat_facturas.partida p ON p.id = os.partida", ()),
+    ("ct", "LEFT JOIN cat_facturas.contrato ct ON ct.id = p.contrato", ("p",)),
+    ("a", "LEFT JOIN cat_facturas.area a ON a.id = ct.area", ("ct",)),
+    ("e", "LEFT JOIN cat_facturas.entidad e ON e.id = p.entidad", ("p",)),
+    ("eo", "LEFT JOIN cat_facturas.estado_orden eo ON eo.id = os.estatus", ()),
+    ("u", "LEFT JOIN cat_facturas.usuario u ON c.resp_captura = u.correo", ()),
+)
+_JOIN_DEPS = {alias: deps for alias, _, deps in _JOINS}
+
+# columnas que siempre van: orden y cursor de paginación
+_CURSOR_COLUMNAS = ("FECHA DE RECEPCION", "cfdi_id")
+
+# Vistas (proyecciones) del listado: sólo se unen las tablas que aportan columnas o filtros
+VISTAS: Dict[str, Tuple[str, ...]] = {
+    # tabla de /facturas-listado
+    "grid": (
+        "cfdi_id", "os_id", "FOLIO FISCAL", "RFC", "PROVEEDOR", "UNIDAD EJECUTORA DEL GASTO",
+        "CONTRATO", "PARTIDA PRESUPUESTAL", "ORDEN DE SUMINISTRO", "MES DE SERVICIO",
+        "IMPORTE A PAGAR", "monto_total", "FECHA DE RECEPCION", "ESTATUS GENERAL", "cfdi_estatus",
+    ),
+    # todas las columnas (respuesta histórica del endpoint)
+    "detail": tuple(_LISTADO_COLUMNAS),
+    # Excel de facturas (EXPORT_COLUMNAS = NO + éstas)
+    "export-full": (
+        "RESPONSABLE DE CAPTURA A BASE", "FECHA DE RECEPCION", "UNIDAD EJECUTORA DEL GASTO",
+        "OFICIO", "RFC", "PROVEEDOR", "CUENTA BANCARIA", "CONTRATO",
+        "ORDEN DE SUMINISTRO", "FOLIO INTERNO", "FOLIO FISCAL", "VALIDACION", "MES DE SERVICIO",
+        "EJERCICIO FISCAL", "MONTO SIN IVA", "IVA", "MONTO CON IVA", "ISR",
+        "5 AL MILLAR", "IEPS", "RETENCION IMPUESTO SOBRE LA NOMINA", "RIVA", "RISR",
+        "DESCUENTO", "OTRAS CONTRIBUCIONES", "PENALIZACION", "DEDUCTIVA",
+        "IMPORTE A PAGAR", "IMPORTE PARA COMPROMISO", "NO COMPROMISO", "ESTATUS GENERAL", "ESTATUS REPORTE",
+        "CAPITULO", "PARTIDA PRESUPUESTAL", "PROGRAMA PRESUPUESTAL", "ENTIDAD", "EF #",
+        "FECHA DE FISCALIZACION", "FISCALIZADOR", "FECHA DE CARGA EN SICOP", "RESPONSABLE DE CARGA SICOP",
+        "CLC 2024", "NUMERO DE SOLICITUD DE PAGO 2024",
+        "CLC 2025", "NUMERO DE SOLICITUD DE PAGO 2025",
+        "CLC 2026", "NUMERO DE SOLICITUD DE PAGO 2026",
+        "CLC 2027", "NUMERO DE SOLICITUD DE PAGO 2027",
+        "ESTATUS SIAFF", "FECHA DE PAGO",
+        "OFICIO DEV", "FECHA DEV", "MOTIVO DEV",
+        "FECHA DE PAGO REFERENCIADO", "INMUEBLE", "PERIODO", "RECARGARGOS EN PAGO DE SERVICIOS",
+        "CORTE PRESUPUESTO", "RESPONSABLE DOC FIS", "FECHA DE TURNO",
+    ),
+    # importes, retenciones y seguimiento de pago
+    "export-fiscal": (
+        "FECHA DE RECEPCION", "RFC", "PROVEEDOR", "FOLIO FISCAL", "ORDEN DE SUMINISTRO", "MES DE SERVICIO",
+        "EJERCICIO FISCAL", "MONTO SIN IVA", "IVA", "MONTO CON IVA", "ISR", "5 AL MILLAR", "IEPS",
+        "RETENCION IMPUESTO SOBRE LA NOMINA", "RIVA", "RISR", "DESCUENTO", "OTRAS CONTRIBUCIONES",
+        "RETENCION", "PENALIZACION", "DEDUCTIVA", "IMPORTE A PAGAR",
+        "FECHA DE FISCALIZACION", "FISCALIZADOR",
+        "CLC 2024", "NUMERO DE SOLICITUD DE PAGO 2024",
+        "CLC 2025", "NUMERO DE SOLICITUD DE PAGO 2025",
+        "CLC 2026", "NUMERO DE SOLICITUD DE PAGO 2026",
+        "CLC 2027", "NUMERO DE SOLICITUD DE PAGO 2027",
+        "ESTATUS SIAFF", "FECHA DE PAGO",
+    ),
+}
+
+
+def _check_vista(vista: str) -> str:
+    if vista not in VISTAS:
+        raise ValueError(f"vista debe ser una de: {', '.join(VISTAS)}.")
+    return vista
+
+
+def _from_sql(tablas: set) -> str:
+    """FROM cfdi + orden_suministro y los LEFT JOIN de tablas (con sus dependencias)."""
+    needed = set()
+    pending = list(tablas)
+    while pending:
+        t = pending.pop()
+        if t in _JOIN_DEPS and t not in needed:
+            needed.add(t)
+            pending.extend(_JOIN_DEPS[t])
+    sql = " FROM cat_facturas.cfdi c INNER JOIN cat_facturas.orden_suministro os ON os.id = c.orden_suministro"
+    for alias, join, _ in _JOINS:
+        if alias in needed:
+            sql += " " + join
+    return sql
+
+
+def _select_sql(vista: str) -> Tuple[str, set]:
+    """SELECT de la vista y tablas que usa."""
+    cols = list(VISTAS[vista]) + [c for c in _CURSOR_COLUMNAS if c not in VISTAS[vista]]
+    exprs = [(alias, _LISTADO_COLUMNAS[alias]) for alias in cols]
+    tablas = {expr.split(".", 1)[0] for _, expr in exprs}
+    return "SELECT " + ", ".join(f'{expr} AS "{alias}"' for alias, expr in exprs), tablas
+
+
+def _listado_query(
+    proveedor: Optional[str] = None,
+    uuid: Optional[str] = None,
+    area: Optional[int] = None,
+    estatus_os: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    after: Optional[Tuple[Optional[date], int]] = None,
+    vista: str = "detail",
+) -> Tuple[str, list]:
+    """
+    Arma el SELECT del listado (sin ORDER/LIMIT) y sus parámetros.
+    after=(fecha_recepcion, cfdi_id): sólo filas posteriores a ésa en _LISTADO_ORDER (keyset).
+    vista: columnas a seleccionar (ver VISTAS); sólo se unen las tablas que se usan.
+    """
+    select, tablas = _select_sql(vista)
+    conds, params, filtro_tablas = _listado_filtros(proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin)
+    sql = select + _from_sql(tablas | filtro_tablas)
+
+    if after is not None:
+        # mismo orden que el índice idx_cfdi_recepcion_id (fecha DESC NULLS FIRST, id DESC)
+        fecha, last_id = after
+        if fecha is None:
+            conds.append("((c.fecha_recepcion IS NULL AND c.id < %s) OR c.fecha_recepcion IS NOT NULL)")
+            params.append(last_id)
+        else:
+            conds.append("(c.fecha_recepcion, c.id) < (%s, %s)")
+            params.extend([fecha, last_id])
+
+    if conds:
+        sql += " WHERE " + " AND ".join(conds)
+    return sql, params
+
+
+_LISTADO_ORDER = " ORDER BY c.fecha_recepcion DESC, c.id DESC"
+
+
+def encode_cursor(fecha_recepcion: Optional[date], cfdi_id: int) -> str:
+    """Cursor opaco para la fila (fecha_recepcion, cfdi_id)."""
+    raw = f"{fecha_recepcion.isoformat() if fecha_recepcion else ''}|{cfdi_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[date], int]:
+    """Inverso de encode_cursor; ValueError si el cursor no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        fecha, cfdi_id = raw.split("|", 1)
+        if not fecha:
+            return None, int(cfdi_id)
+        value = datetime.fromisoformat(fecha) if "T" in fecha else date.fromisoformat(fecha)
+        return value, int(cfdi_id)
+    except Exception:
+        raise ValueError("Cursor de paginación inválido.")
+
+
+def _paginado_result(items: list, total: int, approx: bool, page: int, per_page: int) -> Dict[str, Any]:
+    total_pages = (total + per_page - 1) // per_page
+    next_cursor = None
+    if len(items) == per_page:
+        last = items[-1]
+        next_cursor = encode_cursor(last["FECHA DE RECEPCION"], last["cfdi_id"])
+    # consecutivo de la página (antes row_number() OVER () sobre todo el resultado)
+    offset = (page - 1) * per_page
+    items = [{"NO": offset + i, **row} for i, row in enumerate(items, 1)]
+    return {
+        "items": items,
+        "total": total,
+        "total_approx": approx,
+        "page": page,
+        "per_page": per_page,
+        "total_pages": total_pages,
+        "next_cursor": next_cursor,
+    }
+
+
+def _listado_page_sql(page, per_page, filtros, after, vista) -> Tuple[str, list]:
+    if after:
+        sql, params = _listado_query(*filtros, after=decode_cursor(after), vista=vista)
+        return sql + _LISTADO_ORDER + " LIMIT %s", params + [per_page]
+
+    sql, params = _listado_query(*filtros, vista=vista)
+    offset = (page - 1) * per_page
+    return sql + _LISTADO_ORDER + " LIMIT %s OFFSET %s", params + [per_page, offset]
+
+
+# -----------------------------
+# Conteo del listado
+# -----------------------------
+# exact: COUNT(*) cacheado por filtros (se invalida con data_version y TTL)
+# capped: cuenta hasta LISTADO_COUNT_CAP ("10000+")
+# estimate: filas estimadas por el planner (EXPLAIN), sin recorrer la tabla
+COUNT_MODES = ("exact", "capped", "estimate")
+LISTADO_COUNT_CAP = int(os.getenv("LISTADO_COUNT_CAP", "10000"))
+LISTADO_COUNT_TTL = float(os.getenv("LISTADO_COUNT_TTL", "120"))  # segundos
+_COUNT_CACHE_MAX = 512
+
+_count_cache: "OrderedDict[tuple, Tuple[int, float]]" = OrderedDict()
+_count_lock = threading.Lock()
+
+
+def _count_query(count_mode: str, filtros: tuple) -> Tuple[str, list]:
+    """Conteo sobre cfdi/orden_suministro con sólo los joins que piden los filtros activos."""
+    conds, params, tablas = _listado_filtros(*filtros)
+    body = _from_sql(tablas).lstrip()
+    if conds:
+        body += " WHERE " + " AND ".join(conds)
+
+    if count_mode == "capped":
+        return f"SELECT COUNT(*) AS count FROM (SELECT 1 {body} LIMIT %s) AS t", params + [LISTADO_COUNT_CAP + 1]
+    if count_mode == "estimate":
+        return f"EXPLAIN (FORMAT JSON) SELECT 1 {body}", params
+    return f"SELECT COUNT(*) AS count {body}", params
+
+
+def _count_value(count_mode: str, row: dict) -> Tuple[int, bool]:
+    """(total, aproximado) a partir de la fila de _count_query."""
+    if count_mode == "estimate":
+        plan = row["QUERY PLAN"]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"]), True
+    n = row["count"]
+    if count_mode == "capped" and n > LISTADO_COUNT_CAP:
+        return LISTADO_COUNT_CAP, True
+    return n, False
+
+
+# tablas del listado: sus contadores de escritura (pg_stat) forman la versión de datos
+_LISTADO_TABLAS = ["cfdi", "orden_suministro", "proveedor", "partida", "contrato", "area", "entidad", "estado_orden", "usuario"]
+
+_LISTADO_VERSION_SQL = """
+    SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) AS n
+    FROM pg_stat_all_tables
+    WHERE schemaname = 'cat_facturas' AND relname = ANY(%s)
+"""
+
+
+def _listado_version(cur) -> Tuple[int, int]:
+    """
+    (versión local, escrituras en BD). La local cambia al instante con los commits de
+    esta instancia; la de pg_stat también ve las de otras (con ~1 s de retraso).
+    """
+    cur.execute(_LISTADO_VERSION_SQL, (_LISTADO_TABLAS,))
+    return data_version.version(), int(cur.fetchone()["n"])
+
+
+async def _listado_version_async(cur) -> Tuple[int, int]:
+    await cur.execute(_LISTADO_VERSION_SQL, (_LISTADO_TABLAS,))
+    return data_version.version(), int((await cur.fetchone())["n"])
+
+
+def _count_cache_key(filtros: tuple, version: Tuple[int, int]) -> tuple:
+    # versión de todas las instancias: una alta/edición en otra instancia invalida el total
+    return (filtros, version)
+
+
+def _count_cache_get(key: tuple) -> Optional[int]:
+    with _count_lock:
+        hit = _count_cache.get(key)
+        if hit is None:
+            return None
+        if hit[1] <= time.monotonic():
+            del _count_cache[key]
+            return None
+        _count_cache.move_to_end(key)
+        return hit[0]
+
+
+def _count_cache_put(key: tuple, total: int) -> None:
+    with _count_lock:
+        _count_cache[key] = (total, time.monotonic() + LISTADO_COUNT_TTL)
+        while len(_count_cache) > _COUNT_CACHE_MAX:
+            _count_cache.popitem(last=False)
+
+
+def _check_count_mode(count_mode: str) -> str:
+    if count_mode not in COUNT_MODES:
+        raise ValueError(f"count debe ser uno de: {', '.join(COUNT_MODES)}.")
+    return count_mode
+
+
+def count_facturas(
+    proveedor: Optional[str] = None,
+    uuid: Optional[str] = None,
+    area: Optional[int] = None,
+    estatus_os: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    count_mode: str = "exact",
+) -> Tuple[int, bool]:
+    """Total de facturas del filtro: (total, aproximado). Mismo conteo/caché que el listado."""
+    count_mode = _check_count_mode(count_mode)
+    filtros = (proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            if count_mode == "exact":
+                key = _count_cache_key(filtros, _listado_version(cur))
+                total = _count_cache_get(key)
+                if total is not None:
+                    return total, False
+            cur.execute(*_count_query(count_mode, filtros))
+            total, approx = _count_value(count_mode, cur.fetchone())
+    if count_mode == "exact":
+        _count_cache_put(key, total)
+    return total, approx
+
+
+def list_facturas_paginado(
+    page: int = 1,
+    per_page: int = 50,
+    proveedor: Optional[str] = None,
+    uuid: Optional[str] = None,
+    area: Optional[int] = None,
+    estatus_os: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    after: Optional[str] = None,
+    count_mode: str = "exact",
+    vista: str = "detail",
+) -> Dict[str, Any]:
+    """
+    Lista facturas con paginación y filtros múltiples.
+    Con after (next_cursor de la página anterior) pagina por keyset; sin él,
+    usa OFFSET a partir de page (saltos a una página específica).
+    count_mode: exact (cacheado) | capped | estimate; ver COUNT_MODES.
+    vista: columnas a regresar (grid | detail | export-full | export-fiscal); ver VISTAS.
    
-    # Contar total de registros
-    count_sql = f"SELECT COUNT(*) FROM ({sql}) AS subq"
+    Returns:
+        Dict con: items, total, total_approx, page, per_page, total_pages, next_cursor
+    """
+    count_mode = _check_count_mode(count_mode)
+    filtros = (proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin)
+    sql, params = _listado_page_sql(page, per_page, filtros, after, _check_vista(vista))
+    total = None
+    approx = False
    
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Total count
-            cur.execute(count_sql, params)
-            #print(cur.fetchall())
-            total = cur.fetchone()["count"]
-            #print(total["count"])
+            if count_mode == "exact":
+                key = _count_cache_key(filtros, _listado_version(cur))
+                total = _count_cache_get(key)
+            # Total count (sólo cfdi/orden_suministro + joins de los filtros)
+            if total is None:
+                cur.execute(*_count_query(count_mode, filtros))
+                total, approx = _count_value(count_mode, cur.fetchone())
+                if count_mode == "exact":
+                    _count_cache_put(key, total)
            
             # Datos paginados
-            sql += " ORDER BY c.fecha_recepcion DESC, c.id DESC"
-            sql += f" LIMIT %s OFFSET %s"
-            params.extend([per_page, offset])
-           
             cur.execute(sql, params)
             cols = [d[0] for d in cur.description]
-            #print("COLUMNAS DEL QUERY:")
-            #print(cols)
             items = [_to_dict(row, cols) for row in cur.fetchall()]
    
-    total_pages = (total + per_page - 1) // per_page
-    return {
-        "items": items,
-        "total": total,
-        "page": page,
-        "per_page": per_page,
-        "total_pages": total_pages,
-    }
+    return _paginado_result(items, total, approx, page, per_page)
 
 
-def exportar_facturas_excel(
+async def list_facturas_paginado_async(
+    page: int = 1,
+    per_page: int = 50,
     proveedor: Optional[str] = None,
     uuid: Optional[str] = None,
     area: Optional[int] = None,
     estatus_os: Optional[int] = None,
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
-) -> str:
+    after: Optional[str] = None,
+    count_mode: str = "exact",
+    vista: str = "detail",
+) -> Dict[str, Any]:
+    """Versión async de list_facturas_paginado (mismo resultado)."""
+    count_mode = _check_count_mode(count_mode)
+    filtros = (proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin)
+    sql, params = _listado_page_sql(page, per_page, filtros, after, _check_vista(vista))
+    total = None
+    approx = False
+
+    async with get_aconn() as conn:
+        async with conn.cursor() as cur:
+            if count_mode == "exact":
+                key = _count_cache_key(filtros, await _listado_version_async(cur))
+                total = _count_cache_get(key)
+            if total is None:
+                await cur.execute(*_count_query(count_mode, filtros))
+                total, approx = _count_value(count_mode, await cur.fetchone())
+                if count_mode == "exact":
+                    _count_cache_put(key, total)
+
+            await cur.execute(sql, params)
+            items = await cur.fetchall()
+
+    return _paginado_result(items, total, approx, page, per_page)
+
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "2000"))  # filas por viaje del cursor del servidor
+
+# columnas del Excel de facturas: NO + vista export-full
+EXPORT_COLUMNAS: Tuple[str, ...] = ("NO",) + VISTAS["export-full"]
+EXPORT_FACTURAS_MAX = int(os.getenv("REPORTE_FACTURAS_MAX", "1000000"))  # tope de filas por exportación
+
+
+def iter_facturas(
+    proveedor: Optional[str] = None,
+    uuid: Optional[str] = None,
+    area: Optional[int] = None,
+    estatus_os: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    vista: str = "export-full",
+    chunk: int = EXPORT_FETCH_ROWS,
+) -> Iterator[Dict[str, Any]]:
     """
-    Exporta todas las facturas (con filtros opcionales) a Excel.
-    Retorna la ruta del archivo temporal.
+    Recorre TODAS las facturas del filtro (orden del listado) con un cursor del
+    servidor: en memoria sólo hay un bloque de chunk filas a la vez.
+    Cada fila trae "NO" (consecutivo) más las columnas de la vista.
+    La conexión queda ocupada mientras se consume el generador.
     """
-    # Obtener TODAS las facturas sin paginación
-    result = list_facturas_paginado(
-        page=1,
-        per_page=999999,
-        proveedor=proveedor,
-        uuid=uuid,
-        area=area,
-        estatus_os=estatus_os,
-        fecha_inicio=fecha_inicio,
-        fecha_fin=fecha_fin,
+    sql, params = _listado_query(
+        proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin, vista=_check_vista(vista)
     )
-    
-    items = result["items"]
-    
-    if not items:
+    no = 0
+    with get_conn() as conn:
+        with conn.cursor(name="facturas_export") as cur:
+            cur.itersize = chunk
+            cur.execute(sql + _LISTADO_ORDER, params)
+            cols = None
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    break
+                if cols is None:
+                    cols = [d[0] for d in cur.description]
+                for row in rows:
+                    no += 1
+                    yield {"NO": no, **_to_dict(row, cols)}
+
+
+def _export_data_version() -> Tuple[int, int]:
+    """Versión de datos del listado para la llave del caché de exportaciones (ver _listado_version)."""
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return _listado_version(cur)
+
+
+def _export_cache_key(formato: str, filtros: tuple, limit: int) -> str:
+    """Hash de formato + filtros normalizados + tope + columnas + versión de datos."""
+    proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin = (
+        (v.strip() or None) if isinstance(v, str) else v for v in filtros
+    )
+    return fingerprint(
+        reporte="facturas",
+        formato=formato,
+        # ILIKE: mayúsculas/minúsculas dan el mismo resultado
+        filtros=[proveedor and proveedor.lower(), uuid and uuid.lower(), area, estatus_os, fecha_inicio, fecha_fin],
+        limit=limit,
+        columnas=EXPORT_COLUMNAS,
+        version=_export_data_version(),
+    )
+
+
+def exportar_facturas(
+    formato: str = "xlsx",
+    proveedor: Optional[str] = None,
+    uuid: Optional[str] = None,
+    area: Optional[int] = None,
+    estatus_os: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    *,
+    limit: Optional[int] = None,
+    contar: Optional[Callable[[Iterator[dict]], Iterator[dict]]] = None,
+) -> Optional[Iterator[bytes]]:
+    """
+    Exporta las facturas (con filtros opcionales, hasta limit o EXPORT_FACTURAS_MAX) en
+    streaming, columnas EXPORT_COLUMNAS.
+    formato: xlsx | csv | ndjson | parquet (ver core.stream_export.FORMATS).
+    Retorna un generador de bytes del archivo (para StreamingResponse), o None si no hay datos.
+    Si ya se exportó lo mismo sin cambios en los datos, se sirve desde core.export_cache.
+    Es la única ruta de exportación de facturas: /exportar, /exportar-excel y el reporte
+    "facturas" de services.reportes_export (directo y en segundo plano) comparten el caché.
+    contar: envoltura de las filas al generarlas (avance de los jobs); no aplica con caché.
+    """
+    formato = check_format(formato)
+    limit = EXPORT_FACTURAS_MAX if not limit else max(1, min(int(limit), EXPORT_FACTURAS_MAX))
+    key = _export_cache_key(formato, (proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin), limit)
+    cached = export_cache.open(key)
+    if cached is not None:
+        return export_cache.read(cached)
+
+    rows = islice(iter_facturas(proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin), limit)
+    if contar is not None:
+        rows = contar(rows)
+    first = next(rows, None)
+    if first is None:
         return None
-    
-    # Convertir a DataFrame
-    df = pd.DataFrame(items)
-    
-    # Columnas ordenadas
-    columnas_ordenadas = [
-    "NO", "RESPONSABLE DE CAPTURA A BASE", "FECHA DE RECEPCION", "UNIDAD EJECUTORA DEL GASTO",
-    "OFICIO", "RFC", "PROVEEDOR", "CUENTA BANCARIA", "CONTRATO",
-    "ORDEN DE SUMINISTRO", "FOLIO INTERNO", "FOLIO FISCAL", "VALIDACION", "MES DE SERVICIO",
-    "EJERCICIO FISCAL", "MONTO SIN IVA", "IVA", "MONTO CON IVA", "ISR",
-    "5 AL MILLAR", "IEPS", "RETENCION IMPUESTO SOBRE LA NOMINA", "RIVA", "RISR",
-    "DESCUENTO", "OTRAS CONTRIBUCIONES", "RETENCIONES", "PENALIZACION", "DEDUCTIVA",
-    "IMPORTE A PAGAR", "IMPORTE PARA COMPROMISO", "NO COMPROMISO","ESTATUS GENERAL", "ESTATUS REPORTE",
-    "CAPITULO", "PARTIDA PRESUPUESTAL", "PROGRAMA PRESUPUESTAL","ENTIDAD", "EF #",
-    "FECHA DE FISCALIZACION", "FISCALIZADOR", "FECHA DE CARGA EN SICOP", "RESPONSABLE DE CARGA SICOP",
-    "CLC 2024", "NUMERO DE SOLICITUD DE PAGO 2024", 
-    "CLC 2025", "NUMERO DE SOLICITUD DE PAGO 2025",
-    "CLC 2026", "NUMERO DE SOLICITUD DE PAGO 2026",
-    "CLC 2027","NUMERO DE SOLICITUD DE PAGO 2027",
-    "ESTATUS SIAFF", "FECHA DE PAGO", 
-    "OFICIO DEV", "FECHA DEV", "MOTIVO DEV",
-    "FECHA DE PAGO REFERENCIADO", "INMUEBLE", "PERIODO", "RECARGARGOS EN PAGO DE SERVICIOS", "OBSERVACIONES_PR",
-    "CORTE PRESUPUESTO", "RESPONSABLE DOC FIS", "FECHA DE TURNO"
-]
 
-    
-    # Filtrar solo columnas que existen
-    columnas_disponibles = [col for col in columnas_ordenadas if col in df.columns]
-    df = df[columnas_disponibles]
-    
-    # Crear archivo temporal
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-    filepath = temp_file.name
-    temp_file.close()
-    
-    # Escribir Excel con ajuste automático de columnas
-    with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Facturas', index=False)
-        
-        # Ajustar ancho de columnas
-        worksheet = writer.sheets['Facturas']
-        
-        from openpyxl.utils import get_column_letter
-        
-        for idx, col in enumerate(df.columns, 1):
-            try:
-                # Calcular longitud máxima del contenido
-                col_series = df[col].astype(str)
-                max_content_length = col_series.str.len().max()
-                
-                # Comparar con longitud del header
-                max_length = max(
-                    max_content_length if pd.notna(max_content_length) else 0,
-                    len(str(col))
-                )
-                
-                # Ajustar ancho (mínimo 10, máximo 50)
-                adjusted_width = min(max(max_length + 2, 10), 50)
-                
-                # Aplicar ancho
-                col_letter = get_column_letter(idx)
-                worksheet.column_dimensions[col_letter].width = adjusted_width
-                
-            except Exception as e:
-                # Si falla, usar ancho por defecto de 15
-                col_letter = get_column_letter(idx)
-                worksheet.column_dimensions[col_letter].width = 15
-    
-    return filepath
+    return export_cache.store(key, stream_rows(
+        formato,
+        rows_from_dicts(chain([first], rows), EXPORT_COLUMNAS),
+        headers=EXPORT_COLUMNAS,
+        sheet_name="Facturas",
+    ))
+
+
+def exportar_facturas_excel(
+    proveedor: Optional[str] = None,
+    uuid: Optional[str] = None,
+    area: Optional[int] = None,
+    estatus_os: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+) -> Optional[Iterator[bytes]]:
+    """
+    Exporta todas las facturas a Excel en streaming (ver exportar_facturas).
+    Anchos de columna con las primeras filas (mínimo 10, máximo 50).
+    """
+    return exportar_facturas("xlsx", proveedor, uuid, area, estatus_os, fecha_inicio, fecha_fin)
+
+
+_AREAS_SQL = """
+    SELECT id, nombre_area 
+    FROM cat_facturas.area 
+    WHERE estatus = 'ACTIVO'
+    ORDER BY nombre_area
+"""
+
+_ESTADOS_ORDEN_SQL = """
+    SELECT id, estatus_general, estatus_reporte
+    FROM cat_facturas.estado_orden
+    ORDER BY id
+"""
+
+
+def _filtros_result(areas_rows: list, estados_rows: list) -> Dict[str, List[Dict]]:
+    return {
+        "areas": [{"id": r["id"], "nombre": r["nombre_area"]} for r in areas_rows],
+        "estados_orden": [
+            {
+                "id": r["id"],
+                "estatus_general": r["estatus_general"],
+                "estatus_reporte": r["estatus_reporte"]
+            }
+            for r in estados_rows
+        ],
+    }
 
 
 def get_filtros_opciones() -> Dict[str, List[Dict]]:
@@ -340,31 +744,20 @@ def get_filtros_opciones() -> Dict[str, List[Dict]]:
     """
     with get_conn() as conn:
         with conn.cursor() as cur:
-            # Áreas
-            cur.execute("""
-                SELECT id, nombre_area 
-                FROM cat_facturas.area 
-                WHERE estatus = 'ACTIVO'
-                ORDER BY nombre_area
-            """)
-            areas = [{"id": r[0], "nombre": r[1]} for r in cur.fetchall()]
-            
-            # Estados de orden
-            cur.execute("""
-                SELECT id, estatus_general, estatus_reporte
-                FROM cat_facturas.estado_orden
-                ORDER BY id
-            """)
-            estados_orden = [
-                {
-                    "id": r[0],
-                    "estatus_general": r[1],
-                    "estatus_reporte": r[2]
-                }
-                for r in cur.fetchall()
-            ]
+            cur.execute(_AREAS_SQL)
+            areas = cur.fetchall()
+            cur.execute(_ESTADOS_ORDEN_SQL)
+            estados_orden = cur.fetchall()
     
-    return {
-        "areas": areas,
-        "estados_orden": estados_orden,
-    }
+    return _filtros_result(areas, estados_orden)
+
+
+async def get_filtros_opciones_async() -> Dict[str, List[Dict]]:
+    async with get_aconn() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(_AREAS_SQL)
+            areas = await cur.fetchall()
+            await cur.execute(_ESTADOS_ORDEN_SQL)
+            estados_orden = await cur.fetchall()
+
+    return _filtros_result(areas, estados_orden)
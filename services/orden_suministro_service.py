@@ -2,6 +2,7 @@
 from __future__ import annotations
 from typing import Optional
 from psycopg.rows import dict_row
+from core import data_version
 from core.db import get_conn
 
 OS_FIELDS = [
@@ -88,6 +89,7 @@ def create_os(data: dict) -> int:
             cur.execute(sql, payload)
             row = cur.fetchone()
             conn.commit()
+            data_version.touch()
             return int(row["id"])
 
 def update_os(orden_id: int, data: dict) -> None:
@@ -128,3 +130,4 @@ def update_os(orden_id: int, data: dict) -> None:
         with conn.cursor() as cur:
             cur.execute(sql, payload)
             conn.commit()
+            data_version.touch()
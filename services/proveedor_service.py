@@ -3,6 +3,7 @@ from __future__ import annotations
 import re
 import psycopg
 from psycopg.rows import dict_row
+from core import data_version
 from core.db import get_conn
 
 RFC_REGEX = re.compile(r"^[A-Z&Ñ]{3,4}[0-9]{6}[A-Z0-9]{3}$", re.IGNORECASE)
@@ -87,6 +88,7 @@ def create_proveedor(data: dict) -> int:
             cur.execute(sql, payload)
             row = cur.fetchone()
             conn.commit()
+            data_version.touch()
             return int(row["id"])
 
 def update_proveedor(prov_id: int, data: dict) -> None:
@@ -120,3 +122,4 @@ def update_proveedor(prov_id: int, data: dict) -> None:
         with conn.cursor() as cur:
             cur.execute(sql, payload)
             conn.commit()
+            data_version.touch()
@@ -0,0 +1,319 @@
+# services/reportes_export.py
+"""
+Registro de reportes exportables (/api/export/excel y exportaciones en segundo plano).
+Cada reporte declara de dónde salen sus filas (SQL -> cursor del servidor, o un
+generador de un service), sus columnas, qué roles lo pueden exportar, los filtros
+que acepta y su tope de filas. Con eso obtiene xlsx/csv/ndjson/parquet en streaming.
+
+Para agregar uno: definir su SQL (o generador) y registrarlo con _registrar(Reporte(...)).
+"""
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from core.db import get_conn
+from core.stream_export import FORMATS, ExportFormat, check_format, stream_rows
+from core.xlsx_stream import rows_from_dicts
+from services.auditoria_service import AUDITORIA_COLUMNAS, EXPORT_AUDITORIA_MAX, count_auditoria, iter_auditoria
+from services.facturas_listado_service import (
+    EXPORT_COLUMNAS,
+    EXPORT_FACTURAS_MAX,
+    count_facturas,
+    exportar_facturas,
+    iter_facturas,
+)
+from services.reportes_service import reportes_admin, reportes_capturista
+
+REPORTE_MAX_FILAS = int(os.getenv("REPORTE_MAX_FILAS", "500000"))  # tope por omisión
+_FETCH_ROWS = 2000
+
+
+class Reporte(NamedTuple):
+    nombre: str
+    titulo: Optional[str]                           # fila de título en xlsx
+    hoja: str
+    columnas: Sequence[Tuple[str, str]]              # (llave, encabezado)
+    roles: Optional[Tuple[str, ...]]                 # None = cualquier usuario con sesión
+    filtros: Dict[str, Callable[[Any], Any]] = {}    # parámetros aceptados y su tipo/parser
+    max_filas: int = REPORTE_MAX_FILAS
+    sql: Optional[Callable[[Dict[str, Any]], Tuple[str, list]]] = None   # (sql sin LIMIT, params)
+    filas: Optional[Callable[[Dict[str, Any], int], Iterator[dict]]] = None  # generador (params, limit)
+    total: Optional[Callable[[Dict[str, Any]], int]] = None              # para el avance de los jobs
+    # exportación propia (formato, params, limit, contar) -> bytes | None (sin datos), p. ej. con caché
+    exportar: Optional[Callable[..., Optional[Iterator[bytes]]]] = None
+
+
+REPORTES: Dict[str, Reporte] = {}
+
+
+def _registrar(rep: Reporte) -> None:
+    if (rep.sql is None) == (rep.filas is None):
+        raise ValueError(f"Reporte {rep.nombre}: declara sql o filas (sólo uno).")
+    REPORTES[rep.nombre] = rep
+
+
+def get_reporte(nombre: str) -> Reporte:
+    rep = REPORTES.get((nombre or "").strip().lower())
+    if rep is None:
+        raise ValueError(f"Reporte no soportado: {nombre}")
+    return rep
+
+
+def puede_exportar(rep: Reporte, rol: str) -> bool:
+    return rep.roles is None or rol in rep.roles
+
+
+def _fecha(v: Any) -> str:
+    """YYYY-MM-DD validada aquí: los generadores la parsean ya dentro de la respuesta en streaming."""
+    return datetime.strptime(str(v), "%Y-%m-%d").strftime("%Y-%m-%d")
+
+
+def normalizar_filtros(rep: Reporte, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Sólo los filtros que declara el reporte, sin vacíos y con su tipo."""
+    out: Dict[str, Any] = {}
+    for key, typ in rep.filtros.items():
+        v = params.get(key)
+        if v is None or (isinstance(v, str) and not v.strip()):
+            continue
+        try:
+            out[key] = typ(v.strip() if isinstance(v, str) else v)
+        except (TypeError, ValueError):
+            raise ValueError(f"Parámetro inválido: {key}")
+    return out
+
+
+def _limite(rep: Reporte, limit: Optional[int]) -> int:
+    return rep.max_filas if not limit else max(1, min(int(limit), rep.max_filas))
+
+
+def iter_reporte(rep: Reporte, params: Dict[str, Any], limit: Optional[int] = None) -> Iterator[dict]:
+    """Filas del reporte (dicts), hasta min(limit, rep.max_filas)."""
+    limit = _limite(rep, limit)
+    if rep.filas is not None:
+        yield from islice(rep.filas(params, limit), limit)
+        return
+
+    sql, sql_params = rep.sql(params)
+    with get_conn() as conn:
+        with conn.cursor(name=f"reporte_{rep.nombre}") as cur:
+            cur.execute(sql + " LIMIT %s", [*sql_params, limit])
+            while True:
+                rows = cur.fetchmany(_FETCH_ROWS)
+                if not rows:
+                    break
+                yield from rows
+
+
+def total_reporte(rep: Reporte, params: Dict[str, Any]) -> Optional[int]:
+    if rep.total is None:
+        return None
+    return min(rep.total(params), rep.max_filas)
+
+
+def exportar_reporte(
+    rep: Reporte,
+    formato: str,
+    params: Dict[str, Any],
+    limit: Optional[int] = None,
+    contar: Optional[Callable[[Iterator[dict]], Iterator[dict]]] = None,
+) -> Tuple[Iterator[bytes], ExportFormat]:
+    """
+    Generador de bytes del reporte en el formato pedido y su (media type, extensión).
+    contar: envoltura de las filas al generarlas (avance de los jobs).
+    """
+    formato = check_format(formato)
+    if rep.exportar is not None:
+        content = rep.exportar(formato, params, _limite(rep, limit), contar)
+        if content is not None:
+            return content, FORMATS[formato]
+        # sin datos: archivo sólo con encabezados, como los demás reportes
+
+    rows = iter_reporte(rep, params, limit)
+    if contar is not None:
+        rows = contar(rows)
+    keys = [k for k, _ in rep.columnas]
+    content = stream_rows(
+        formato,
+        rows_from_dicts(rows, keys),
+        headers=[h for _, h in rep.columnas],
+        sheet_name=rep.hoja,
+        title=rep.titulo if formato == "xlsx" else None,
+    )
+    return content, FORMATS[formato]
+
+
+# -----------------------------
+# Reportes
+# -----------------------------
+_FACTURAS_FILTROS = ("proveedor", "uuid", "area", "estatus_os", "fecha_inicio", "fecha_fin")
+
+_registrar(Reporte(
+    nombre="facturas",
+    titulo=None,
+    hoja="Facturas",
+    columnas=[(c, c) for c in EXPORT_COLUMNAS],
+    roles=("ADMIN", "CAPTURISTA", "RESP_FICALIZADOR"),
+    filtros={"proveedor": str, "uuid": str, "area": int, "estatus_os": int, "fecha_inicio": str, "fecha_fin": str},
+    max_filas=EXPORT_FACTURAS_MAX,
+    filas=lambda p, limit: iter_facturas(*(p.get(k) for k in _FACTURAS_FILTROS)),
+    total=lambda p: count_facturas(*(p.get(k) for k in _FACTURAS_FILTROS))[0],
+    # misma ruta (y caché) que /exportar
+    exportar=lambda formato, p, limit, contar: exportar_facturas(
+        formato, *(p.get(k) for k in _FACTURAS_FILTROS), limit=limit, contar=contar
+    ),
+))
+
+_registrar(Reporte(
+    nombre="auditoria",
+    titulo="Reporte de Auditoría",
+    hoja="Auditoria",
+    columnas=AUDITORIA_COLUMNAS,
+    roles=("ADMIN",),
+    filtros={"correo": str, "accion": str, "q": str, "date_from": _fecha, "date_to": _fecha},
+    max_filas=EXPORT_AUDITORIA_MAX,
+    filas=lambda p, limit: iter_auditoria(**p, limit=limit),
+    total=lambda p: count_auditoria(**p),
+))
+
+
+def _proveedores_sql(p: Dict[str, Any]) -> Tuple[str, list]:
+    where, params = [], []
+    if p.get("q"):
+        like = f"%{p['q'].lower()}%"
+        where.append("(lower(rfc) LIKE %s OR lower(razon_social) LIKE %s OR lower(nombre_comercial) LIKE %s)")
+        params.extend([like, like, like])
+    if p.get("estatus"):
+        where.append("estatus = %s")
+        params.append(p["estatus"].upper())
+    sql = """
+        SELECT rfc, razon_social, nombre_comercial, tipo_persona, telefono, email, estatus
+        FROM cat_facturas.proveedor
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY razon_social", params
+
+
+_registrar(Reporte(
+    nombre="proveedores",
+    titulo="Catálogo de Proveedores",
+    hoja="Proveedores",
+    columnas=[
+        ("rfc", "RFC"), ("razon_social", "RAZON SOCIAL"), ("nombre_comercial", "NOMBRE COMERCIAL"),
+        ("tipo_persona", "TIPO PERSONA"), ("telefono", "TELEFONO"), ("email", "EMAIL"), ("estatus", "ESTATUS"),
+    ],
+    roles=("ADMIN",),
+    filtros={"q": str, "estatus": str},
+    sql=_proveedores_sql,
+))
+
+
+def _contratos_sql(p: Dict[str, Any]) -> Tuple[str, list]:
+    where, params = [], []
+    if p.get("area"):
+        where.append("ct.area = %s")
+        params.append(p["area"])
+    if p.get("estatus"):
+        where.append("ct.estatus = %s")
+        params.append(p["estatus"].upper())
+    if p.get("ejercicio"):
+        where.append("ct.ejercicio = %s")
+        params.append(p["ejercicio"])
+    if p.get("vence_dias"):
+        where.append("ct.f_fin <= CURRENT_DATE + make_interval(days => %s)")
+        params.append(p["vence_dias"])
+    sql = """
+        SELECT ct.num_contrato, ct.rfc_pp, a.nombre_area, ct.tipo_de_contrato, ct.ejercicio, ct.mes,
+               ct.f_inicio, ct.f_fin, ct.monto_total, ct.monto_maximo, ct.monto_ejercido,
+               ct.estatus, ct.observaciones
+        FROM cat_facturas.contrato ct
+        LEFT JOIN cat_facturas.area a ON a.id = ct.area
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY ct.f_fin, ct.num_contrato", params
+
+
+_registrar(Reporte(
+    nombre="contratos",
+    titulo="Contratos",
+    hoja="Contratos",
+    columnas=[
+        ("num_contrato", "NUM CONTRATO"), ("rfc_pp", "RFC PP"), ("nombre_area", "AREA"),
+        ("tipo_de_contrato", "TIPO DE CONTRATO"), ("ejercicio", "EJERCICIO"), ("mes", "MES"),
+        ("f_inicio", "FECHA INICIO"), ("f_fin", "FECHA FIN"), ("monto_total", "MONTO TOTAL"),
+        ("monto_maximo", "MONTO MAXIMO"), ("monto_ejercido", "MONTO EJERCIDO"),
+        ("estatus", "ESTATUS"), ("observaciones", "OBSERVACIONES"),
+    ],
+    roles=("ADMIN",),
+    filtros={"area": int, "estatus": str, "ejercicio": int, "vence_dias": int},
+    sql=_contratos_sql,
+))
+
+
+def _os_sin_cfdi_sql(p: Dict[str, Any]) -> Tuple[str, list]:
+    where, params = ["NOT EXISTS (SELECT 1 FROM cat_facturas.cfdi c WHERE c.orden_suministro = os.id)"], []
+    if p.get("proveedor"):
+        like = f"%{p['proveedor']}%"
+        where.append("(pr.rfc ILIKE %s OR pr.razon_social ILIKE %s)")
+        params.extend([like, like])
+    if p.get("fecha_inicio"):
+        where.append("os.fecha_orden >= %s")
+        params.append(p["fecha_inicio"])
+    if p.get("fecha_fin"):
+        where.append("os.fecha_orden <= %s")
+        params.append(p["fecha_fin"])
+    sql = """
+        SELECT os.orden_suministro, os.folio_interno, os.fecha_orden, pr.rfc, pr.razon_social,
+               os.mes_servicio, os.monto_c_iva, os.importe_pago, eo.estatus_general, os.fecha_pago
+        FROM cat_facturas.orden_suministro os
+        LEFT JOIN cat_facturas.proveedor pr ON pr.id = os.proveedor
+        LEFT JOIN cat_facturas.estado_orden eo ON eo.id = os.estatus
+        WHERE """ + " AND ".join(where)
+    return sql + " ORDER BY os.fecha_orden DESC NULLS LAST, os.id DESC", params
+
+
+_registrar(Reporte(
+    nombre="os_sin_cfdi",
+    titulo="Órdenes de suministro sin CFDI",
+    hoja="OS sin CFDI",
+    columnas=[
+        ("orden_suministro", "ORDEN DE SUMINISTRO"), ("folio_interno", "FOLIO INTERNO"),
+        ("fecha_orden", "FECHA ORDEN"), ("rfc", "RFC"), ("razon_social", "PROVEEDOR"),
+        ("mes_servicio", "MES DE SERVICIO"), ("monto_c_iva", "MONTO CON IVA"),
+        ("importe_pago", "IMPORTE A PAGAR"), ("estatus_general", "ESTATUS GENERAL"), ("fecha_pago", "FECHA DE PAGO"),
+    ],
+    roles=("ADMIN", "CAPTURISTA"),
+    filtros={"proveedor": str, "fecha_inicio": str, "fecha_fin": str},
+    sql=_os_sin_cfdi_sql,
+))
+
+
+def _kpis(p: Dict[str, Any], limit: int) -> Iterator[dict]:
+    yield from reportes_capturista()
+    admin = reportes_admin()
+    yield from admin["kpis"]
+    for r in admin["os_por_estatus"]:
+        yield {"reporte": f"Órdenes {r['estatus']}", "valor": r["total"], "detalle": "Por estado resumen"}
+
+
+_registrar(Reporte(
+    nombre="kpis",
+    titulo="Indicadores del tablero",
+    hoja="KPIs",
+    columnas=[("reporte", "REPORTE"), ("valor", "VALOR"), ("detalle", "DETALLE")],
+    roles=("ADMIN",),
+    max_filas=1000,
+    filas=_kpis,
+))
+
+
+def catalogo() -> List[Dict[str, Any]]:
+    """Reportes registrados (para la UI / documentación)."""
+    return [
+        {"reporte": r.nombre, "titulo": r.titulo or r.hoja, "roles": r.roles, "filtros": list(r.filtros), "max_filas": r.max_filas}
+        for r in REPORTES.values()
+    ]
@@ -1,6 +1,7 @@
 import re
 import psycopg
 from psycopg import errors
+from core import data_version
 from core.db import get_conn
 from core.security import hash_password
 
@@ -73,6 +74,7 @@ def create_user(correo: str, nombre: str, rol: str, estatus: str, plain_password
             row = cur.fetchone()
             new_id = row["id"] 
             conn.commit()
+            data_version.touch()
             return int(new_id)
 
 def update_user(user_id: int, correo: str, nombre: str, rol: str, estatus: str) -> None:
@@ -97,6 +99,7 @@ def update_user(user_id: int, correo: str, nombre: str, rol: str, estatus: str)
         with conn.cursor() as cur:
             cur.execute(sql, (correo, nombre, rol, estatus, user_id))
             conn.commit()
+            data_version.touch()
 
 def reset_password(user_id: int, new_plain_password: str) -> None:
     if len(new_plain_password) < 8:
@@ -0,0 +1,10 @@
+-- sql/001_idx_cfdi_listado.sql
+-- Índice para el listado de facturas: ORDER BY c.fecha_recepcion DESC, c.id DESC
+-- y paginación por cursor (keyset) en /api/facturas-listado/lista.
+-- CONCURRENTLY no puede correr dentro de una transacción: ejecutar con autocommit (psql).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cfdi_recepcion_id
+    ON cat_facturas.cfdi (fecha_recepcion DESC, id DESC);
+
+-- join cfdi -> orden_suministro
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cfdi_orden_suministro
+    ON cat_facturas.cfdi (orden_suministro);
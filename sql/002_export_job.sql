@@ -0,0 +1,33 @@
+-- sql/002_export_job.sql
+-- Trabajos de exportación en segundo plano (services/export_jobs_service.py).
+-- La tabla es la fuente de verdad del estado; el archivo vive en
+-- cat_facturas.export_job_parte (sql/005_export_job_parte.sql).
+CREATE TABLE IF NOT EXISTS cat_facturas.export_job (
+    id                  uuid PRIMARY KEY,
+    correo              varchar(150) NOT NULL,
+    reporte             varchar(40)  NOT NULL,
+    formato             varchar(10)  NOT NULL,
+    parametros          jsonb        NOT NULL DEFAULT '{}'::jsonb,
+    estatus             varchar(12)  NOT NULL DEFAULT 'PENDIENTE',  -- PENDIENTE | EN_PROCESO | TERMINADO | ERROR | EXPIRADO
+    filas               integer      NOT NULL DEFAULT 0,            -- filas escritas
+    filas_total         integer,                                    -- total estimado
+    archivo             text,                                       -- nombre en EXPORT_JOBS_DIR
+    nombre_descarga     text,
+    bytes               bigint,
+    error               text,
+    instancia           text,
+    fecha_creacion      timestamptz  NOT NULL DEFAULT now(),
+    fecha_inicio        timestamptz,
+    fecha_actualizacion timestamptz  NOT NULL DEFAULT now(),        -- latido del worker
+    fecha_fin           timestamptz,
+    fecha_expira        timestamptz
+);
+
+-- límite por usuario (PENDIENTE/EN_PROCESO) y "mis exportaciones"
+CREATE INDEX IF NOT EXISTS idx_export_job_correo
+    ON cat_facturas.export_job (correo, fecha_creacion DESC);
+
+-- limpieza: vencidos y trabajos abandonados
+CREATE INDEX IF NOT EXISTS idx_export_job_activos
+    ON cat_facturas.export_job (estatus, fecha_actualizacion)
+    WHERE estatus IN ('PENDIENTE', 'EN_PROCESO', 'TERMINADO');
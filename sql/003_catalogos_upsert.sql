@@ -0,0 +1,20 @@
+-- sql/003_catalogos_upsert.sql
+-- Índices únicos para la carga masiva de catálogos (services/catalogos_service.py):
+-- cada hoja se aplica con INSERT ... ON CONFLICT sobre su llave natural.
+-- Si ya existen duplicados el CREATE falla; listarlos y depurarlos antes, p. ej.:
+--   SELECT upper(trim(nombre_area)), count(*) FROM cat_facturas.area GROUP BY 1 HAVING count(*) > 1;
+-- CONCURRENTLY no puede correr dentro de una transacción: ejecutar con autocommit (psql).
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_area_nombre
+    ON cat_facturas.area ((upper(trim(nombre_area))));
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_proveedor_rfc
+    ON cat_facturas.proveedor (rfc);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_usuario_correo
+    ON cat_facturas.usuario ((lower(correo)));
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_contrato_num_contrato
+    ON cat_facturas.contrato (num_contrato);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_partida_contrato_pe
+    ON cat_facturas.partida (contrato, partida_especifica);
@@ -0,0 +1,31 @@
+-- sql/004_catalogo_import_job.sql
+-- Importaciones de catálogos en segundo plano (services/catalogos_jobs_service.py).
+-- Cada lote de filas se confirma junto con su punto de control (punto_control), así un
+-- trabajo interrumpido se reanuda desde el último lote confirmado. El Excel vive en
+-- la columna contenido (sql/006_catalogo_import_job_contenido.sql).
+CREATE TABLE IF NOT EXISTS cat_facturas.catalogo_import_job (
+    id                  uuid PRIMARY KEY,
+    correo              varchar(150) NOT NULL,
+    nombre_archivo      text         NOT NULL,
+    archivo             text         NOT NULL,                      -- nombre en CATALOGOS_JOBS_DIR
+    estatus             varchar(12)  NOT NULL DEFAULT 'PENDIENTE',  -- PENDIENTE | EN_PROCESO | TERMINADO | ERROR
+    filas               integer      NOT NULL DEFAULT 0,            -- filas confirmadas
+    filas_total         integer,                                    -- total estimado (dimensión de las hojas)
+    punto_control       jsonb,                                      -- hoja, fila, summary y row_errors del último lote
+    resultado           jsonb,                                      -- respuesta final (igual que /upload)
+    error               text,
+    intentos            integer      NOT NULL DEFAULT 0,
+    instancia           text,
+    fecha_creacion      timestamptz  NOT NULL DEFAULT now(),
+    fecha_inicio        timestamptz,
+    fecha_actualizacion timestamptz  NOT NULL DEFAULT now(),        -- latido del worker
+    fecha_fin           timestamptz
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalogo_import_job_fecha
+    ON cat_facturas.catalogo_import_job (fecha_creacion DESC);
+
+-- una importación activa a la vez y limpieza de trabajos abandonados
+CREATE INDEX IF NOT EXISTS idx_catalogo_import_job_activos
+    ON cat_facturas.catalogo_import_job (estatus, fecha_actualizacion)
+    WHERE estatus IN ('PENDIENTE', 'EN_PROCESO');
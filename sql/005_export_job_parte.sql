@@ -0,0 +1,13 @@
+-- sql/005_export_job_parte.sql
+-- Archivo de cada exportación en segundo plano, en partes de EXPORT_JOB_PART_BYTES.
+-- Vive en BD (no en disco de la instancia): con autoscaling cualquier instancia sirve
+-- la descarga. Se borra al expirar el trabajo (sweep) o con el trabajo.
+CREATE TABLE IF NOT EXISTS cat_facturas.export_job_parte (
+    job_id  uuid    NOT NULL REFERENCES cat_facturas.export_job (id) ON DELETE CASCADE,
+    n       integer NOT NULL,   -- 0, 1, 2, ... en orden del archivo
+    datos   bytea   NOT NULL,
+    PRIMARY KEY (job_id, n)
+);
+
+-- los datos ya vienen comprimidos (xlsx/parquet) o se sirven tal cual: sin TOAST comprimido
+ALTER TABLE cat_facturas.export_job_parte ALTER COLUMN datos SET STORAGE EXTERNAL;
@@ -0,0 +1,11 @@
+-- sql/006_catalogo_import_job_contenido.sql
+-- El Excel de cada importación vive en la fila del trabajo (no en disco de la instancia):
+-- con autoscaling, /reanudar puede caer en cualquier instancia. sweep lo borra
+-- (contenido = NULL) pasado CATALOGOS_JOB_TTL.
+ALTER TABLE cat_facturas.catalogo_import_job ADD COLUMN IF NOT EXISTS contenido bytea;
+
+-- el xlsx ya viene comprimido
+ALTER TABLE cat_facturas.catalogo_import_job ALTER COLUMN contenido SET STORAGE EXTERNAL;
+
+-- nombre en CATALOGOS_JOBS_DIR; ya no se usa
+ALTER TABLE cat_facturas.catalogo_import_job ALTER COLUMN archivo DROP NOT NULL;
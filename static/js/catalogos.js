@@ -2,6 +2,7 @@
 
 const fileExcel = document.getElementById("fileExcel");
 const btnUpload = document.getElementById("btnUpload");
+const btnPreview = document.getElementById("btnPreview");
 const uploadMsg = document.getElementById("uploadMsg");
 
 const resultBox = document.getElementById("resultBox");
@@ -11,6 +12,9 @@ const summaryTbody = document.getElementById("summaryTbody");
 const errorsBox = document.getElementById("errorsBox");
 const errorsTbody = document.getElementById("errorsTbody");
 
+const diffBox = document.getElementById("diffBox");
+const diffTbody = document.getElementById("diffTbody");
+
 const notesBox = document.getElementById("notesBox");
 const notesList = document.getElementById("notesList");
 
@@ -33,7 +37,9 @@ function clearUI() {
   summaryTbody.innerHTML = "";
   errorsTbody.innerHTML = "";
   notesList.innerHTML = "";
+  diffTbody.innerHTML = "";
   errorsBox.style.display = "none";
+  diffBox.style.display = "none";
   notesBox.style.display = "none";
 }
 
@@ -47,6 +53,7 @@ function renderSummary(summary) {
       <td>${escapeHtml(sh)}</td>
       <td>${escapeHtml(s.inserted)}</td>
       <td>${escapeHtml(s.updated)}</td>
+      <td>${escapeHtml(s.unchanged ?? 0)}</td>
       <td>${escapeHtml(s.errors)}</td>
     `;
     summaryTbody.appendChild(tr);
@@ -71,6 +78,49 @@ function renderRowErrors(rowErrors) {
   }
 }
 
+const DIFF_TIPOS = { insert: "Alta", update: "Cambio", noop: "Sin cambios" };
+
+function diffDetalle(tipo, m) {
+  if (tipo === "insert") {
+    return Object.entries(m.valores || {})
+      .filter(([, v]) => v !== null && v !== "")
+      .map(([k, v]) => `${k}=${v}`)
+      .join(", ");
+  }
+  if (tipo === "update") {
+    return Object.entries(m.cambios || {})
+      .map(([k, [antes, despues]]) => `${k}: ${antes ?? "—"} → ${despues ?? "—"}`)
+      .join(", ");
+  }
+  return "";
+}
+
+// Muestras de la vista previa (dry_run): por hoja, altas / cambios / sin cambios
+function renderDiff(diff) {
+  const sheets = Object.keys(diff || {});
+  if (!sheets.length) {
+    diffBox.style.display = "none";
+    return;
+  }
+  diffBox.style.display = "block";
+  diffTbody.innerHTML = "";
+  for (const sh of sheets) {
+    for (const tipo of Object.keys(DIFF_TIPOS)) {
+      for (const m of diff[sh][tipo] || []) {
+        const tr = document.createElement("tr");
+        tr.innerHTML = `
+          <td>${escapeHtml(sh)}</td>
+          <td>${escapeHtml(m.row)}</td>
+          <td>${escapeHtml(DIFF_TIPOS[tipo])}</td>
+          <td>${escapeHtml(m.llave)}</td>
+          <td>${escapeHtml(diffDetalle(tipo, m))}</td>
+        `;
+        diffTbody.appendChild(tr);
+      }
+    }
+  }
+}
+
 function renderNotes(notes) {
   if (!notes || !notes.length) {
     notesBox.style.display = "none";
@@ -85,7 +135,105 @@ function renderNotes(notes) {
   }
 }
 
-btnUpload.addEventListener("click", async () => {
+function renderResult(j, dryRun) {
+  resultBox.style.display = "block";
+  resultSummary.innerHTML = `
+    <b>Archivo:</b> ${escapeHtml(j.file)}<br>
+    <b>Mensaje:</b> ${escapeHtml(j.message)}<br>
+    <b>Hojas procesadas:</b> ${escapeHtml(j.total_sheets)}
+  `;
+
+  renderSummary(j.summary);
+  renderRowErrors(j.row_errors);
+  if (dryRun) renderDiff(j.diff);
+  renderNotes(j.notes);
+}
+
+function renderError(j, detail) {
+  resultBox.style.display = "block";
+  // Si trae errors estructurales, muéstralos
+  if (j.errors && Array.isArray(j.errors)) {
+    resultSummary.innerHTML = `<b style="color:crimson;">Estructura inválida:</b><br>${j.errors.map(escapeHtml).join("<br>")}`;
+  } else {
+    resultSummary.innerHTML = `
+      <b style="color:crimson;">Error:</b> ${escapeHtml(j.error || detail)}<br>
+      ${j.traceback ? "<pre style='white-space:pre-wrap; margin-top:10px;'>" + escapeHtml(j.traceback) + "</pre>" : ""}
+    `;
+  }
+}
+
+const sleep = (ms) => new Promise((res) => setTimeout(res, ms));
+
+// Sigue una importación en segundo plano hasta que termina (TERMINADO / ERROR)
+async function waitJob(job) {
+  while (job.estatus === "PENDIENTE" || job.estatus === "EN_PROCESO") {
+    const donde = job.hoja ? ` · hoja ${job.hoja}, fila ${job.fila}` : "";
+    setMsg(`Importando... ${job.progreso}% (${job.filas}/${job.filas_total ?? "?"} filas)${donde}`, false);
+    await sleep(1500);
+    const r = await fetch(`/api/catalogos/jobs/${encodeURIComponent(job.id)}`);
+    const j = await r.json().catch(() => ({}));
+    if (!r.ok) throw new Error(j.detail || "No fue posible consultar el avance.");
+    job = j;
+  }
+  return job;
+}
+
+function showJob(job) {
+  if (job.estatus === "TERMINADO") {
+    setMsg("Procesado correctamente.", false);
+    renderResult(job.resultado || {}, false);
+    return;
+  }
+
+  const res = job.resultado || {};
+  setMsg(job.error || res.message || "La importación falló.", true);
+  if (res.errors) {
+    renderError(res, job.error);
+    return;
+  }
+
+  // lo confirmado hasta el último lote ya está guardado; se puede continuar desde ahí
+  renderError({ error: job.error }, job.error);
+  if (job.summary) renderSummary(job.summary);
+  if (job.reanudable) {
+    const btn = document.createElement("button");
+    btn.className = "fx-btn fx-btn-sm";
+    btn.style.marginTop = "10px";
+    btn.textContent = `Reanudar desde hoja ${job.hoja ?? "-"}, fila ${job.fila ?? "-"}`;
+    btn.addEventListener("click", () => resumeJob(job.id));
+    resultSummary.appendChild(document.createElement("br"));
+    resultSummary.appendChild(btn);
+  }
+}
+
+async function runJob(start) {
+  btnUpload.disabled = true;
+  btnPreview.disabled = true;
+  try {
+    const r = await start();
+    const j = await r.json().catch(() => ({}));
+    if (!r.ok) {
+      const detail = j.detail || j.message || "Error al procesar.";
+      setMsg(detail, true);
+      renderError(j, detail);
+      return;
+    }
+    showJob(await waitJob(j));
+  } catch (e) {
+    setMsg(e.message || "Error inesperado.", true);
+  } finally {
+    btnUpload.disabled = false;
+    btnPreview.disabled = false;
+  }
+}
+
+function resumeJob(id) {
+  clearUI();
+  setMsg("Reanudando importación...", false);
+  return runJob(() => fetch(`/api/catalogos/jobs/${encodeURIComponent(id)}/reanudar`, { method: "POST" }));
+}
+
+async function uploadCatalogos(dryRun) {
   clearUI();
 
   if (!fileExcel.files || !fileExcel.files.length) {
@@ -97,47 +245,37 @@ btnUpload.addEventListener("click", async () => {
   const fd = new FormData();
   fd.append("file", f);
 
-  setMsg("Subiendo y procesando...", false);
+  // la carga real corre en segundo plano (commits por lotes, reanudable)
+  if (!dryRun) {
+    setMsg("Subiendo archivo...", false);
+    return runJob(() => fetch("/api/catalogos/upload?background=1", { method: "POST", body: fd }));
+  }
+
+  setMsg("Analizando cambios...", false);
   btnUpload.disabled = true;
+  btnPreview.disabled = true;
 
   try {
-    const r = await fetch("/api/catalogos/upload", { method: "POST", body: fd });
+    const r = await fetch("/api/catalogos/upload?dry_run=1", { method: "POST", body: fd });
     const j = await r.json().catch(() => ({}));
 
     if (!r.ok) {
       const detail = j.detail || j.message || "Error al procesar.";
       setMsg(detail, true);
-
-      // Si trae errors estructurales, muéstralos
-      if (j.errors && Array.isArray(j.errors)) {
-        resultBox.style.display = "block";
-        resultSummary.innerHTML = `<b style="color:crimson;">Estructura inválida:</b><br>${j.errors.map(escapeHtml).join("<br>")}`;
-      }else{
-         resultBox.style.display = "block";
-        resultSummary.innerHTML = `
-        <b style="color:crimson;">Error:</b> ${escapeHtml(j.error || detail)}<br>
-        ${j.traceback ? "<pre style='white-space:pre-wrap; margin-top:10px;'>" + escapeHtml(j.traceback) + "</pre>" : ""}
-        `;
-      }
+      renderError(j, detail);
       return;
     }
 
-    setMsg("Procesado correctamente.", false);
-
-    resultBox.style.display = "block";
-    resultSummary.innerHTML = `
-      <b>Archivo:</b> ${escapeHtml(j.file)}<br>
-      <b>Mensaje:</b> ${escapeHtml(j.message)}<br>
-      <b>Hojas procesadas:</b> ${escapeHtml(j.total_sheets)}
-    `;
-
-    renderSummary(j.summary);
-    renderRowErrors(j.row_errors);
-    renderNotes(j.notes);
+    setMsg("Vista previa: no se guardó ningún cambio.", false);
+    renderResult(j, true);
 
   } catch (e) {
     setMsg(e.message || "Error inesperado.", true);
   } finally {
     btnUpload.disabled = false;
+    btnPreview.disabled = false;
   }
-});
+}
+
+btnUpload.addEventListener("click", () => uploadCatalogos(false));
+btnPreview.addEventListener("click", () => uploadCatalogos(true));
@@ -513,6 +513,11 @@ async function au_submitEdit(e) {
 // --------------------- ALTA ---------------------
 let AU_LAST_VALID = null;
 
+// identifica el XML seleccionado: el ticket de /validar sólo vale para ese mismo archivo
+function au_fileKey(f) {
+  return f ? `${f.name}|${f.size}|${f.lastModified}` : "";
+}
+
 async function au_validarXML() {
   const f = au_qs("au_file")?.files?.[0];
   if (!f) return alert("Selecciona un XML.");
@@ -531,7 +536,7 @@ async function au_validarXML() {
 
   try {
     const res = await au_fetch("/api/cfdi/validar", { method: "POST", body: fd });
-    AU_LAST_VALID = res;
+    AU_LAST_VALID = { ...res, fileKey: au_fileKey(f) };
     // Si RFC catálogo OK, resolver proveedor por RFC y poblar campos
     const extracted = res?.extracted;
     const rfc = extracted?.rfc_emisor;
@@ -662,8 +667,10 @@ async function au_submitAlta(e) {
   fd.append("fecha_orden", au_qs("au_fecha_captura").value);
   fd.append("estatus_os", au_qs("au_estatus_os").value);
  
-  //info CFDI
-  fd.append("file", f);
+  //info CFDI: con el ticket de /validar no se vuelve a subir el XML
+  const ticket = AU_LAST_VALID?.fileKey === au_fileKey(f) ? AU_LAST_VALID?.ticket : null;
+  if (ticket) fd.append("ticket", ticket);
+  else fd.append("file", f);
   fd.append("proveedor_id", au_qs("au_proveedor_id").value);
   fd.append("fecha_recepcion", au_qs("au_fecha_captura").value);
   fd.append("monto_partida", au_qs("au_monto_partida").value || 0);
@@ -733,7 +740,16 @@ async function au_submitAlta(e) {
  
   try {
     
-    const res = await au_fetch("/api/cfdi/alta", { method: "POST", body: fd });
+    let res;
+    try {
+      res = await au_fetch("/api/cfdi/alta", { method: "POST", body: fd });
+    } catch (err) {
+      if (!err?.ticket_expired) throw err;
+      // ticket vencido: se reenvía el XML
+      fd.delete("ticket");
+      fd.append("file", f);
+      res = await au_fetch("/api/cfdi/alta", { method: "POST", body: fd });
+    }
     msg.textContent = res?.message;
     if(res.ok){
       alert("CFDI Registrado correctamente: "+res?.message)
@@ -750,6 +766,8 @@ async function au_submitAlta(e) {
 window.addEventListener("DOMContentLoaded", async () => {
   if (AU.isAlta()) {
     au_qs("au_btnValidar")?.addEventListener("click", au_validarXML);
+    // otro XML: la validación (y su ticket) ya no aplica
+    au_qs("au_file")?.addEventListener("change", () => { AU_LAST_VALID = null; });
     au_qs("au_altaForm")?.addEventListener("submit", au_submitAlta);
     await au_initAltaCatalogos();
     //await au_initEstadoOrden();
@@ -6,6 +6,8 @@
 const FL = {
     currentPage: 1,
     perPage: 50,
+    nextCursor: null,   // cursor para "Siguiente" (evita OFFSET en páginas profundas)
+    useCursor: false,
     filters: {},
     filtrosOpciones: {},
 };
@@ -160,12 +162,16 @@ async function fl_cargarFacturas() {
             per_page: FL.perPage,
         });
         
+        if (FL.useCursor && FL.nextCursor) params.append("after", FL.nextCursor);
+
         // Agregar filtros solo si tienen valor
         Object.entries(FL.filters).forEach(([key, value]) => {
             if (value) params.append(key, value);
         });
         
         const data = await fl_fetch(`/api/facturas-listado/lista?${params}`);
+        FL.nextCursor = data.next_cursor || null;
+        FL.useCursor = false;
         
         fl_show(loading, false);
         
@@ -197,12 +203,12 @@ function fl_renderTabla(items) {
     tbody.innerHTML = "";
    
     items.forEach(item => {
-        const badgeClass = fl_getBadgeClass(item.estatus_general);
+        const badgeClass = fl_getBadgeClass(item["ESTATUS GENERAL"]);
        
         const tr = document.createElement("tr");
         tr.innerHTML = `
             <td>${item.cfdi_id || "N/A"}</td>
-            <td>${fl_escape(item["ID"] || "").substring(0, 20)}...</td>
+            <td>${fl_escape(item["FOLIO FISCAL"] || "").substring(0, 20)}...</td>
             <td>
                 <div>${fl_escape(item["PROVEEDOR"] || "N/A")}</div>
                 <div class="fl_mono" style="font-size: 11px; color: #6c757d;">${fl_escape(item["RFC"] || "")}</div>
@@ -213,7 +219,7 @@ function fl_renderTabla(items) {
             <td>${fl_formatCurrency(item.monto_total)}</td>
             <td>${fl_formatDate(item["FECHA DE RECEPCION"])}</td>
             <td>
-                <span class="fl_badge ${badgeClass}">${fl_escape(item.estatus_general || "N/A")}</span>
+                <span class="fl_badge ${badgeClass}">${fl_escape(item["ESTATUS GENERAL"] || "N/A")}</span>
             </td>
         `;
         tbody.appendChild(tr);
@@ -226,7 +232,8 @@ function fl_renderPaginacion(data) {
     const inicio = ((data.page - 1) * data.per_page) + 1;
     const fin = Math.min(data.page * data.per_page, data.total);
     
-    info.textContent = `Mostrando ${inicio} - ${fin} de ${data.total} facturas`;
+    const total = data.total_approx ? `${data.total}+` : data.total;
+    info.textContent = `Mostrando ${inicio} - ${fin} de ${total} facturas`;
     
     // Botones de paginación
     controls.innerHTML = "";
@@ -261,11 +268,13 @@ function fl_renderPaginacion(data) {
     btnNext.className = "fl_page_btn";
     btnNext.textContent = "Siguiente »";
     btnNext.disabled = data.page >= data.total_pages;
-    btnNext.onclick = () => fl_cambiarPagina(data.page + 1);
+    btnNext.onclick = () => fl_cambiarPagina(data.page + 1, true);
     controls.appendChild(btnNext);
 }
 
-function fl_cambiarPagina(page) {
+function fl_cambiarPagina(page, siguiente = false) {
+    // "Siguiente" usa el cursor; los saltos a un número de página usan OFFSET
+    FL.useCursor = siguiente && !!FL.nextCursor;
     FL.currentPage = page;
     fl_cargarFacturas();
     window.scrollTo({ top: 0, behavior: 'smooth' });
@@ -288,10 +297,19 @@ async function fl_exportarExcel() {
         Object.entries(FL.filters).forEach(([key, value]) => {
             if (value) params.append(key, value);
         });
+        params.append("background", "true");
+        
+        // Se genera en segundo plano; se consulta el avance y al terminar se descarga
+        let job = await fl_fetch(`/api/facturas-listado/exportar-excel?${params}`);
+        while (job.estatus === "PENDIENTE" || job.estatus === "EN_PROCESO") {
+            btn.textContent = `Generando... ${job.progreso || 0}%`;
+            await new Promise(r => setTimeout(r, 1500));
+            job = await fl_fetch(`/api/export/jobs/${job.id}`);
+        }
+        if (job.estatus !== "TERMINADO") throw { detail: job.error || "La exportación no terminó" };
         
         // Descargar archivo
-        const url = `/api/facturas-listado/exportar-excel?${params}`;
-        window.location.href = url;
+        window.location.href = job.descarga;
         
         setTimeout(() => {
             btn.textContent = originalText;